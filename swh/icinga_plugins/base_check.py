@@ -3,47 +3,869 @@
 # License: GNU General Public License version 3, or any later version
 # See top-level LICENSE file for more information
 import atexit
-from typing import Any, Dict, List
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import dataclasses
+import json
+import logging
+import os
+import socket
+import sys
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from wsgiref.simple_server import WSGIServer
 
-from prometheus_client import CollectorRegistry, Gauge, Summary, write_to_textfile
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Summary,
+    start_http_server,
+)
+
+from .circuit import shared_circuit_breaker
+from .histogram import DEFAULT_BUCKETS, PersistentHistogram
+from .history import STATUS_CODES, HistoryStore, RollingQuantiles, quantile_name
+from .http_client import CheckSession, Deadline
+from .perfdata import PerfData, format_perfdata
+from .profiling import RunProfiler
+from .ratelimit import shared_rate_limiter
+from .state import load_json, lock_file, save_json, save_text
+from .textfile import DEFAULT_MAX_AGE, merge_textfile
+from .timing import RequestTiming
+from .tracing import Tracer
+from .usage import ResourceUsage, UsageStats
+
+logger = logging.getLogger(__name__)
+
+
+def _checkpoint_owner() -> Dict[str, Any]:
+    return {"host": socket.gethostname(), "pid": os.getpid()}
+
+
+def _owned_by_other_run(checkpoint: Dict[str, Any]) -> bool:
+    """Returns whether the job of ``checkpoint`` is still run by another process"""
+    owner = checkpoint.get("owner")
+    if not owner or owner == _checkpoint_owner():
+        return False
+    if owner.get("host") != socket.gethostname():
+        # processes of other hosts cannot be checked, until the job times out
+        return True
+    try:
+        os.kill(owner["pid"], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # running as another user
+        return True
+    return True
+
+
+@dataclasses.dataclass(frozen=True)
+class PreflightProbe:
+    """An endpoint probed before running a check"""
+
+    name: str
+    url: str
+    session: Optional[CheckSession] = None
+    """Session to send the probe with, instead of the one of the check"""
+    method: str = "HEAD"
+    error_status: int = 500
+    """The probe fails on status codes greater than or equal to this one"""
 
 
 class BaseCheck:
+    TYPE: str
+    """Name of the check, printed at the start of its results"""
     DEFAULT_WARNING_THRESHOLD = 60
     DEFAULT_CRITICAL_THRESHOLD = 120
+    DEFAULT_ADAPTIVE_WARNING_MARGIN = 0.25
+    DEFAULT_ADAPTIVE_CRITICAL_FACTOR = 1.5
+    DEFAULT_ADAPTIVE_MIN_SAMPLES = 30
+    DEFAULT_RATE_LIMIT_BURST = 5
+    DEFAULT_CIRCUIT_BREAKER_THRESHOLD = 3
+    DEADLINE_GRACE = 60
+    """Time (in seconds) given to checks after the critical threshold, to report
+    their timeout before reaching their deadline"""
+    DURATION_BUCKETS: Sequence[float] = DEFAULT_BUCKETS
+    """Upper bounds of the buckets of the histograms of durations"""
     PROMETHEUS_METRICS_BASENAME = "swh_e2e_"
+    HTTP_METRICS_LABELS: List[str] = []
+    """Labels of the HTTP metrics, before their own ones, whose values are
+    given by the ``on_http_retry_stat`` and ``on_http_request_timing``
+    callbacks of other checks (eg. sub-checks of a check), and are empty for
+    requests of the check itself"""
 
-    def __init__(self, obj: Dict[str, str], application: str):
+    def __init__(self, obj: Dict[str, Any], application: str):
         self.warning_threshold = float(
             obj.get("warning_threshold", self.DEFAULT_WARNING_THRESHOLD)
         )
         self.critical_threshold = float(
             obj.get("critical_threshold", self.DEFAULT_CRITICAL_THRESHOLD)
         )
+        self.adaptive_thresholds = bool(obj.get("adaptive_thresholds"))
+        self.adaptive_warning_margin = float(
+            obj.get("adaptive_warning_margin", self.DEFAULT_ADAPTIVE_WARNING_MARGIN)
+        )
+        self.adaptive_critical_factor = float(
+            obj.get("adaptive_critical_factor", self.DEFAULT_ADAPTIVE_CRITICAL_FACTOR)
+        )
+        self.adaptive_min_samples = int(
+            obj.get("adaptive_min_samples", self.DEFAULT_ADAPTIVE_MIN_SAMPLES)
+        )
+        self.perfdata_format: str = obj.get("perfdata_format", "legacy")
+        self.output_format: str = obj.get("output_format", "text")
+        self.output_spool_directory: Optional[str] = obj.get("output_spool_directory")
         self.prometheus_enabled = obj.get("prometheus_enabled")
         self.prometheus_exporter_directory = obj.get("prometheus_exporter_directory")
+        self.prometheus_max_age = float(obj.get("prometheus_max_age", DEFAULT_MAX_AGE))
+        port = obj.get("prometheus_http_port")
+        self.prometheus_http_port = int(port) if port is not None else None
+        self.prometheus_http_addr: str = obj.get("prometheus_http_addr", "0.0.0.0")
+        self.prometheus_http_server: Optional[WSGIServer] = None
         self.environment = obj.get("environment")
         self.application = application
+        self.state_directory: Optional[str] = obj.get("state_directory")
+        self.preflight_enabled = bool(obj.get("preflight"))
+        # Results of checks with the same key share the same history
+        self.history_key = application
 
         # A new registry is created to not export the default process metrics
         self.registry = CollectorRegistry()
 
         self.prometheus_metrics: Dict[str, Any] = {}
+        self.prometheus_histograms: Dict[str, PersistentHistogram] = {}
+
+        http_labels = self.HTTP_METRICS_LABELS
+        self.register_prometheus_counter("http_retries", "", http_labels)
+        self.register_prometheus_counter("http_throttled", "", http_labels)
+        self.register_prometheus_counter("http_backoff", "seconds", http_labels)
+        self.register_prometheus_counter("http_rate_limit_wait", "seconds", http_labels)
+        self.register_prometheus_counter(
+            "http_requests", "", http_labels + ["endpoint", "method", "status_code"]
+        )
+        self.register_prometheus_counter(
+            "http_phase_duration", "seconds", http_labels + ["endpoint", "phase"]
+        )
+        self.register_prometheus_counter(
+            "http_server_timing", "seconds", http_labels + ["endpoint", "metric"]
+        )
+        self.register_prometheus_gauge(
+            "duration_quantile", "seconds", ["metric", "quantile"]
+        )
+        self.register_prometheus_gauge("threshold", "seconds", ["metric", "level"])
+        self.register_prometheus_gauge("circuit_open", "", ["backend"])
+        self.register_prometheus_gauge("endpoint_up", "", ["endpoint"])
+        # Only exported while the check runs with the HTTP exporter
+        self.register_prometheus_gauge("progress_elapsed", "seconds")
+        self.register_prometheus_gauge("progress_state", "", ["state"])
+        self.register_prometheus_gauge("profile_cpu_time", "seconds")
+        self.register_prometheus_gauge("profile_memory_peak", "bytes")
+        self.register_prometheus_gauge("usage_cpu_user", "seconds")
+        self.register_prometheus_gauge("usage_cpu_system", "seconds")
+        self.register_prometheus_gauge("usage_max_rss", "bytes")
+        self.register_prometheus_gauge("usage_http_requests", "")
+        self.register_prometheus_gauge("usage_http_sent", "bytes")
+        self.register_prometheus_gauge("usage_http_received", "bytes")
+        self.register_prometheus_gauge("usage_polls", "")
+        self._progress_state: Optional[str] = None
+        # Thresholds the metrics were compared to, and total duration of each
+        # phase of the HTTP requests, for the performance data
+        self._thresholds: Dict[str, Tuple[float, float]] = {}
+        self._http_phase_times: Dict[str, float] = {}
+        self._start_usage: Optional[ResourceUsage] = None
+        # Identifiers of the objects the check worked on (eg. the id of a
+        # deposit), and the error which aborted it, for JSON results
+        self.identifiers: Dict[str, Any] = {}
+        self._exception: Optional[str] = None
+        # Results of the running check, printed once it ends
+        self._results: Optional[List[Tuple[str, str, Dict[str, Any]]]] = None
+
+        # Time budget of the check, after which its HTTP calls are aborted
+        deadline = obj.get("deadline")
+        budget = float(deadline) if deadline is not None else None
+        if budget is None and self.critical_threshold:
+            budget = self.critical_threshold + self.DEADLINE_GRACE
+        self.deadline = Deadline(budget) if budget is not None else None
+
+        # Limits the rate of the requests of all checks of the process, and of
+        # all processes sharing the state directory, to each backend
+        rate_limiter = None
+        if obj.get("rate_limit"):
+            rate_limiter = shared_rate_limiter(
+                float(obj["rate_limit"]),
+                float(obj.get("rate_limit_burst", self.DEFAULT_RATE_LIMIT_BURST)),
+                (
+                    os.path.join(self.state_directory, "ratelimit")
+                    if self.state_directory is not None
+                    else None
+                ),
+            )
+
+        # Stops checks early when their backends are down, across runs
+        self.circuit_breaker = None
+        threshold = int(
+            obj.get("circuit_breaker_threshold", self.DEFAULT_CIRCUIT_BREAKER_THRESHOLD)
+        )
+        if self.state_directory is not None and threshold > 0:
+            self.circuit_breaker = shared_circuit_breaker(
+                os.path.join(self.state_directory, "circuits"), threshold
+            )
+
+        # Checks run by another check (eg. MultiDepositCheck) share its trace
+        # and its counts of requests and polls
+        self.usage: UsageStats = obj.get("usage") or UsageStats()
+        self.tracer: Tracer = obj.get("tracer") or Tracer(
+            {
+                "service.name": "swh-icinga-plugins",
+                "deployment.environment": self.environment,
+                "swh.check.application": application,
+            }
+        )
+        self.trace_file: Optional[str] = obj.get("trace_file")
+        self.trace_endpoint: Optional[str] = obj.get("trace_endpoint")
+        self.profile_enabled = bool(obj.get("profile"))
+        self.trace_memory_enabled = bool(obj.get("trace_memory"))
+        self.profile_directory: Optional[str] = obj.get("profile_directory")
+
+        # Session to use for all HTTP calls of the check
+        # HTTP metrics are collected by another check if it gave its callbacks
+        self.session = CheckSession(
+            on_retry_stat=obj.get("on_http_retry_stat", self._on_http_retry_stat),
+            deadline=self.deadline,
+            rate_limiter=rate_limiter,
+            circuit_breaker=self.circuit_breaker,
+            on_request_timing=obj.get(
+                "on_http_request_timing", self._on_http_request_timing
+            ),
+            tracer=self.tracer,
+            usage=self.usage,
+        )
 
         atexit.register(self.save_prometheus_metrics)
 
-    def get_status(self, value):
-        if self.critical_threshold and value >= self.critical_threshold:
+    def _on_http_retry_stat(
+        self, name: str, amount: float, labels: Optional[List[str]] = None
+    ) -> None:
+        counter = {
+            "retries": "http_retries",
+            "throttled": "http_throttled",
+            "backoff_time": "http_backoff",
+            "rate_limit_time": "http_rate_limit_wait",
+        }[name]
+        self.increment_prometheus_metric(counter, amount, self._http_labels(labels))
+
+    def _on_http_request_timing(
+        self, timing: RequestTiming, labels: Optional[List[str]] = None
+    ) -> None:
+        logger.debug("%s %s: %s", timing.method, timing.endpoint, timing)
+        labels = self._http_labels(labels)
+        self.increment_prometheus_metric(
+            "http_requests",
+            labels=labels + [timing.endpoint, timing.method, str(timing.status_code)],
+        )
+        for phase, duration in timing.phases().items():
+            self.increment_prometheus_metric(
+                "http_phase_duration", duration, labels + [timing.endpoint, phase]
+            )
+            self._http_phase_times[phase] = (
+                self._http_phase_times.get(phase, 0.0) + duration
+            )
+        for metric, duration in timing.server_timing.items():
+            self.increment_prometheus_metric(
+                "http_server_timing", duration, labels + [timing.endpoint, metric]
+            )
+
+    def _http_labels(self, labels: Optional[List[str]]) -> List[str]:
+        if labels is None:
+            return [""] * len(self.HTTP_METRICS_LABELS)
+        return labels
+
+    def load_state(self, name: str) -> Dict[str, Any]:
+        """Loads the ``name`` JSON document saved in the state directory by a
+        previous run, or an empty dict if there is none."""
+        if self.state_directory is None:
+            return {}
+        return load_json(os.path.join(self.state_directory, name + ".json"))
+
+    def save_state(self, name: str, state: Dict[str, Any]) -> None:
+        """Atomically saves ``state`` as the ``name`` JSON document of the state
+        directory, if any, for the next runs."""
+        if self.state_directory is None:
+            return
+        save_json(os.path.join(self.state_directory, name + ".json"), state)
+
+    @contextlib.contextmanager
+    def lock_state(self, name: str) -> Iterator[None]:
+        """Locks the ``name`` JSON document of the state directory, if any, while
+        it is loaded, updated and saved, against concurrent runs of checks."""
+        if self.state_directory is None:
+            yield
+            return
+        with lock_file(os.path.join(self.state_directory, name + ".lock")):
+            yield
+
+    def delete_state(self, name: str) -> None:
+        """Deletes the ``name`` JSON document of the state directory, if any"""
+        if self.state_directory is None:
+            return
+        try:
+            os.unlink(os.path.join(self.state_directory, name + ".json"))
+        except FileNotFoundError:
+            pass
+
+    @property
+    def checkpoint_key(self) -> str:
+        """Identifies the jobs which runs of the check can resume: runs of other
+        variants of the check (eg. with other arguments) must use another key"""
+        return self.history_key
+
+    @property
+    def _checkpoint_state_name(self) -> str:
+        return f"checkpoint-{self.environment or 'default'}-{self.checkpoint_key}"
+
+    def load_checkpoint(self) -> Optional[Dict[str, Any]]:
+        """Returns the state of the job of a previous run, saved by
+        :meth:`save_checkpoint`, if that run was interrupted before the end of
+        the job, and the job did not time out since.
+
+        Jobs of runs which are still running are not resumed, so they are not
+        polled and reported twice. Resumed jobs are owned by this run."""
+        name = self._checkpoint_state_name
+        with self.lock_state(name):
+            checkpoint = self.load_state(name)
+            if not checkpoint:
+                return None
+            if (
+                self.critical_threshold
+                and time.time() - checkpoint["start_time"] > self.critical_threshold
+            ):
+                self.delete_state(name)
+                return None
+            if _owned_by_other_run(checkpoint):
+                logger.info(
+                    "Not resuming the job started at %s, still run by %s",
+                    checkpoint["start_time"],
+                    checkpoint["owner"],
+                )
+                return None
+            checkpoint["owner"] = _checkpoint_owner()
+            self.save_state(name, checkpoint)
+        logger.info("Resuming the job started at %s", checkpoint["start_time"])
+        return checkpoint
+
+    def save_checkpoint(self, checkpoint: Dict[str, Any]) -> None:
+        """Saves the state of the job of the check, including its ``start_time``,
+        so the next run can resume it if this one is interrupted."""
+        name = self._checkpoint_state_name
+        with self.lock_state(name):
+            self.save_state(name, {**checkpoint, "owner": _checkpoint_owner()})
+
+    def clear_checkpoint(self) -> None:
+        """Forgets the job of the check, once it ended, unless another run
+        started a job since"""
+        name = self._checkpoint_state_name
+        with self.lock_state(name):
+            if not _owned_by_other_run(self.load_state(name)):
+                self.delete_state(name)
+
+    @property
+    def _histograms_state_name(self) -> str:
+        return f"histograms-{self.environment or 'default'}-{self.history_key}"
+
+    @property
+    def _quantiles_state_name(self) -> str:
+        return f"quantiles-{self.environment or 'default'}-{self.history_key}"
+
+    def record_history(
+        self, status_type: str, metrics: Dict[str, Any]
+    ) -> Dict[str, float]:
+        """Appends the durations in ``metrics`` to the history of the check, and
+        updates the estimated quantiles of their recent values.
+
+        The time spent waiting before retries and for the rate limiter is
+        recorded in its own metrics, and not in ``total_time``, so throttling
+        by the checks themselves does not skew their adaptive thresholds.
+
+        Quantiles of all durations are exported to Prometheus, and those of
+        ``total_time`` are returned as metrics to print."""
+        if self.state_directory is None:
+            return {}
+        environment = self.environment or "default"
+        store = HistoryStore(
+            os.path.join(self.state_directory, "history", environment, self.history_key)
+        )
+        status = STATUS_CODES.get(status_type, STATUS_CODES["UNKNOWN"])
+        wait_time = sum(
+            metrics.get(name, 0.0)
+            for name in ("http_backoff_time", "http_rate_limit_time")
+        )
+        quantile_metrics = {}
+        # concurrent runs of the check would lose the updates of each other's
+        # sketches, and append records out of order
+        with self.lock_state(self._quantiles_state_name):
+            state = self.load_state(self._quantiles_state_name)
+            now = time.time()
+            for metric_name, metric_value in metrics.items():
+                if not isinstance(metric_value, float):
+                    # only durations are recorded, not counts
+                    continue
+                if metric_name == "total_time":
+                    metric_value = max(0.0, metric_value - wait_time)
+                store.append(metric_name, now, metric_value, status)
+
+                if metric_name in state:
+                    rolling = RollingQuantiles.from_dict(state[metric_name])
+                else:
+                    rolling = RollingQuantiles()
+                rolling.add(metric_value)
+                state[metric_name] = rolling.to_dict()
+
+                for q, value in rolling.quantiles().items():
+                    self.collect_prometheus_metric(
+                        "duration_quantile", value, [metric_name, quantile_name(q)]
+                    )
+                    if metric_name == "total_time":
+                        quantile_metrics[f"total_time_{quantile_name(q)}"] = value
+
+            self.save_state(self._quantiles_state_name, state)
+        return quantile_metrics
+
+    def main(self) -> int:
+        """Runs the check, prints its result and returns its status code"""
+        raise NotImplementedError()
+
+    def preflight_probes(self) -> List[PreflightProbe]:
+        """Returns the endpoints the check needs"""
+        return []
+
+    def preflight(self) -> Optional[int]:
+        """Probes all endpoints the check needs concurrently, and reports a
+        critical status if any of them failed.
+
+        Returns:
+            the status code of the check if it must stop, else :const:`None`
+        """
+        probes = self.preflight_probes()
+        if not probes:
+            return None
+
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=len(probes)) as executor:
+            errors = list(
+                executor.map(
+                    lambda probe: (probe.session or self.session).probe(
+                        probe.url, probe.method, probe.error_status
+                    ),
+                    probes,
+                )
+            )
+        preflight_time = time.time() - start_time
+
+        failures = []
+        for probe, error in zip(probes, errors):
+            self.collect_prometheus_metric(
+                "endpoint_up", 0 if error else 1, [probe.name]
+            )
+            if error:
+                failures.append(f"{probe.name} ({probe.url}) failed with {error}")
+        if not failures:
+            return None
+
+        self.print_result(
+            "CRITICAL",
+            f"Pre-flight probe of {'; '.join(failures)}.",
+            preflight_time=preflight_time,
+        )
+        if self.PROMETHEUS_METRICS_BASENAME + "status" in self.prometheus_metrics:
+            self.collect_prometheus_metric("status", 2)
+        return 2
+
+    def start_prometheus_http_server(self) -> None:
+        """Serves the metrics of the check over HTTP while it runs, with the time
+        elapsed since it started, if the HTTP exporter is enabled."""
+        if self.prometheus_http_port is None:
+            return
+        (self.prometheus_http_server, _) = start_http_server(
+            self.prometheus_http_port, self.prometheus_http_addr, self.registry
+        )
+        start_time = time.time()
+        gauge = self.prometheus_metrics[
+            self.PROMETHEUS_METRICS_BASENAME + "progress_elapsed"
+        ]
+        gauge.labels(*self._get_label_values([])).set_function(
+            lambda: time.time() - start_time
+        )
+
+    def stop_prometheus_http_server(self) -> None:
+        if self.prometheus_http_server is None:
+            return
+        self.prometheus_http_server.shutdown()
+        self.prometheus_http_server.server_close()
+        self.prometheus_http_server = None
+        # the progress of the check is not exported to the textfile
+        for name in ("progress_elapsed", "progress_state"):
+            self.prometheus_metrics[self.PROMETHEUS_METRICS_BASENAME + name].clear()
+        self._progress_state = None
+
+    def report_progress(self, state: str) -> None:
+        """Exports the current state of the scenario of the check (eg. the
+        status of the job it polls) to the HTTP exporter"""
+        if self.prometheus_http_server is None or state == self._progress_state:
+            return
+        gauge = self.prometheus_metrics[
+            self.PROMETHEUS_METRICS_BASENAME + "progress_state"
+        ]
+        if self._progress_state is not None:
+            gauge.remove(*self._get_label_values([self._progress_state]))
+        gauge.labels(*self._get_label_values([state])).set(1)
+        self._progress_state = state
+
+    def run(self) -> int:
+        """Runs the check, and reports a critical status instead of an error when
+        it was aborted because an endpoint or backend is down, or its deadline
+        expired."""
+        self._start_usage = start_usage = ResourceUsage.current()
+        self.start_prometheus_http_server()
+        try:
+            with self.tracer.span(
+                f"check {self.application}", attributes={"check.key": self.history_key}
+            ) as span:
+                try:
+                    status = self._run()
+                finally:
+                    self.tracer.end_phase()
+                span.set_attribute("check.status_code", status)
+                if status >= STATUS_CODES["CRITICAL"]:
+                    span.set_error(f"check exited with status code {status}")
+                return status
+        finally:
+            self.collect_circuit_metrics()
+            self.collect_usage_metrics(start_usage)
+            self.stop_prometheus_http_server()
+            if self.trace_file is not None or self.trace_endpoint is not None:
+                self.tracer.export(self.trace_file, self.trace_endpoint)
+
+    def collect_circuit_metrics(self) -> None:
+        """Exports whether the circuit of each backend the check sent requests
+        to was open"""
+        if self.circuit_breaker is None:
+            return
+        for backend in sorted(self.circuit_breaker.backends):
+            self.collect_prometheus_metric(
+                "circuit_open",
+                int(self.circuit_breaker.is_rejected(backend)),
+                [backend],
+            )
+
+    def collect_usage_metrics(self, start: ResourceUsage) -> None:
+        """Exports the resources used by the check since ``start``"""
+        usage = ResourceUsage.current().since(start)
+        self.collect_prometheus_metric("usage_cpu_user", usage.cpu_user)
+        self.collect_prometheus_metric("usage_cpu_system", usage.cpu_system)
+        self.collect_prometheus_metric("usage_max_rss", usage.max_rss)
+        self.collect_prometheus_metric("usage_http_requests", self.usage.http_requests)
+        self.collect_prometheus_metric("usage_http_sent", self.usage.http_bytes_sent)
+        self.collect_prometheus_metric(
+            "usage_http_received", self.usage.http_bytes_received
+        )
+        self.collect_prometheus_metric("usage_polls", self.usage.polls)
+
+    @contextlib.contextmanager
+    def profiled(self) -> Iterator[None]:
+        """Profiles the CPU and/or memory usage of the block if enabled, writes
+        the profiles to the profile directory, and exports the CPU time and
+        peak memory."""
+        if not (self.profile_enabled or self.trace_memory_enabled):
+            yield
+            return
+
+        assert self.profile_directory is not None
+        profiler = RunProfiler(
+            self.profile_directory,
+            self.history_key,
+            cpu=self.profile_enabled,
+            memory=self.trace_memory_enabled,
+        )
+        try:
+            with profiler.profile():
+                yield
+        finally:
+            assert profiler.cpu_time is not None
+            self.collect_prometheus_metric("profile_cpu_time", profiler.cpu_time)
+            if profiler.peak_memory is not None:
+                self.collect_prometheus_metric(
+                    "profile_memory_peak", profiler.peak_memory
+                )
+
+    def start_phase(self, name: str) -> None:
+        """Starts the ``name`` phase of the scenario of the check in its trace,
+        ending the previous one"""
+        self.tracer.start_phase(name)
+
+    def _run(self) -> int:
+        # a check may print several results (eg. the deposit and the update of
+        # its metadata), only the final one is recorded in the history
+        self._results = []
+        crash: Optional[Tuple[str, str, Dict[str, Any]]] = None
+        try:
+            return self._run_check()
+        except Exception as e:
+            # the error is raised again for its traceback, but JSON results
+            # report it too
+            self._exception = f"{type(e).__name__}: {e}"
+            crash = ("UNKNOWN", f"Check failed with {self._exception}", {})
+            raise
+        finally:
+            (results, self._results) = (self._results, None)
+            if results or crash:
+                self._print_results(results or [], crash)
+
+    def _run_check(self) -> int:
+        if self.preflight_enabled:
+            self.start_phase("preflight")
+            status = self.preflight()
+            if status is not None:
+                return status
+
+        try:
+            with self.profiled():
+                return self.main()
+        except Exception as e:
+            rejected = self.circuit_breaker and self.circuit_breaker.rejected
+            if rejected:
+                message = f"Check aborted, {rejected}"
+            elif self.deadline is not None and self.deadline.expired:
+                message = (
+                    f"Check did not complete within {self.deadline.budget:.2f}s: {e}"
+                )
+            else:
+                raise
+
+            self._exception = f"{type(e).__name__}: {e}"
+            metrics = {}
+            if self.deadline is not None:
+                metrics["total_time"] = self.deadline.elapsed
+            self.print_result("CRITICAL", message, **metrics)
+            if self.PROMETHEUS_METRICS_BASENAME + "status" in self.prometheus_metrics:
+                self.collect_prometheus_metric("status", 2)
+            return 2
+
+    def get_adaptive_thresholds(self, metric: str) -> Optional[Tuple[float, float]]:
+        """Returns the warning and critical thresholds of ``metric`` derived from
+        the quantiles of its recent values, or :const:`None` if there are not
+        enough of them.
+
+        The warning threshold is the p95 increased by a margin, and the critical
+        one the p99 multiplied by a factor, but not above the static critical
+        threshold, which also bounds the time checks wait for."""
+        if self.state_directory is None:
+            return None
+        state = self.load_state(self._quantiles_state_name).get(metric)
+        if state is None:
+            return None
+        rolling = RollingQuantiles.from_dict(state)
+        if rolling.count < self.adaptive_min_samples:
+            return None
+        quantiles = rolling.quantiles()
+
+        critical = quantiles[0.99] * self.adaptive_critical_factor
+        if self.critical_threshold:
+            critical = min(critical, self.critical_threshold)
+        warning = min(quantiles[0.95] * (1 + self.adaptive_warning_margin), critical)
+        return (warning, critical)
+
+    def get_status(self, value, metric: str = "total_time"):
+        warning_threshold = self.warning_threshold
+        critical_threshold = self.critical_threshold
+        if self.adaptive_thresholds:
+            thresholds = self.get_adaptive_thresholds(metric)
+            if thresholds is not None:
+                (warning_threshold, critical_threshold) = thresholds
+                self.collect_prometheus_metric(
+                    "threshold", warning_threshold, [metric, "warning"]
+                )
+                self.collect_prometheus_metric(
+                    "threshold", critical_threshold, [metric, "critical"]
+                )
+        self._thresholds[metric] = (warning_threshold, critical_threshold)
+
+        if critical_threshold and value >= critical_threshold:
             return (2, "CRITICAL")
-        elif self.warning_threshold and value >= self.warning_threshold:
+        elif warning_threshold and value >= warning_threshold:
             return (1, "WARNING")
         else:
             return (0, "OK")
 
     def print_result(self, status_type, status_string, **metrics):
+        retry_stats = self.session.retry_stats
+        if retry_stats.retries or retry_stats.throttled:
+            metrics["http_retries"] = retry_stats.retries
+            metrics["http_throttled"] = retry_stats.throttled
+            metrics["http_backoff_time"] = retry_stats.backoff_time
+        if retry_stats.rate_limit_time:
+            metrics["http_rate_limit_time"] = retry_stats.rate_limit_time
+        if self._results is not None:
+            # the check is running, its results are printed once it ends
+            self._results.append((status_type, status_string, metrics))
+        else:
+            self._print_results([(status_type, status_string, metrics)])
+
+    def _print_results(
+        self,
+        results: List[Tuple[str, str, Dict[str, Any]]],
+        crash: Optional[Tuple[str, str, Dict[str, Any]]] = None,
+    ) -> None:
+        """Records the metrics of the final result of the check (``crash`` if
+        it crashed, else the last of ``results``) in its history, and prints
+        all ``results`` as text, or the final one as a JSON document."""
+        (status_type, status_string, metrics) = crash or results[-1]
+        metrics.update(self.record_history(status_type, metrics))
+        if self.output_format == "json" or self.output_spool_directory is not None:
+            self.write_result_document(
+                self.result_document(status_type, status_string, metrics)
+            )
+        if self.output_format == "json":
+            return
+        for status_type, status_string, metrics in results:
+            self._print_result(status_type, status_string, metrics)
+
+    def _print_result(
+        self, status_type: str, status_string: str, metrics: Dict[str, Any]
+    ) -> None:
+        if self.perfdata_format == "standard":
+            perfdata = format_perfdata(self.perfdata(metrics))
+            print(f"{self.TYPE} {status_type} - {status_string} | {perfdata}")
+            return
+
         print(f"{self.TYPE} {status_type} - {status_string}")
         for metric_name, metric_value in sorted(metrics.items()):
-            print(f"| '{metric_name}' = {metric_value:.2f}s")
+            if isinstance(metric_value, int):
+                # counts, while all other metrics are durations
+                print(f"| '{metric_name}' = {metric_value}")
+            else:
+                print(f"| '{metric_name}' = {metric_value:.2f}s")
+
+    def _metric_thresholds(
+        self, metric: str
+    ) -> Tuple[Optional[float], Optional[float]]:
+        """Returns the warning and critical thresholds ``metric`` was compared
+        to, if any"""
+        thresholds = self._thresholds.get(metric)
+        if thresholds is None and metric == "total_time":
+            thresholds = (self.warning_threshold, self.critical_threshold)
+        (warning, critical) = thresholds or (None, None)
+        # null thresholds are disabled
+        return (warning or None, critical or None)
+
+    def _resource_usage(self) -> Optional[ResourceUsage]:
+        if self._start_usage is None:
+            return None
+        return ResourceUsage.current().since(self._start_usage)
+
+    def result_document(
+        self, status_type: str, status_string: str, metrics: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Returns the result of the check as a JSON document, with the details
+        of its run"""
+        usage = self.usage
+        resources = self._resource_usage()
+        error = None
+        if STATUS_CODES.get(status_type, STATUS_CODES["UNKNOWN"]) >= 2:
+            error = {"message": status_string, "exception": self._exception}
+        return {
+            "check": self.TYPE,
+            "application": self.application,
+            "environment": self.environment,
+            "instance": self.history_key,
+            "time": time.time(),
+            "status": status_type,
+            "status_code": STATUS_CODES.get(status_type, STATUS_CODES["UNKNOWN"]),
+            "message": status_string,
+            "identifiers": self.identifiers,
+            "metrics": metrics,
+            "thresholds": {
+                metric: dict(
+                    zip(("warning", "critical"), self._metric_thresholds(metric))
+                )
+                for metric in sorted(metrics)
+                if metric in self._thresholds or metric == "total_time"
+            },
+            "phases": self.tracer.phase_durations(),
+            "http": {
+                "requests": usage.http_requests,
+                "bytes_sent": usage.http_bytes_sent,
+                "bytes_received": usage.http_bytes_received,
+                **dataclasses.asdict(self.session.retry_stats),
+                "phase_times": dict(self._http_phase_times),
+            },
+            "usage": {
+                "polls": usage.polls,
+                **(dataclasses.asdict(resources) if resources is not None else {}),
+            },
+            "trace_id": self.tracer.trace_id,
+            "error": error,
+        }
+
+    def write_result_document(self, document: Dict[str, Any]) -> None:
+        """Writes ``document`` to the spool directory if any, and to the
+        standard output if JSON results are enabled. Both are written in a
+        single operation, so readers never get partial documents."""
+        text = json.dumps(document) + "\n"
+        if self.output_spool_directory is not None:
+            timestamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(document["time"]))
+            save_text(
+                os.path.join(
+                    self.output_spool_directory,
+                    f"{self.history_key}-{timestamp}-{os.getpid()}.json",
+                ),
+                text,
+            )
+        if self.output_format == "json":
+            sys.stdout.write(text)
+            sys.stdout.flush()
+
+    def perfdata(self, metrics: Dict[str, Any]) -> List[PerfData]:
+        """Returns the performance data of ``metrics``, with the thresholds they
+        were compared to, followed by the total duration of each phase of the
+        check and of its HTTP requests, and the resources it used so far."""
+        perfdata = []
+        for metric_name, metric_value in sorted(metrics.items()):
+            if isinstance(metric_value, int):
+                perfdata.append(PerfData(metric_name, metric_value, min=0))
+                continue
+            (warning, critical) = self._metric_thresholds(metric_name)
+            perfdata.append(
+                PerfData(
+                    metric_name,
+                    metric_value,
+                    "s",
+                    warn=warning,
+                    crit=critical,
+                    min=0,
+                )
+            )
+
+        for phase, duration in self.tracer.phase_durations().items():
+            perfdata.append(PerfData(f"phase_{phase}_time", duration, "s", min=0))
+        for phase, duration in self._http_phase_times.items():
+            perfdata.append(PerfData(f"http_{phase}_time", duration, "s", min=0))
+
+        usage = self.usage
+        perfdata += [
+            PerfData("usage_http_requests", usage.http_requests, min=0),
+            PerfData("usage_http_sent", usage.http_bytes_sent, "B", min=0),
+            PerfData("usage_http_received", usage.http_bytes_received, "B", min=0),
+            PerfData("usage_polls", usage.polls, min=0),
+        ]
+        resources = self._resource_usage()
+        if resources is not None:
+            perfdata += [
+                PerfData("usage_cpu_user", resources.cpu_user, "s", min=0),
+                PerfData("usage_cpu_system", resources.cpu_system, "s", min=0),
+                PerfData("usage_max_rss", resources.max_rss, "B", min=0),
+            ]
+        return perfdata
 
     def collect_prometheus_metric(
         self, name: str, value: float, labels: List[str] = []
@@ -55,6 +877,36 @@ class BaseCheck:
 
         g.labels(*self._get_label_values(labels)).set(value)
 
+        histogram = self.prometheus_histograms.get(
+            self.PROMETHEUS_METRICS_BASENAME + name
+        )
+        if histogram is not None:
+            histogram.observe(self._get_label_values(labels), value)
+
+    def merge_histograms_state(self) -> None:
+        """Adds the observations of previous runs kept in the state directory to
+        the histograms of this run, and saves them all for the next runs."""
+        if self.state_directory is None or not self.prometheus_histograms:
+            return
+        # reloaded right before saving, as concurrent runs of the check may
+        # have added observations since this one started
+        with self.lock_state(self._histograms_state_name):
+            state = self.load_state(self._histograms_state_name)
+            for histogram in self.prometheus_histograms.values():
+                histogram.merge(state.get(histogram.name, {}))
+                state[histogram.name] = histogram.to_dict()
+            self.save_state(self._histograms_state_name, state)
+
+    def increment_prometheus_metric(
+        self, name: str, amount: float = 1, labels: List[str] = []
+    ):
+        c = self.prometheus_metrics.get(self.PROMETHEUS_METRICS_BASENAME + name)
+
+        if c is None:
+            raise ValueError(f"No metric {name} found")
+
+        c.labels(*self._get_label_values(labels)).inc(amount)
+
     def _get_label_values(self, labels: List[str]) -> List[str]:
         label_list = []
 
@@ -92,8 +944,15 @@ class BaseCheck:
         )
 
     def register_prometheus_gauge(
-        self, name: str, unit: str, labels: List[str] = []
+        self,
+        name: str,
+        unit: str,
+        labels: List[str] = [],
+        buckets: Optional[Sequence[float]] = None,
     ) -> None:
+        """Registers a gauge. If ``buckets`` are given, the values of the gauge
+        are also observed by a ``<name>_histogram`` histogram, which
+        accumulates them across runs if there is a state directory."""
         full_name = self.PROMETHEUS_METRICS_BASENAME + name
 
         self.prometheus_metrics[full_name] = Gauge(
@@ -103,6 +962,27 @@ class BaseCheck:
             unit=unit,
             labelnames=self._get_label_names(labels),
         )
+        if buckets is not None:
+            self.prometheus_histograms[full_name] = PersistentHistogram(
+                full_name + "_histogram",
+                unit,
+                self._get_label_names(labels),
+                buckets,
+                registry=self.registry,
+            )
+
+    def register_prometheus_counter(
+        self, name: str, unit: str, labels: List[str] = []
+    ) -> None:
+        full_name = self.PROMETHEUS_METRICS_BASENAME + name
+
+        self.prometheus_metrics[full_name] = Counter(
+            name=full_name,
+            documentation="",
+            registry=self.registry,
+            unit=unit,
+            labelnames=self._get_label_names(labels),
+        )
 
     def save_prometheus_metrics(self) -> None:
         """Dump on disk the .prom file containing the
@@ -113,7 +993,15 @@ class BaseCheck:
         if self.prometheus_enabled:
             assert self.prometheus_exporter_directory is not None
 
+            self.merge_histograms_state()
             filename = (
                 self.prometheus_exporter_directory + "/" + self.application + ".prom"
             )
-            write_to_textfile(filename, self.registry)
+            # concurrent checks of the same application share its textfile,
+            # their series are told apart by this label
+            merge_textfile(
+                filename,
+                self.registry,
+                {"check_instance": self.history_key},
+                max_age=self.prometheus_max_age,
+            )
@@ -0,0 +1,127 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Circuit breakers stopping checks early when their backend is down."""
+
+import functools
+import logging
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, Optional, Set
+from urllib.parse import urlsplit
+
+from .state import load_json, lock_file, save_json
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpen(Exception):
+    """Raised instead of sending a request to a backend considered down"""
+
+    def __init__(self, backend: str, message: str):
+        super().__init__(message)
+        self.backend = backend
+
+
+class CircuitBreaker:
+    """Circuit breaker of each backend host, persisted in ``directory`` so it
+    spans all runs of all checks.
+
+    The circuit of a backend opens after ``threshold`` consecutive failed
+    requests (connection errors, timeouts or server errors, after retries).
+    While it is open, the first request of a process to the backend is
+    preceded by a cheap health probe: if the probe fails, that request and all
+    the following ones to the backend raise :exc:`CircuitOpen`, else they are
+    sent, and the circuit closes on the first successful one.
+    """
+
+    def __init__(self, directory: str, threshold: int):
+        self.directory = directory
+        self.threshold = threshold
+        self.rejected: Optional[CircuitOpen] = None
+        """The first rejection of a request, if any"""
+        self.backends: Set[str] = set()
+        """Backends requests were sent to, or rejected"""
+        self._probed: Set[str] = set()
+        self._rejections: Dict[str, CircuitOpen] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, backend: str) -> str:
+        return os.path.join(self.directory, re.sub(r"[^\w.-]", "_", backend) + ".json")
+
+    def before_request(self, url: str, probe: Callable[[str], Optional[str]]) -> None:
+        """Checks a request can be sent to ``url``.
+
+        Args:
+            probe: called with ``url`` if the circuit of its backend is open;
+              returns :const:`None` if the backend is healthy, else the reason
+              why it is not
+
+        Raises:
+            CircuitOpen: if the circuit is open and the probe failed
+        """
+        backend = urlsplit(url).netloc
+        with self._lock:
+            self.backends.add(backend)
+            if backend in self._rejections:
+                raise self._rejections[backend]
+            if backend in self._probed:
+                return
+            state = load_json(self._path(backend))
+            failures = state.get("failures", 0)
+            if failures < self.threshold:
+                return
+
+            self._probed.add(backend)
+            error = probe(url)
+            if error is None:
+                logger.info("Circuit of %s is open, but its probe succeeded", backend)
+                return
+
+            rejection = CircuitOpen(
+                backend,
+                f"{backend} is down: {failures} consecutive requests failed "
+                f"and its health probe failed with {error}",
+            )
+            self._rejections[backend] = rejection
+            if self.rejected is None:
+                self.rejected = rejection
+            raise rejection
+
+    def is_rejected(self, backend: str) -> bool:
+        """Returns whether requests to ``backend`` were rejected because its
+        circuit is open"""
+        return backend in self._rejections
+
+    def record(self, url: str, failed: bool) -> None:
+        """Records the outcome of a request to ``url``"""
+        backend = urlsplit(url).netloc
+        path = self._path(backend)
+        # the state is shared with the checks of other processes
+        with self._lock, lock_file(path + ".lock"):
+            state = load_json(path)
+            failures = state.get("failures", 0)
+            if failed:
+                state["failures"] = failures + 1
+                if state["failures"] == self.threshold:
+                    logger.warning("Opening the circuit of %s", backend)
+                    state["opened_at"] = time.time()
+            elif failures:
+                if failures >= self.threshold:
+                    logger.info("Closing the circuit of %s", backend)
+                state = {"failures": 0}
+            else:
+                # avoid rewriting the state on every successful request
+                return
+            save_json(path, state)
+
+
+@functools.lru_cache(maxsize=None)
+def shared_circuit_breaker(directory: str, threshold: int) -> CircuitBreaker:
+    """Returns the :class:`CircuitBreaker` of the process for the given state
+    ``directory``, so all checks of a process share their rejections."""
+    return CircuitBreaker(directory, threshold)
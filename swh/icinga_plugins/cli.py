@@ -6,6 +6,7 @@
 # WARNING: do not import unnecessary things here to keep cli startup time under
 # control
 import sys
+from typing import Optional
 
 import click
 
@@ -16,21 +17,184 @@ from swh.core.cli import swh as swh_cli_group
 @swh_cli_group.group(name="icinga_plugins", context_settings=CONTEXT_SETTINGS)
 @click.option("-w", "--warning", type=int, help="Warning threshold.")
 @click.option("-c", "--critical", type=int, help="Critical threshold.")
+@click.option(
+    "--perfdata-format",
+    type=click.Choice(["legacy", "standard"]),
+    default="legacy",
+    show_default=True,
+    help="Format of the performance data: 'legacy' prints a metric per line, "
+    "'standard' prints them on the first line as label=value[UOM];warn;crit;min;max, "
+    "with the timings of the phases and the resources used by the check.",
+)
+@click.option(
+    "--output",
+    "output_format",
+    type=click.Choice(["text", "json"]),
+    default="text",
+    show_default=True,
+    help="Print the result of the check as text for Icinga, or as a JSON "
+    "document with the details of the run.",
+)
+@click.option(
+    "--output-spool-directory",
+    type=click.Path(file_okay=False),
+    help="Also write the result of each run of a check as a JSON document to a "
+    "new file of this directory.",
+)
 @click.option("--prometheus-exporter/--no-prometheus-exporter", default=False)
 @click.option(
     "--prometheus-exporter-directory",
     type=str,
     default="/var/lib/prometheus/node-exporter",
 )
+@click.option(
+    "--prometheus-max-age",
+    type=click.FloatRange(min=0),
+    default=24 * 3600,
+    show_default=True,
+    help="Age (in seconds) after which the series of the Prometheus textfile "
+    "that no run of a check updated are removed.",
+)
+@click.option(
+    "--prometheus-http-port",
+    type=click.IntRange(min=0, max=65535),
+    help="Serve the metrics of the check on this port while it runs, including "
+    "its progress (disabled if unset).",
+)
+@click.option(
+    "--prometheus-http-addr",
+    type=str,
+    default="0.0.0.0",
+    show_default=True,
+    help="Address the metrics are served on, with --prometheus-http-port.",
+)
+@click.option(
+    "--trace-file",
+    type=click.Path(dir_okay=False),
+    help="Append the trace of the run of the check to this file, as a line of "
+    "OTLP JSON (disabled if unset).",
+)
+@click.option(
+    "--trace-endpoint",
+    type=str,
+    help="Post the trace of the run of the check as OTLP JSON to this URL, "
+    "eg. http://localhost:4318/v1/traces (disabled if unset).",
+)
+@click.option(
+    "--profile/--no-profile",
+    default=False,
+    help="Profile the CPU usage of the check with cProfile, and write the "
+    "profile (.pstats) to the profile directory.",
+)
+@click.option(
+    "--trace-memory/--no-trace-memory",
+    default=False,
+    help="Trace the memory allocations of the check with tracemalloc, and write "
+    "a snapshot and its top allocations to the profile directory.",
+)
+@click.option(
+    "--profile-directory",
+    type=click.Path(file_okay=False),
+    help="Directory where profiles are written, defaults to the 'profiles' "
+    "subdirectory of the state directory.",
+)
 @click.option("--environment", type=str, help="The tested environment")
+@click.option(
+    "--state-directory",
+    type=click.Path(file_okay=False),
+    help="Directory where checks keep state between runs (disabled if unset)",
+)
+@click.option(
+    "--adaptive-thresholds/--no-adaptive-thresholds",
+    default=False,
+    help="Derive thresholds from the history of the check kept in the state "
+    "directory, once it has enough samples.",
+)
+@click.option(
+    "--adaptive-warning-margin",
+    type=float,
+    default=0.25,
+    show_default=True,
+    help="Adaptive warning threshold, as a ratio over the p95 of past durations.",
+)
+@click.option(
+    "--adaptive-critical-factor",
+    type=float,
+    default=1.5,
+    show_default=True,
+    help="Adaptive critical threshold, as a factor of the p99 of past durations.",
+)
+@click.option(
+    "--adaptive-min-samples",
+    type=int,
+    default=30,
+    show_default=True,
+    help="Number of past durations needed before using adaptive thresholds.",
+)
+@click.option(
+    "--deadline",
+    type=float,
+    help="Maximum duration (in seconds) of a check, after which its HTTP requests "
+    "are aborted and it reports a critical status. Defaults to the critical "
+    "threshold plus one minute.",
+)
+@click.option(
+    "--rate-limit",
+    type=click.FloatRange(min=0, min_open=True),
+    help="Maximum number of HTTP requests per second to each backend, shared by "
+    "all checks using the same state directory (unlimited if unset).",
+)
+@click.option(
+    "--rate-limit-burst",
+    type=click.IntRange(min=1),
+    default=5,
+    show_default=True,
+    help="Number of HTTP requests which can be sent at once to each backend.",
+)
+@click.option(
+    "--circuit-breaker-threshold",
+    type=click.IntRange(min=0),
+    default=3,
+    show_default=True,
+    help="Number of consecutive failed requests to a backend after which checks "
+    "fail fast while a health probe of the backend fails. Needs a state "
+    "directory, disabled if 0.",
+)
+@click.option(
+    "--preflight/--no-preflight",
+    default=False,
+    help="Before running a check, probe all endpoints it needs concurrently, and "
+    "report a critical status right away if any of them fails.",
+)
 @click.pass_context
 def icinga_cli_group(
     ctx,
     warning,
     critical,
+    perfdata_format: str,
+    output_format: str,
+    output_spool_directory: Optional[str],
     prometheus_exporter: bool,
     prometheus_exporter_directory: str,
+    prometheus_max_age: float,
+    prometheus_http_port: Optional[int],
+    prometheus_http_addr: str,
+    trace_file: Optional[str],
+    trace_endpoint: Optional[str],
+    profile: bool,
+    trace_memory: bool,
+    profile_directory: Optional[str],
     environment: str,
+    state_directory: Optional[str],
+    adaptive_thresholds: bool,
+    adaptive_warning_margin: float,
+    adaptive_critical_factor: float,
+    adaptive_min_samples: int,
+    deadline: Optional[float],
+    rate_limit: Optional[float],
+    rate_limit_burst: int,
+    circuit_breaker_threshold: int,
+    preflight: bool,
 ):
     """Main command for Icinga plugins"""
     ctx.ensure_object(dict)
@@ -39,9 +203,43 @@ def icinga_cli_group(
     if critical:
         ctx.obj["critical_threshold"] = int(critical)
 
+    ctx.obj["perfdata_format"] = perfdata_format
+    ctx.obj["output_format"] = output_format
+    ctx.obj["output_spool_directory"] = output_spool_directory
     ctx.obj["prometheus_enabled"] = prometheus_exporter
     ctx.obj["prometheus_exporter_directory"] = prometheus_exporter_directory
+    ctx.obj["prometheus_max_age"] = prometheus_max_age
+    if prometheus_http_port is not None:
+        ctx.obj["prometheus_http_port"] = prometheus_http_port
+        ctx.obj["prometheus_http_addr"] = prometheus_http_addr
+    ctx.obj["trace_file"] = trace_file
+    ctx.obj["trace_endpoint"] = trace_endpoint
+    if profile or trace_memory:
+        import os
+
+        if profile_directory is None:
+            if state_directory is None:
+                raise click.UsageError(
+                    "Missing option '--profile-directory' or '--state-directory'.",
+                    ctx,
+                )
+            profile_directory = os.path.join(state_directory, "profiles")
+        ctx.obj["profile"] = profile
+        ctx.obj["trace_memory"] = trace_memory
+        ctx.obj["profile_directory"] = profile_directory
     ctx.obj["environment"] = environment
+    ctx.obj["state_directory"] = state_directory
+    ctx.obj["adaptive_thresholds"] = adaptive_thresholds
+    ctx.obj["adaptive_warning_margin"] = adaptive_warning_margin
+    ctx.obj["adaptive_critical_factor"] = adaptive_critical_factor
+    ctx.obj["adaptive_min_samples"] = adaptive_min_samples
+    if deadline is not None:
+        ctx.obj["deadline"] = deadline
+    if rate_limit is not None:
+        ctx.obj["rate_limit"] = rate_limit
+        ctx.obj["rate_limit_burst"] = rate_limit_burst
+    ctx.obj["circuit_breaker_threshold"] = circuit_breaker_threshold
+    ctx.obj["preflight"] = preflight
 
 
 @icinga_cli_group.group(name="check-vault")
@@ -70,7 +268,7 @@ def check_vault_directory(ctx):
     and waits for completion."""
     from .vault import VaultCheck
 
-    sys.exit(VaultCheck(ctx.obj).main())
+    sys.exit(VaultCheck(ctx.obj).run())
 
 
 @icinga_cli_group.group(name="check-savecodenow")
@@ -92,8 +290,14 @@ def check_scn(ctx, **kwargs):
 @check_scn.command(name="origin")
 @click.argument("origin", type=str, nargs=-1)
 @click.option("--visit-type", type=str, required=True, help="Visit type for origin")
+@click.option(
+    "--check-visit/--no-check-visit",
+    default=False,
+    help="Once saved, check the latest visit of the origin and its snapshot "
+    "can be read from swh-web.",
+)
 @click.pass_context
-def check_scn_origin(ctx, origin, visit_type):
+def check_scn_origin(ctx, origin, visit_type, check_visit):
     """Requests a save code now via the api for a given origin with type visit_type, waits
     for its completion, report approximate time of completion (failed or succeeded) and
     warn if threshold exceeded.
@@ -101,7 +305,7 @@ def check_scn_origin(ctx, origin, visit_type):
     """
     from .save_code_now import SaveCodeNowCheck
 
-    sys.exit(SaveCodeNowCheck(ctx.obj, list(origin), visit_type).main())
+    sys.exit(SaveCodeNowCheck(ctx.obj, list(origin), visit_type, check_visit).run())
 
 
 @icinga_cli_group.group(name="check-deposit")
@@ -127,8 +331,8 @@ def check_scn_origin(ctx, origin, visit_type):
 @click.option(
     "--collection",
     type=str,
-    required=True,
-    help="Software collection to use on the SWORD server",
+    help="Software collection to use on the SWORD server "
+    "(required, except for the multi command)",
 )
 @click.option(
     "--poll-interval",
@@ -145,6 +349,11 @@ def check_deposit(ctx, **kwargs):
     ctx.obj.update(kwargs)
 
 
+def _require_collection(ctx):
+    if ctx.obj.get("collection") is None:
+        raise click.UsageError("Missing option '--collection'.", ctx)
+
+
 @check_deposit.command(name="single")
 @click.option(
     "--archive", type=click.Path(), required=True, help="Software artefact to upload"
@@ -160,5 +369,140 @@ def check_deposit_single(ctx, **kwargs):
     """Checks the provided archive and metadata file and be deposited."""
     from .deposit import DepositCheck
 
+    _require_collection(ctx)
+    ctx.obj.update(kwargs)
+    sys.exit(DepositCheck(ctx.obj).run())
+
+
+@check_deposit.command(name="synthetic")
+@click.option(
+    "--archive-size",
+    type=click.IntRange(min=0),
+    default=1024 * 1024,
+    show_default=True,
+    help="Total size (in bytes) of the content of the generated archive",
+)
+@click.option(
+    "--file-count",
+    type=click.IntRange(min=1),
+    default=10,
+    show_default=True,
+    help="Number of files in the generated archive",
+)
+@click.pass_context
+def check_deposit_synthetic(ctx, **kwargs):
+    """Checks a newly generated archive, with unique content and matching
+    metadata, can be deposited."""
+    from .deposit import DepositCheck
+
+    _require_collection(ctx)
     ctx.obj.update(kwargs)
-    sys.exit(DepositCheck(ctx.obj).main())
+    sys.exit(DepositCheck(ctx.obj).run())
+
+
+@check_deposit.command(name="multi")
+@click.option(
+    "--deposit",
+    "deposits",
+    type=(str, click.Path(), click.Path()),
+    multiple=True,
+    required=True,
+    metavar="COLLECTION ARCHIVE METADATA",
+    help="Collection, software artefact and metadata file of a deposit to check. "
+    "Can be given several times, with different collections.",
+)
+@click.option(
+    "--client",
+    "clients",
+    type=(str, str, str, str),
+    multiple=True,
+    metavar="COLLECTION USERNAME PASSWORD PROVIDER_URL",
+    help="Login, password and provider URL of the deposit client of a collection, "
+    "used instead of --username, --password and --provider-url for its deposit. "
+    "Can be given once per collection.",
+)
+@click.pass_context
+def check_deposit_multi(ctx, deposits, clients):
+    """Checks the provided archives and metadata files can be deposited
+    concurrently, in their respective collections."""
+    from .deposit import MultiDepositCheck
+
+    collections = [collection for (collection, _, _) in deposits]
+    if len(set(collections)) != len(collections):
+        raise click.BadParameter("collections must be unique", param_hint="--deposit")
+    client_collections = [collection for (collection, _, _, _) in clients]
+    if len(set(client_collections)) != len(client_collections):
+        raise click.BadParameter("collections must be unique", param_hint="--client")
+    unknown = set(client_collections) - set(collections)
+    if unknown:
+        raise click.BadParameter(
+            f"no deposit in collections {', '.join(sorted(unknown))}",
+            param_hint="--client",
+        )
+    sys.exit(
+        MultiDepositCheck(
+            ctx.obj,
+            list(deposits),
+            {collection: client for (collection, *client) in clients},
+        ).run()
+    )
+
+
+@icinga_cli_group.command(name="stats")
+@click.option(
+    "--metric",
+    type=str,
+    default="total_time",
+    show_default=True,
+    help="Metric of the checks to compute statistics of",
+)
+@click.option(
+    "--ewma-alpha",
+    type=click.FloatRange(min=0, max=1, min_open=True),
+    default=0.1,
+    show_default=True,
+    help="Smoothing factor of the moving average used to detect anomalies",
+)
+@click.option(
+    "--trend-days",
+    type=float,
+    default=7,
+    show_default=True,
+    help="Number of days over which the trend of the metric is computed",
+)
+@click.option(
+    "--slo-target",
+    type=click.FloatRange(min=0, max=1, max_open=True),
+    default=0.99,
+    show_default=True,
+    help="Target ratio of successful runs of each check",
+)
+@click.option(
+    "--slo-window-days",
+    type=float,
+    default=1,
+    show_default=True,
+    help="Number of days over which the SLO burn rate is computed",
+)
+@click.pass_context
+def stats(ctx, metric, ewma_alpha, trend_days, slo_target, slo_window_days):
+    """Reports statistics over the history of the checks kept in the state
+    directory: moving average and anomaly z-score of their latest duration,
+    trend of their durations and burn rate of their error budget.
+
+    Requires numpy."""
+    if ctx.obj.get("state_directory") is None:
+        raise click.UsageError("Missing option '--state-directory'.", ctx)
+
+    from .stats import StatsReport
+
+    sys.exit(
+        StatsReport(
+            ctx.obj,
+            metric=metric,
+            alpha=ewma_alpha,
+            trend_days=trend_days,
+            slo_target=slo_target,
+            slo_window_days=slo_window_days,
+        ).run()
+    )
@@ -3,81 +3,558 @@
 # License: GNU General Public License version 3, or any later version
 # See top-level LICENSE file for more information
 
+from concurrent.futures import ThreadPoolExecutor
+import dataclasses
 import datetime
+import functools
+import hashlib
 import logging
+import os
 import sys
+import tempfile
 import time
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+import uuid
 
 import requests
-from tenacity.before_sleep import before_sleep_log
 
-from swh.core.retry import http_retry
-from swh.deposit.client import PublicApiDepositClient
+from swh.deposit.client import (
+    BaseDepositClient,
+    CreateMultipartDepositClient,
+    PublicApiDepositClient,
+    StatusDepositClient,
+    UpdateMetadataOnDoneDepositClient,
+)
 
-from .base_check import BaseCheck
+from .base_check import BaseCheck, PreflightProbe
+from .circuit import CircuitOpen
+from .http_client import CheckSession, DeadlineExceeded
+from .synthetic import SyntheticArchive
 
 logger = logging.getLogger(__name__)
 
 
-@http_retry(
-    before_sleep=before_sleep_log(logger, logging.WARNING),
-)
-def requests_get(url: str, params: Dict = {}):
-    """Get queries with retry on throttling exception.
+CHUNK_SIZE = 64 * 1024
+
+METADATA_DIGESTS_STATE = "metadata_digests"
+
+
+def read_chunks(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Yields the content of the file at ``path`` by chunks of ``chunk_size``
+    bytes."""
+    with open(path, "rb") as fd:
+        while True:
+            chunk = fd.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def block_digests(path: str, block_size: int = CHUNK_SIZE) -> List[str]:
+    """Computes the SHA256 digest of each block of ``block_size`` bytes of the
+    file at ``path``."""
+    return [
+        hashlib.sha256(block).hexdigest() for block in read_chunks(path, block_size)
+    ]
+
+
+def matches_block_digests(
+    response: requests.Response, size: int, digests: List[str], block_size: int
+) -> bool:
+    """Checks the body of a streamed ``response`` has the given ``size``
+    and ``digests`` (as computed by :func:`block_digests`).
+
+    The body is hashed block by block as it is received, and the comparison stops
+    at the first mismatching block, so at most two blocks are held in memory.
+
+    ``Content-Length`` is only used to fail early when the body is not encoded,
+    as it is otherwise the size of the encoded body, not of the decoded one.
+    """
+    content_length = response.headers.get("Content-Length")
+    content_encoding = response.headers.get("Content-Encoding", "identity")
+    if (
+        content_length is not None
+        and content_encoding.lower() == "identity"
+        and int(content_length) != size
+    ):
+        return False
+
+    buffer = bytearray()
+    index = 0
+
+    def check_block(block: bytes) -> bool:
+        nonlocal index
+        if index >= len(digests) or hashlib.sha256(block).hexdigest() != digests[index]:
+            return False
+        index += 1
+        return True
+
+    for chunk in response.iter_content(chunk_size=block_size):
+        buffer += chunk
+        while len(buffer) >= block_size:
+            if not check_block(bytes(buffer[:block_size])):
+                return False
+            del buffer[:block_size]
+    if buffer and not check_block(bytes(buffer)):
+        return False
+    return index == len(digests)
+
+
+@dataclasses.dataclass(frozen=True)
+class MultipartPart:
+    """A part of a :class:`MultipartStream`, whose content is produced by
+    ``chunks`` and is exactly ``length`` bytes long."""
+
+    name: str
+    filename: str
+    content_type: str
+    length: int
+    chunks: Callable[[], Iterator[bytes]]
+
+    @classmethod
+    def from_file(cls, name: str, path: str, content_type: str) -> "MultipartPart":
+        return cls(
+            name=name,
+            filename=os.path.basename(path),
+            content_type=content_type,
+            length=os.path.getsize(path),
+            chunks=lambda: read_chunks(path),
+        )
+
+
+class MultipartStream:
+    """A multipart/form-data request body generated while it is sent.
+
+    Its length is known in advance, so requests sends it with a
+    ``Content-Length`` header instead of using chunked transfer encoding.
+    Times at which the first and last chunks are consumed by the connection
+    are recorded, to tell apart the transfer time from the server time.
+
+    The body is generated again each time the request is sent, so only the
+    last attempt of a retried request is measured.
+    """
+
+    def __init__(self, parts: List[MultipartPart]):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self._parts = parts
+        self.first_chunk_time: Optional[float] = None
+        self.last_chunk_time: Optional[float] = None
+        self.bytes_sent = 0
+        self.attempts = 0
+
+    def _part_header(self, part: MultipartPart) -> bytes:
+        return (
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="{part.name}"; '
+            f'filename="{part.filename}"\r\n'
+            f"Content-Type: {part.content_type}\r\n\r\n"
+        ).encode()
+
+    def _footer(self) -> bytes:
+        return f"--{self.boundary}--\r\n".encode()
+
+    def __len__(self) -> int:
+        return sum(
+            len(self._part_header(part)) + part.length + 2 for part in self._parts
+        ) + len(self._footer())
+
+    def _generate(self) -> Iterator[bytes]:
+        for part in self._parts:
+            yield self._part_header(part)
+            yield from part.chunks()
+            yield b"\r\n"
+        yield self._footer()
+
+    def __iter__(self) -> Iterator[bytes]:
+        self.attempts += 1
+        self.first_chunk_time = None
+        self.last_chunk_time = None
+        self.bytes_sent = 0
+        for chunk in self._generate():
+            if self.first_chunk_time is None:
+                self.first_chunk_time = time.time()
+            self.bytes_sent += len(chunk)
+            yield chunk
+        self.last_chunk_time = time.time()
+
+
+class RaisingDepositClient(BaseDepositClient):
+    """Base of the sub-clients of :class:`CheckDepositClient`, whose
+    :meth:`execute` raises the errors which end the check
+    (:exc:`DeadlineExceeded` and :exc:`CircuitOpen`), instead of returning
+    them as an error result like other errors."""
 
-    Remaining issues (< 429) are to be dealt with with the client call code.
+    _check_error: Optional[Exception] = None
 
+    def do_execute(self, *args, **kwargs):
+        try:
+            return super().do_execute(*args, **kwargs)
+        except (DeadlineExceeded, CircuitOpen) as e:
+            self._check_error = e
+            raise
+
+    def execute(self, *args, **kwargs) -> Dict[str, Any]:
+        self._check_error = None
+        result = super().execute(*args, **kwargs)
+        if self._check_error is not None:
+            raise self._check_error
+        return result
+
+
+class StreamingMultipartDepositClient(
+    RaisingDepositClient, CreateMultipartDepositClient
+):
+    """Creates a multipart deposit like :class:`CreateMultipartDepositClient`,
+    but streams the archive from disk instead of loading it in memory, and
+    measures the upload.
+
+    Instead of ``archive_path``, :meth:`execute` also accepts a
+    :class:`SyntheticArchive` as ``archive``, which is generated while sent.
+
+    After :meth:`execute`, ``upload_stats`` contains the number of bytes sent,
+    the time to first response (from the start of the request to the
+    response), the transfer time of the body, and the server time (from the
+    end of the body to the response).
     """
-    response = requests.get(url, params=params)
 
-    if 429 <= response.status_code:
-        response.raise_for_status()
+    def __init__(self, config=None, url=None, auth=None):
+        super().__init__(config=config, url=url, auth=auth)
+        self.upload_stats: Dict[str, float] = {}
+
+    def compute_information(self, *args, **kwargs) -> Dict[str, Any]:
+        collection, in_progress, slug = args
+        metadata_path = kwargs["metadata_path"]
+
+        archive: Optional[SyntheticArchive] = kwargs.get("archive")
+        if archive is not None:
+            archive_part = MultipartPart(
+                name="file",
+                filename=archive.filename,
+                content_type=archive.content_type,
+                length=len(archive),
+                chunks=archive.chunks,
+            )
+            md5sum = archive.md5()
+        else:
+            archive_path = kwargs["archive_path"]
+            if "zip" in archive_path.split(".")[-1]:
+                content_type = "application/zip"
+            else:
+                content_type = "application/x-tar"
+            archive_part = MultipartPart.from_file("file", archive_path, content_type)
+
+            md5 = hashlib.md5()
+            for chunk in read_chunks(archive_path):
+                md5.update(chunk)
+            md5sum = md5.hexdigest()
+
+        body = MultipartStream(
+            [
+                archive_part,
+                MultipartPart.from_file("atom", metadata_path, "application/atom+xml"),
+            ]
+        )
+        headers = {
+            "CONTENT_MD5": md5sum,
+            "IN-PROGRESS": str(in_progress),
+            "SLUG": slug,
+            "CONTENT-TYPE": body.content_type,
+        }
+        return {"body": body, "headers": headers}
+
+    def do_execute(self, method, url, info, **kwargs):
+        body = info["body"]
+        start_time = time.time()
+        response = self.do(method, url, data=body, headers=info["headers"])
+        end_time = time.time()
+
+        if body.attempts > 1 and body.first_chunk_time is not None:
+            # the request was retried, the backoff before its last attempt is
+            # not part of the upload
+            start_time = body.first_chunk_time
+        # When the body was not consumed by the connection (e.g. the server
+        # answered early), all the time is accounted to the server.
+        transfer_end_time = body.last_chunk_time or start_time
+        self.upload_stats = {
+            "bytes": body.bytes_sent,
+            "first_response_time": end_time - start_time,
+            "transfer_time": transfer_end_time - (body.first_chunk_time or start_time),
+            "server_time": end_time - transfer_end_time,
+        }
+        return response
 
-    return response
+
+class CheckStatusDepositClient(RaisingDepositClient, StatusDepositClient):
+    pass
+
+
+class CheckUpdateMetadataDepositClient(
+    RaisingDepositClient, UpdateMetadataOnDoneDepositClient
+):
+    pass
+
+
+class CheckDepositClient(PublicApiDepositClient):
+    """Deposit client sending the requests of its sub-clients through a
+    :class:`CheckSession`, so they are retried and bound by its deadline.
+
+    The session is given the credentials of the deposit server, so it should
+    not be used with other servers."""
+
+    def __init__(self, session: CheckSession, config=None, url=None, auth=None):
+        super().__init__(config=config, url=url, auth=auth)
+        session.auth = self.session.auth
+        session.headers.update(self.session.headers)
+        self.session = session
+        self._sub_clients: Dict[type, RaisingDepositClient] = {}
+
+    def sub_client(self, cls):
+        """Returns the ``cls`` deposit client using the session of this client,
+        created on the first call, so its connections are reused"""
+        if cls not in self._sub_clients:
+            client = cls(url=self.base_url, auth=self.auth)
+            client.session = self.session
+            self._sub_clients[cls] = client
+        return self._sub_clients[cls]
+
+    def deposit_status(self, collection: str, deposit_id: int):
+        return self.sub_client(CheckStatusDepositClient).execute(collection, deposit_id)
+
+    def deposit_update_metadata(
+        self,
+        collection: str,
+        deposit_id: int,
+        slug: Optional[str],
+        metadata: str,
+        swhid: str,
+    ):
+        """Updates the metadata of a deposit with status 'done', like
+        :meth:`PublicApiDepositClient.deposit_update`."""
+        response = self.deposit_status(collection, deposit_id)
+        if "error" in response:
+            return response
+
+        status = response["deposit_status"]
+        if status != "done":
+            return {
+                "error": "You can only update metadata on deposit with status 'done'",
+                "detail": f"The deposit {deposit_id} has status '{status}'",
+                "deposit_status": status,
+                "deposit_id": deposit_id,
+            }
+        result = self.sub_client(CheckUpdateMetadataDepositClient).execute(
+            collection,
+            False,
+            slug,
+            deposit_id=deposit_id,
+            metadata_path=metadata,
+            swhid=swhid,
+        )
+        if "error" in result:
+            return result
+        return self.deposit_status(collection, deposit_id)
 
 
 class DepositCheck(BaseCheck):
     TYPE = "DEPOSIT"
     DEFAULT_WARNING_THRESHOLD = 120
     DEFAULT_CRITICAL_THRESHOLD = 3600
+    DURATION_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
 
     def __init__(self, obj):
         super().__init__(obj, application="deposit")
         self.api_url = obj["swh_web_url"].rstrip("/")
         self._poll_interval = obj["poll_interval"]
-        self._archive_path = obj["archive"]
-        self._metadata_path = obj["metadata"]
         self._collection = obj["collection"]
+        self.history_key = f"deposit_{self._collection}"
         self._slug: Optional[str] = None
         self._provider_url = obj["provider_url"]
 
-        self._client = PublicApiDepositClient(
+        # The deposit server gets its own session, not to send its credentials
+        # to other servers
+        self._client = CheckDepositClient(
+            self.session.derive(),
             {
                 "url": obj["server"],
                 "auth": {"username": obj["username"], "password": obj["password"]},
-            }
+            },
         )
 
-        self.register_prometheus_gauge("duration", "seconds", ["step", "status"])
+        self.register_prometheus_gauge(
+            "duration", "seconds", ["step", "status"], buckets=self.DURATION_BUCKETS
+        )
         self.register_prometheus_gauge("status", "")
+        self.register_prometheus_gauge("upload_throughput", "bytes_per_second")
+        self.register_prometheus_gauge(
+            "state_duration",
+            "seconds",
+            ["collection", "state"],
+            buckets=self.DURATION_BUCKETS,
+        )
+        self.register_prometheus_gauge("metadata_list_pages", "")
+        self.register_prometheus_gauge("metadata_list_size", "bytes")
+
+        # (status, time it was first observed) for each observed status change
+        self._status_timeline: List[Tuple[str, float]] = []
+        # statuses whose duration was exported
+        self._collected_states: Set[str] = set()
+        # number of pages and bytes read from the list of metadata
+        self.metadata_list_stats: Dict[str, int] = {"pages": 0, "bytes": 0}
+
+        self._archive_path: Optional[str] = obj.get("archive")
+        self._synthetic_archive: Optional[SyntheticArchive] = None
+        if self._archive_path is None:
+            # Generate a new archive for each run, so its content is not
+            # deduplicated by the archive and actually loaded
+            self._synthetic_archive = SyntheticArchive(
+                obj["archive_size"], obj["file_count"], uuid.uuid4().hex
+            )
+            # deposit_update only accepts a metadata file, which is small
+            self._tmp_dir = tempfile.TemporaryDirectory(prefix="swh-icinga-deposit-")
+            self._metadata_path = os.path.join(self._tmp_dir.name, "metadata.xml")
+            with open(self._metadata_path, "w") as fd:
+                fd.write(self._synthetic_archive.metadata())
+        else:
+            self._metadata_path = obj["metadata"]
+
+    def preflight_probes(self) -> List[PreflightProbe]:
+        return [
+            PreflightProbe("swh-web", self.api_url + "/"),
+            # authenticated, so it also checks the credentials
+            PreflightProbe(
+                "deposit",
+                self._client.base_url + "servicedocument/",
+                session=self._client.session,
+                method="GET",
+                error_status=400,
+            ),
+        ]
 
     def upload_deposit(self):
         slug = (
             "check-deposit-%s"
             % datetime.datetime.fromtimestamp(time.time()).isoformat()
         )
-        result = self._client.deposit_create(
-            archive=self._archive_path,
-            metadata=self._metadata_path,
-            collection=self._collection,
-            in_progress=False,
-            slug=slug,
+        client = self._client.sub_client(StreamingMultipartDepositClient)
+        if self._synthetic_archive is not None:
+            archive: Dict[str, Any] = {"archive": self._synthetic_archive}
+        else:
+            archive = {"archive_path": self._archive_path}
+        result = client.execute(
+            self._collection,
+            False,
+            slug,
+            metadata_path=self._metadata_path,
+            **archive,
         )
         self._slug = slug
         self._deposit_id = result["deposit_id"]
+        self.identifiers.update(
+            collection=self._collection, deposit_id=self._deposit_id, slug=slug
+        )
+        self.upload_stats = client.upload_stats
+        self.record_status(result)
         return result
 
+    @property
+    def checkpoint_key(self) -> str:
+        # single and synthetic checks of a collection deposit different archives
+        mode = "single" if self._synthetic_archive is None else "synthetic"
+        return f"{self.history_key}_{mode}"
+
+    def resume_deposit(self, checkpoint: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Restores the deposit uploaded by a previous interrupted run from its
+        checkpoint, and returns its current status, or :const:`None` if it
+        cannot be resumed."""
+        self._deposit_id = checkpoint["deposit_id"]
+        result = self.get_deposit_status()
+        if "error" in result:
+            return None
+        self._slug = checkpoint["slug"]
+        self.identifiers.update(
+            collection=self._collection,
+            deposit_id=self._deposit_id,
+            slug=self._slug,
+        )
+        self.upload_stats = checkpoint["upload_stats"]
+        if self._synthetic_archive is not None:
+            # same seed, same metadata, to compare it with the loaded one
+            self._synthetic_archive = SyntheticArchive(
+                self._synthetic_archive.size,
+                self._synthetic_archive.file_count,
+                checkpoint["seed"],
+            )
+            with open(self._metadata_path, "w") as fd:
+                fd.write(self._synthetic_archive.metadata())
+        return result
+
+    def save_deposit_checkpoint(self, start_time: float, upload_time: float) -> None:
+        self.save_checkpoint(
+            {
+                "start_time": start_time,
+                "upload_time": upload_time,
+                "slug": self._slug,
+                "deposit_id": self._deposit_id,
+                "upload_stats": self.upload_stats,
+                "seed": (
+                    self._synthetic_archive.seed
+                    if self._synthetic_archive is not None
+                    else None
+                ),
+            }
+        )
+
+    def record_status(self, result: Dict[str, Any]) -> None:
+        """Adds the status of the deposit to the timeline, if it changed"""
+        status = result.get("deposit_status")
+        if status is None:
+            return
+        if not self._status_timeline or self._status_timeline[-1][0] != status:
+            self._status_timeline.append((status, time.time()))
+
+    def state_durations(self, now: Optional[float] = None) -> Dict[str, float]:
+        """Computes the time spent in each status of the timeline.
+
+        The last status is still ongoing, so it only gets a duration if ``now``
+        is given."""
+        durations: Dict[str, float] = {}
+        timeline = list(self._status_timeline)
+        if now is not None and timeline:
+            timeline.append(("", now))
+        for (status, start), (_, end) in zip(timeline, timeline[1:]):
+            durations[status] = durations.get(status, 0.0) + end - start
+        return durations
+
+    def collect_state_durations(
+        self, metrics: Dict[str, float], now: Optional[float] = None
+    ) -> None:
+        """Adds the time spent in each status to ``metrics``, and exports it as
+        prometheus metrics labelled by collection, once per status left since
+        the last call."""
+        for status, duration in self.state_durations(now).items():
+            metrics[f"state_{status}_time"] = duration
+            if status in self._collected_states:
+                continue
+            self._collected_states.add(status)
+            self.collect_prometheus_metric(
+                "state_duration", duration, [self._collection, status]
+            )
+
+    def collect_upload_metrics(self, metrics: Dict[str, float]) -> None:
+        """Adds the upload timings to ``metrics``, and exports them with the
+        upload throughput as prometheus metrics."""
+        stats = self.upload_stats
+        for step in ("first_response", "transfer", "server"):
+            metrics[f"upload_{step}_time"] = stats[f"{step}_time"]
+            self.collect_prometheus_metric(
+                "duration", stats[f"{step}_time"], [f"upload_{step}", "ok"]
+            )
+        if stats["transfer_time"] > 0:
+            self.collect_prometheus_metric(
+                "upload_throughput", stats["bytes"] / stats["transfer_time"]
+            )
+
     def update_deposit_with_metadata(self) -> Dict[str, Any]:
         """Trigger a metadata update on the deposit once it's completed."""
         deposit = self.get_deposit_status()
@@ -85,7 +562,7 @@ class DepositCheck(BaseCheck):
         assert deposit["deposit_id"] == self._deposit_id
 
         # We can reuse the initial metadata file we already sent
-        return self._client.deposit_update(
+        return self._client.deposit_update_metadata(
             self._collection,
             self._deposit_id,
             self._slug,
@@ -93,15 +570,143 @@ class DepositCheck(BaseCheck):
             swhid=swhid,
         )
 
+    def metadata_digests(self) -> Tuple[int, List[str]]:
+        """Returns the size and block digests of the metadata file.
+
+        They are cached in the state directory, and only computed again when
+        the size or modification time of the file changed."""
+        path = os.path.abspath(self._metadata_path)
+        stat = os.stat(path)
+        cache = self.load_state(METADATA_DIGESTS_STATE)
+        entry = cache.get(path)
+        if (
+            entry is None
+            or entry["mtime_ns"] != stat.st_mtime_ns
+            or entry["size"] != stat.st_size
+            or entry["block_size"] != CHUNK_SIZE
+        ):
+            entry = {
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "block_size": CHUNK_SIZE,
+                "digests": block_digests(path),
+            }
+            if self._synthetic_archive is None:
+                # generated metadata files are never checked again
+                cache[path] = entry
+                self.save_state(METADATA_DIGESTS_STATE, cache)
+        return entry["size"], entry["digests"]
+
+    def check_metadata(
+        self, result: Dict[str, Any], start_datetime: datetime.datetime
+    ) -> Optional[str]:
+        """Checks the metadata of a deposit with status ``done`` was loaded as-is
+        in the archive, since ``start_datetime``.
+
+        Returns:
+            an error message if the check failed, None otherwise
+
+        """
+        # Get the SWHID
+        if "deposit_swh_id" not in result:
+            # if the deposit succeeded immediately (which is rare), it does not
+            # contain the SWHID, so we need to re-fetch its status.
+            result = self.get_deposit_status()
+        if result.get("deposit_swh_id") is None:
+            return f"'deposit_swh_id' missing from result: {result!r}"
+
+        swhid = result["deposit_swh_id"]
+
+        # Check for unexpected status
+        if result["deposit_status"] != "done":
+            return (
+                f'Deposit status went from "done" to: {result["deposit_status"]} '
+                f'({result["deposit_status_detail"]})'
+            )
+
+        # Get metadata list from swh-web, page by page until the metadata of
+        # this deposit is found
+        expected_origin = f"{self._provider_url}/{self._slug}"
+        metadata_objects: List[Dict[str, Any]] = []
+        relevant_metadata_object = None
+        page_count = 0
+        page_bytes = 0
+        url: Optional[str] = (
+            f"{self.api_url}/api/1/raw-extrinsic-metadata/swhid/{swhid}/"
+        )
+        params = {
+            "authority": f"deposit_client {self._provider_url}",
+            "after": start_datetime.isoformat(),
+        }
+        while url is not None:
+            response = self.session.get(url, params=params)
+            page_count += 1
+            page_bytes += len(response.content)
+            self.metadata_list_stats = {"pages": page_count, "bytes": page_bytes}
+            self.collect_prometheus_metric("metadata_list_pages", page_count)
+            self.collect_prometheus_metric("metadata_list_size", page_bytes)
+
+            # throttled requests are already retried by the session
+            if response.status_code != 200:
+                return (
+                    f"Getting the list of metadata returned code "
+                    f"{response.status_code}: {response.content!r}"
+                )
+
+            page = response.json()
+
+            # Filter out objects that were clearly not created by this deposit
+            relevant_metadata_object = next(
+                (d for d in page if d.get("origin") == expected_origin), None
+            )
+            if relevant_metadata_object is not None:
+                break
+            metadata_objects.extend(page)
+
+            # The URL of the next page already contains the query parameters
+            url = response.links.get("next", {}).get("url")
+            params = {}
+
+        if relevant_metadata_object is None:
+            return (
+                f"No recent metadata on {swhid} with origin {expected_origin} in: "
+                f"{metadata_objects!r}"
+            )
+
+        # Check the metadata was loaded as-is
+        metadata_url = relevant_metadata_object["metadata_url"]
+        size, digests = self.metadata_digests()
+        with self.session.get(metadata_url, stream=True) as response:
+            if response.status_code != 200:
+                return (
+                    f"Getting the metadata on {swhid} (at {metadata_url}) "
+                    f"returned code {response.status_code}: {response.content!r}"
+                )
+            metadata_matches = matches_block_digests(
+                response, size, digests, CHUNK_SIZE
+            )
+        if not metadata_matches:
+            return (
+                f"Metadata on {swhid} with origin {expected_origin} "
+                f"(at {metadata_url}) differs from uploaded Atom document "
+                f"(at {self._metadata_path})"
+            )
+
+        return None
+
     def get_deposit_status(self):
-        return self._client.deposit_status(
+        result = self._client.deposit_status(
             collection=self._collection, deposit_id=self._deposit_id
         )
+        self.record_status(result)
+        return result
 
     def wait_while_status(self, statuses, start_time, metrics, result):
         while result["deposit_status"] in statuses:
+            self.report_progress(result["deposit_status"])
             metrics["total_time"] = time.time() - start_time
             if metrics["total_time"] > self.critical_threshold:
+                self.collect_state_durations(metrics, now=time.time())
                 self.print_result(
                     "CRITICAL",
                     f"Timed out while in status "
@@ -121,32 +726,47 @@ class DepositCheck(BaseCheck):
                 )
                 self.collect_prometheus_metric("status", 2)
 
+                self.clear_checkpoint()
                 sys.exit(2)
 
+            self.usage.add("polls")
             time.sleep(self._poll_interval)
 
             result = self.get_deposit_status()
 
+        self.collect_state_durations(metrics)
         return result
 
     def main(self):
-        start_time = time.time()
+        metrics = {}
+        checkpoint = self.load_checkpoint()
+        result = self.resume_deposit(checkpoint) if checkpoint else None
+        if result is not None:
+            assert checkpoint is not None
+            start_time = checkpoint["start_time"]
+            metrics["upload_time"] = checkpoint["upload_time"]
+        else:
+            # Upload the archive and metadata
+            self.report_progress("upload")
+            self.start_phase("upload")
+            start_time = time.time()
+            result = self.upload_deposit()
+            metrics["upload_time"] = time.time() - start_time
+            self.save_deposit_checkpoint(start_time, metrics["upload_time"])
         start_datetime = datetime.datetime.fromtimestamp(
             start_time, tz=datetime.timezone.utc
         )
-        metrics = {}
-
-        # Upload the archive and metadata
-        result = self.upload_deposit()
-        metrics["upload_time"] = time.time() - start_time
+        self.collect_upload_metrics(metrics)
 
         # Wait for validation
+        self.start_phase("validate")
         result = self.wait_while_status(["deposited"], start_time, metrics, result)
         metrics["total_time"] = time.time() - start_time
         metrics["validation_time"] = metrics["total_time"] - metrics["upload_time"]
 
         # Check validation succeeded
         if result["deposit_status"] == "rejected":
+            self.clear_checkpoint()
             self.print_result(
                 "CRITICAL",
                 f'Deposit was rejected: {result["deposit_status_detail"]}',
@@ -156,7 +776,7 @@ class DepositCheck(BaseCheck):
                 "duration", metrics["validation_time"], ["validation", "rejected"]
             )
             self.collect_prometheus_metric(
-                "duration", metrics["total_time"], ["validation", "rejected"]
+                "duration", metrics["total_time"], ["total", "rejected"]
             )
             self.collect_prometheus_metric("status", 2)
             return 2
@@ -165,9 +785,11 @@ class DepositCheck(BaseCheck):
         )
 
         # Wait for loading
+        self.start_phase("load")
         result = self.wait_while_status(
             ["verified", "loading"], start_time, metrics, result
         )
+        self.clear_checkpoint()
         metrics["total_time"] = time.time() - start_time
         metrics["load_time"] = (
             metrics["total_time"] - metrics["upload_time"] - metrics["validation_time"]
@@ -203,78 +825,11 @@ class DepositCheck(BaseCheck):
             self.collect_prometheus_metric("status", 2)
             return 2
 
-        # Get the SWHID
-        if "deposit_swh_id" not in result:
-            # if the deposit succeeded immediately (which is rare), it does not
-            # contain the SWHID, so we need to re-fetch its status.
-            result = self.get_deposit_status()
-        if result.get("deposit_swh_id") is None:
-            self.print_result(
-                "CRITICAL",
-                f"'deposit_swh_id' missing from result: {result!r}",
-                **metrics,
-            )
-            return 2
-
-        swhid = result["deposit_swh_id"]
-
-        # Check for unexpected status
-        if result["deposit_status"] != "done":
-            self.print_result(
-                "CRITICAL",
-                f'Deposit status went from "done" to: {result["deposit_status"]} '
-                f'({result["deposit_status_detail"]})',
-                **metrics,
-            )
-            return 2
-
-        # Get metadata list from swh-web
-        response = requests_get(
-            f"{self.api_url}/api/1/raw-extrinsic-metadata/swhid/{swhid}/",
-            params={
-                "authority": f"deposit_client {self._provider_url}",
-                "after": start_datetime.isoformat(),
-            },
-        )
-        status_code = response.status_code
-        if status_code != 200 and status_code != 429:
-            self.print_result(
-                "CRITICAL",
-                f"Getting the list of metadata returned code {response.status_code}: "
-                f"{response.content!r}",
-                **metrics,
-            )
-            return 2
-
-        metadata_objects = response.json()
-        expected_origin = f"{self._provider_url}/{self._slug}"
-
-        # Filter out objects that were clearly not created by this deposit
-        relevant_metadata_objects = [
-            d for d in metadata_objects if d.get("origin") == expected_origin
-        ]
-        if not relevant_metadata_objects:
-            self.print_result(
-                "CRITICAL",
-                f"No recent metadata on {swhid} with origin {expected_origin} in: "
-                f"{metadata_objects!r}",
-                **metrics,
-            )
-            return 2
-
-        # Check the metadata was loaded as-is
-        metadata_url = relevant_metadata_objects[0]["metadata_url"]
-        metadata_file = requests_get(metadata_url).content
-        with open(self._metadata_path, "rb") as fd:
-            expected_metadata_file = fd.read()
-        if metadata_file != expected_metadata_file:
-            self.print_result(
-                "CRITICAL",
-                f"Metadata on {swhid} with origin {expected_origin} "
-                f"(at {metadata_url}) differs from uploaded Atom document "
-                f"(at {self._metadata_path})",
-                **metrics,
-            )
+        self.report_progress("check_metadata")
+        self.start_phase("check_metadata")
+        error = self.check_metadata(result, start_datetime)
+        if error is not None:
+            self.print_result("CRITICAL", error, **metrics)
             return 2
 
         # Everything went fine, check total time wasn't too large and
@@ -291,6 +846,8 @@ class DepositCheck(BaseCheck):
             return status_code
 
         # Initial deposit is now completed, now we can update the deposit with metadata
+        self.report_progress("update_metadata")
+        self.start_phase("update_metadata")
         result = self.update_deposit_with_metadata()
         total_time = time.time() - start_time
         metrics_update = {
@@ -328,3 +885,241 @@ class DepositCheck(BaseCheck):
         )
         self.collect_prometheus_metric("status", status_code)
         return status_code
+
+
+WAITING_STATUSES = ("deposited", "verified", "loading")
+
+
+class MultiDepositCheck(BaseCheck):
+    """Checks several deposits at once, possibly in different collections.
+
+    All deposits are uploaded concurrently, then their statuses are polled
+    together until none of them is waiting for validation or loading.
+
+    Deposits are made with the username, password and provider URL of ``obj``,
+    unless ``clients`` has other ones for their collection."""
+
+    TYPE = "DEPOSIT"
+    DEFAULT_WARNING_THRESHOLD = DepositCheck.DEFAULT_WARNING_THRESHOLD
+    DEFAULT_CRITICAL_THRESHOLD = DepositCheck.DEFAULT_CRITICAL_THRESHOLD
+    DURATION_BUCKETS = DepositCheck.DURATION_BUCKETS
+    HTTP_METRICS_LABELS = ["collection"]
+
+    def __init__(
+        self,
+        obj,
+        deposits: List[Tuple[str, str, str]],
+        clients: Optional[Dict[str, Tuple[str, str, str]]] = None,
+    ):
+        super().__init__(obj, application="deposit_multi")
+        self._poll_interval = obj["poll_interval"]
+        clients = clients or {}
+
+        # The checks of each deposit only run their steps, results and metrics
+        # are reported by this check
+        self._checks: Dict[str, DepositCheck] = {
+            collection: DepositCheck(
+                {
+                    **obj,
+                    **self._client_options(clients.get(collection)),
+                    "collection": collection,
+                    "archive": archive,
+                    "metadata": metadata,
+                    "prometheus_enabled": False,
+                    "tracer": self.tracer,
+                    "usage": self.usage,
+                    "on_http_retry_stat": functools.partial(
+                        self._on_http_retry_stat, labels=[collection]
+                    ),
+                    "on_http_request_timing": functools.partial(
+                        self._on_http_request_timing, labels=[collection]
+                    ),
+                }
+            )
+            for (collection, archive, metadata) in deposits
+        }
+
+        self.register_prometheus_gauge(
+            "duration",
+            "seconds",
+            ["collection", "step", "status"],
+            buckets=self.DURATION_BUCKETS,
+        )
+        self.register_prometheus_gauge("collection_status", "", ["collection"])
+        self.register_prometheus_gauge("status", "")
+        self.register_prometheus_gauge(
+            "upload_throughput", "bytes_per_second", ["collection"]
+        )
+        self.register_prometheus_gauge(
+            "state_duration",
+            "seconds",
+            ["collection", "state"],
+            buckets=self.DURATION_BUCKETS,
+        )
+        self.register_prometheus_gauge("metadata_list_pages", "", ["collection"])
+        self.register_prometheus_gauge("metadata_list_size", "bytes", ["collection"])
+
+    @staticmethod
+    def _client_options(client: Optional[Tuple[str, str, str]]) -> Dict[str, str]:
+        if client is None:
+            return {}
+        (username, password, provider_url) = client
+        return {
+            "username": username,
+            "password": password,
+            "provider_url": provider_url,
+        }
+
+    def preflight_probes(self) -> List[PreflightProbe]:
+        probes = {
+            (probe.name, probe.url): probe
+            for check in self._checks.values()
+            for probe in check.preflight_probes()
+        }
+        return list(probes.values())
+
+    def collect_deposit_metrics(self, collection: str, check: DepositCheck) -> None:
+        """Exports the metrics of the deposit in ``collection``, which its check
+        does not export itself, labelled by collection."""
+        stats = check.upload_stats
+        for step in ("transfer", "server"):
+            self.collect_prometheus_metric(
+                "duration", stats[f"{step}_time"], [collection, f"upload_{step}", "ok"]
+            )
+        if stats["transfer_time"] > 0:
+            self.collect_prometheus_metric(
+                "upload_throughput",
+                stats["bytes"] / stats["transfer_time"],
+                [collection],
+            )
+        if check.metadata_list_stats["pages"] > 0:
+            self.collect_prometheus_metric(
+                "metadata_list_pages", check.metadata_list_stats["pages"], [collection]
+            )
+            self.collect_prometheus_metric(
+                "metadata_list_size", check.metadata_list_stats["bytes"], [collection]
+            )
+
+    def _map(self, func, checks: List[DepositCheck]) -> List[Any]:
+        with ThreadPoolExecutor(max_workers=len(checks)) as executor:
+            return list(executor.map(func, checks))
+
+    def _deposit_error(
+        self,
+        check: DepositCheck,
+        result: Dict[str, Any],
+        start_datetime: datetime.datetime,
+    ) -> Optional[str]:
+        if result["deposit_status"] in WAITING_STATUSES:
+            return f'Timed out while in status {result["deposit_status"]}'
+        elif result["deposit_status"] == "rejected":
+            return f'Deposit was rejected: {result["deposit_status_detail"]}'
+        elif result["deposit_status"] == "failed":
+            return f'Deposit loading failed: {result["deposit_status_detail"]}'
+        elif result["deposit_status"] != "done":
+            return (
+                f'Deposit got unexpected status: {result["deposit_status"]} '
+                f'({result["deposit_status_detail"]})'
+            )
+        return check.check_metadata(result, start_datetime)
+
+    def main(self):
+        start_time = time.time()
+        start_datetime = datetime.datetime.fromtimestamp(
+            start_time, tz=datetime.timezone.utc
+        )
+        metrics: Dict[str, float] = {}
+        checks = list(self._checks.values())
+
+        # Upload all archives and metadata at once
+        self.report_progress("upload")
+        self.start_phase("upload")
+        results = dict(
+            zip(self._checks, self._map(DepositCheck.upload_deposit, checks))
+        )
+        end_times: Dict[str, float] = {}
+        for collection, check in self._checks.items():
+            upload_time = check.upload_stats["first_response_time"]
+            metrics[f"{collection}_upload_time"] = upload_time
+            self.collect_prometheus_metric(
+                "duration", upload_time, [collection, "upload", "ok"]
+            )
+
+        # Poll the statuses of all waiting deposits together
+        self.start_phase("wait")
+        while True:
+            now = time.time()
+            for collection, result in results.items():
+                if (
+                    collection not in end_times
+                    and result["deposit_status"] not in WAITING_STATUSES
+                ):
+                    end_times[collection] = now
+            waiting = [
+                collection for collection in results if collection not in end_times
+            ]
+            if not waiting or now - start_time > self.critical_threshold:
+                break
+            self.report_progress("waiting")
+
+            self.usage.add("polls")
+            time.sleep(self._poll_interval)
+
+            waiting_checks = [self._checks[collection] for collection in waiting]
+            results.update(
+                zip(waiting, self._map(DepositCheck.get_deposit_status, waiting_checks))
+            )
+
+        # Check the outcome of each deposit
+        self.start_phase("check")
+        now = time.time()
+        errors: Dict[str, str] = {}
+        status_code = 0
+        for collection, check in self._checks.items():
+            total_time = end_times.get(collection, now) - start_time
+            metrics[f"{collection}_total_time"] = total_time
+            # the status of finished deposits does not end, unlike the one of
+            # timed out deposits
+            state_end = None if collection in end_times else now
+            for state, duration in check.state_durations(state_end).items():
+                self.collect_prometheus_metric(
+                    "state_duration", duration, [collection, state]
+                )
+
+            error = self._deposit_error(check, results[collection], start_datetime)
+            self.collect_deposit_metrics(collection, check)
+            if error is not None:
+                errors[collection] = error
+                collection_status_code = 2
+            else:
+                (collection_status_code, _) = self.get_status(
+                    total_time, f"{collection}_total_time"
+                )
+            status_code = max(status_code, collection_status_code)
+
+            self.collect_prometheus_metric(
+                "duration",
+                total_time,
+                [collection, "total", results[collection]["deposit_status"]],
+            )
+            self.collect_prometheus_metric(
+                "collection_status", collection_status_code, [collection]
+            )
+
+        metrics["total_time"] = max(
+            metrics[f"{collection}_total_time"] for collection in self._checks
+        )
+        status = {0: "OK", 1: "WARNING", 2: "CRITICAL"}[status_code]
+        summary = (
+            f"{len(self._checks) - len(errors)} of {len(self._checks)} deposits "
+            f'succeeded, the slowest one took {metrics["total_time"]:.2f}s.'
+        )
+        for collection, error in errors.items():
+            summary += f" {collection}: {error}."
+        self.identifiers["deposits"] = {
+            collection: check.identifiers
+            for (collection, check) in self._checks.items()
+        }
+        self.print_result(status, summary, **metrics)
+        self.collect_prometheus_metric("status", status_code)
+        return status_code
@@ -0,0 +1,91 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Prometheus histograms accumulating observations across runs of checks.
+
+Each run of a check only makes a few observations, so the counts of the
+buckets are kept in the state directory and exported as cumulative buckets,
+like the histograms of long-running processes, for ``histogram_quantile``.
+"""
+
+import math
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from prometheus_client import CollectorRegistry
+from prometheus_client.metrics_core import HistogramMetricFamily
+from prometheus_client.utils import floatToGoString
+
+DEFAULT_BUCKETS = (1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+class PersistentHistogram:
+    """Histogram of the values observed for each set of label values, which can
+    be saved to and restored from a JSON document."""
+
+    def __init__(
+        self,
+        name: str,
+        unit: str,
+        labelnames: Sequence[str],
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        registry: Optional[CollectorRegistry] = None,
+    ):
+        self.name = name
+        self.unit = unit
+        self.labelnames = list(labelnames)
+        self.buckets = sorted(float(bound) for bound in buckets)
+        if self.buckets[-1] != math.inf:
+            self.buckets.append(math.inf)
+        # label values -> (count of each bucket, sum of the values)
+        self.series: Dict[Tuple[str, ...], Tuple[List[int], float]] = {}
+        if registry is not None:
+            registry.register(self)
+
+    def observe(self, labelvalues: Sequence[str], value: float) -> None:
+        (counts, total) = self.series.get(
+            tuple(labelvalues), ([0] * len(self.buckets), 0.0)
+        )
+        index = next(i for (i, bound) in enumerate(self.buckets) if value <= bound)
+        counts[index] += 1
+        self.series[tuple(labelvalues)] = (counts, total + value)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            # infinity is not valid JSON
+            "buckets": self.buckets[:-1],
+            "series": [
+                {"labels": list(labels), "counts": counts, "sum": total}
+                for (labels, (counts, total)) in self.series.items()
+            ],
+        }
+
+    def merge(self, d: Dict[str, Any]) -> None:
+        """Adds the observations of :meth:`to_dict` to those of this histogram,
+        unless they were made with other buckets."""
+        if d.get("buckets") != self.buckets[:-1]:
+            return
+        for series in d["series"]:
+            labels = tuple(series["labels"])
+            (counts, total) = self.series.get(labels, ([0] * len(self.buckets), 0.0))
+            self.series[labels] = (
+                [count + other for (count, other) in zip(counts, series["counts"])],
+                total + series["sum"],
+            )
+
+    def describe(self) -> Iterable[HistogramMetricFamily]:
+        return [HistogramMetricFamily(self.name, "", unit=self.unit)]
+
+    def collect(self) -> Iterable[HistogramMetricFamily]:
+        family = HistogramMetricFamily(
+            self.name, "", labels=self.labelnames, unit=self.unit
+        )
+        for labels, (counts, total) in self.series.items():
+            cumulative = 0
+            buckets = []
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                buckets.append((floatToGoString(bound), cumulative))
+            family.add_metric(list(labels), buckets, total)
+        return [family]
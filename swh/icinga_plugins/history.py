@@ -0,0 +1,212 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""History of the results of the checks, kept across runs.
+
+Each metric of a check has its own append-only file of fixed-size records
+``(timestamp, value, status)``, so it can be appended to in constant time and
+memory-mapped as an array for analysis. Quantiles of the recent values are
+estimated incrementally with the P² algorithm [JC85]_, so each run only
+updates a constant-size sketch instead of reading the whole history.
+
+.. [JC85] R. Jain and I. Chlamtac, "The P² algorithm for dynamic calculation
+   of quantiles and histograms without storing observations", Communications
+   of the ACM, 1985.
+"""
+
+import os
+import re
+import struct
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+RECORD = struct.Struct("<ddi")
+"""Format of the records: timestamp, value, Icinga status code"""
+
+STATUS_CODES = {"OK": 0, "WARNING": 1, "CRITICAL": 2, "UNKNOWN": 3}
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+DEFAULT_WINDOW = 1000
+"""Number of values after which quantile sketches are restarted"""
+
+
+def quantile_name(q: float) -> str:
+    """Returns the usual name of a quantile, eg. ``p95`` for 0.95"""
+    return "p%g" % (q * 100)
+
+
+class HistoryStore:
+    """Append-only files of records of the values of the metrics of a check,
+    in ``directory``."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, metric: str) -> str:
+        return os.path.join(self.directory, re.sub(r"[^\w.-]", "_", metric) + ".bin")
+
+    def append(self, metric: str, timestamp: float, value: float, status: int) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        # A single write of a record opened in append mode, so records of
+        # concurrent runs are never interleaved
+        with open(self.path(metric), "ab") as fd:
+            fd.write(RECORD.pack(timestamp, value, status))
+
+    def metrics(self) -> List[str]:
+        try:
+            filenames = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(
+            name[: -len(".bin")] for name in filenames if name.endswith(".bin")
+        )
+
+    def read(self, metric: str) -> Iterator[Tuple[float, float, int]]:
+        """Yields the ``(timestamp, value, status)`` records of ``metric``, ignoring
+        a trailing truncated record"""
+        try:
+            with open(self.path(metric), "rb") as fd:
+                data = fd.read()
+        except FileNotFoundError:
+            return
+        yield from RECORD.iter_unpack(data[: len(data) - len(data) % RECORD.size])
+
+
+class P2Quantile:
+    """Estimates the ``q`` quantile of a stream of values in constant space,
+    with the five markers of the P² algorithm."""
+
+    def __init__(self, q: float):
+        self.q = q
+        self.heights: List[float] = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * q, 1 + 4 * q, 3 + 2 * q, 5]
+        self.increments = [0, q / 2, q, (1 + q) / 2, 1]
+
+    @property
+    def count(self) -> int:
+        if len(self.heights) < 5:
+            return len(self.heights)
+        return self.positions[4]
+
+    def add(self, value: float) -> None:
+        heights, positions = self.heights, self.positions
+        if len(heights) < 5:
+            heights.append(value)
+            heights.sort()
+            return
+
+        if value < heights[0]:
+            heights[0] = value
+            k = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            k = 3
+        else:
+            k = max(i for i in range(4) if heights[i] <= value)
+        for i in range(k + 1, 5):
+            positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in range(1, 4):
+            d = self.desired[i] - positions[i]
+            if (d >= 1 and positions[i + 1] - positions[i] > 1) or (
+                d <= -1 and positions[i - 1] - positions[i] < -1
+            ):
+                step = 1 if d > 0 else -1
+                height = self._parabolic(i, step)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = heights[i] + step * (heights[i + step] - heights[i]) / (
+                        positions[i + step] - positions[i]
+                    )
+                heights[i] = height
+                positions[i] += step
+
+    def _parabolic(self, i: int, step: int) -> float:
+        h, n = self.heights, self.positions
+        return h[i] + step / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + step) * (h[i + 1] - h[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - step) * (h[i] - h[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def value(self) -> Optional[float]:
+        """Returns the estimated quantile, or :const:`None` if there was no value"""
+        if not self.heights:
+            return None
+        if len(self.heights) < 5:
+            # exact quantile (nearest rank) of the few values
+            return self.heights[
+                min(len(self.heights) - 1, int(self.q * len(self.heights)))
+            ]
+        return self.heights[2]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "q": self.q,
+            "heights": self.heights,
+            "positions": self.positions,
+            "desired": self.desired,
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "P2Quantile":
+        sketch = cls(d["q"])
+        sketch.heights = d["heights"]
+        sketch.positions = d["positions"]
+        sketch.desired = d["desired"]
+        return sketch
+
+
+class RollingQuantiles:
+    """Quantiles of the recent values of a metric.
+
+    Sketches are restarted every ``window`` values, and the previous ones are
+    used until the new ones got ``window / 2`` values, so quantiles are always
+    estimated from at least ``window / 2`` values (or all values until there
+    are that many), none of them older than the last ``1.5 * window``."""
+
+    def __init__(
+        self, quantiles: Tuple[float, ...] = QUANTILES, window: int = DEFAULT_WINDOW
+    ):
+        self.window = window
+        self.current = [P2Quantile(q) for q in quantiles]
+        self.previous: List[P2Quantile] = []
+
+    @property
+    def count(self) -> int:
+        """Number of values the quantiles are estimated from"""
+        if self.previous and self.current[0].count < self.window // 2:
+            return self.previous[0].count
+        return self.current[0].count
+
+    def add(self, value: float) -> None:
+        if self.current[0].count >= self.window:
+            self.previous = self.current
+            self.current = [P2Quantile(sketch.q) for sketch in self.previous]
+        for sketch in self.current:
+            sketch.add(value)
+
+    def quantiles(self) -> Dict[float, float]:
+        """Returns the estimated value of each quantile, if there is any value"""
+        sketches = self.current
+        if self.previous and self.current[0].count < self.window // 2:
+            sketches = self.previous
+        values = {sketch.q: sketch.value() for sketch in sketches}
+        return {q: value for (q, value) in values.items() if value is not None}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "window": self.window,
+            "current": [sketch.to_dict() for sketch in self.current],
+            "previous": [sketch.to_dict() for sketch in self.previous],
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "RollingQuantiles":
+        rolling = cls(window=d["window"])
+        rolling.current = [P2Quantile.from_dict(s) for s in d["current"]]
+        rolling.previous = [P2Quantile.from_dict(s) for s in d["previous"]]
+        return rolling
@@ -0,0 +1,357 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""HTTP session shared by the HTTP calls of a check."""
+
+import dataclasses
+import logging
+import time
+from typing import Callable, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from requests.status_codes import codes
+from tenacity import stop_after_attempt
+
+from swh.core.retry import MAX_NUMBER_ATTEMPTS, http_retry, is_retryable_exception
+
+from .circuit import CircuitBreaker
+from .ratelimit import RateLimiter
+from .timing import RequestTiming, TimingAdapter, endpoint_template
+from .tracing import SPAN_KIND_CLIENT, Tracer
+from .usage import UsageStats
+
+logger = logging.getLogger(__name__)
+
+# Methods which can be retried on server errors without side effects
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+CONNECT_TIMEOUT = 10.0
+"""Maximum time (in seconds) to establish a connection"""
+
+PROBE_TIMEOUT = 5.0
+"""Maximum time (in seconds) to wait for the health probe of a backend"""
+
+
+def root_url(url: str) -> str:
+    """Returns the URL of the root of the server of ``url``"""
+    return urlunsplit(urlsplit(url)[:2] + ("/", "", ""))
+
+
+def _headers_size(headers) -> int:
+    return sum(len(f"{name}: {value}\r\n") for (name, value) in headers.items()) + 2
+
+
+def request_size(request: requests.PreparedRequest) -> int:
+    """Returns the approximate size of ``request`` on the wire"""
+    if isinstance(request.body, (bytes, str)):
+        body_size = len(request.body)
+    else:
+        # streamed bodies have a Content-Length header, or are chunked
+        body_size = int(request.headers.get("Content-Length", 0))
+    return (
+        len(f"{request.method} {request.path_url} HTTP/1.1\r\n")
+        + _headers_size(request.headers)
+        + body_size
+    )
+
+
+def _bytes_read(response: requests.Response) -> int:
+    # bytes read from the connection, before decompression
+    tell = getattr(response.raw, "tell", None)
+    return tell() if tell is not None else 0
+
+
+class DeadlineExceeded(requests.Timeout):
+    pass
+
+
+class Deadline:
+    """Time budget of a check, starting when it is created."""
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.start = time.monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+    def remaining(self) -> float:
+        return max(0.0, self.budget - self.elapsed)
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+@dataclasses.dataclass
+class RetryStats:
+    """Retries of the requests of a :class:`CheckSession`."""
+
+    retries: int = 0
+    """Number of requests sent again after a failed attempt"""
+    throttled: int = 0
+    """Number of responses with status code 429 (too many requests)"""
+    backoff_time: float = 0.0
+    """Total time spent waiting before retries"""
+    rate_limit_time: float = 0.0
+    """Total time spent waiting for the rate limiter"""
+
+
+class CheckSession(requests.Session):
+    """A :class:`requests.Session` retrying requests like
+    :func:`swh.core.retry.http_retry`, and keeping statistics on retries.
+
+    Requests are retried on throttling (status code 429) and connection errors,
+    and also on server errors (status code >= 500) for idempotent methods.
+    Unlike ``http_retry``, the last response is returned when all attempts
+    failed, so it can be dealt with by the client code like any other
+    unexpected response.
+
+    When a ``deadline`` is given, requests without an explicit ``timeout`` get
+    one from its remaining time, requests are not retried if the backoff would
+    exceed it, and :exc:`DeadlineExceeded` is raised once it expired.
+
+    When a ``rate_limiter`` is given, each attempt waits for it before being
+    sent.
+
+    When a ``circuit_breaker`` is given, the outcome of requests is recorded in
+    it, and requests to backends it considers down raise
+    :exc:`swh.icinga_plugins.circuit.CircuitOpen` instead of being sent.
+
+    When ``on_request_timing`` is given, it is called with the latency
+    breakdown of each request sent, see :mod:`swh.icinga_plugins.timing`.
+
+    When a ``tracer`` is given, each request gets a span in it, with an event
+    for each retry.
+
+    When ``usage`` is given, the requests sent and the bytes sent and received
+    are counted in it. The bodies of streamed responses are counted when they
+    are closed.
+
+    Args:
+        on_retry_stat: called with the name of a field of :class:`RetryStats`
+            and the amount it is increased by, on each update of ``retry_stats``
+        deadline: time budget of the requests of the session
+        rate_limiter: limits the rate of requests to each host
+        circuit_breaker: keeps track of backends which are down
+        on_request_timing: called with the :class:`RequestTiming` of each request
+        tracer: records the spans of the requests
+        usage: counts the requests and the bytes sent and received
+    """
+
+    def __init__(
+        self,
+        on_retry_stat: Optional[Callable[[str, float], None]] = None,
+        deadline: Optional[Deadline] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        on_request_timing: Optional[Callable[[RequestTiming], None]] = None,
+        tracer: Optional[Tracer] = None,
+        usage: Optional[UsageStats] = None,
+    ):
+        super().__init__()
+        self.retry_stats = RetryStats()
+        self._on_retry_stat = on_retry_stat
+        self.deadline = deadline
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
+        self._on_request_timing = on_request_timing
+        self.tracer = tracer
+        self.usage = usage
+        if on_request_timing is not None:
+            self.mount("http://", TimingAdapter(on_request_timing))
+            self.mount("https://", TimingAdapter(on_request_timing))
+
+    def derive(self) -> "CheckSession":
+        """Returns a new session, with the same deadline and retry statistics,
+        e.g. to set credentials only used with another server."""
+        session = CheckSession(
+            self._on_retry_stat,
+            self.deadline,
+            self.rate_limiter,
+            self.circuit_breaker,
+            self._on_request_timing,
+            self.tracer,
+            self.usage,
+        )
+        session.retry_stats = self.retry_stats
+        return session
+
+    def timeout(self) -> Tuple[float, Optional[float]]:
+        """Returns the connect and read timeouts of a request sent now.
+
+        Raises:
+            DeadlineExceeded: if the deadline expired
+        """
+        if self.deadline is None:
+            return (CONNECT_TIMEOUT, None)
+        remaining = self.deadline.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Deadline of {self.deadline.budget:.2f}s exceeded")
+        return (min(CONNECT_TIMEOUT, remaining), remaining)
+
+    def _add_retry_stat(self, name: str, amount: float) -> None:
+        setattr(self.retry_stats, name, getattr(self.retry_stats, name) + amount)
+        if self._on_retry_stat is not None:
+            self._on_retry_stat(name, amount)
+
+    def _should_retry(self, retry_state) -> bool:
+        method = retry_state.args[0].upper()
+        outcome = retry_state.outcome
+        if outcome.failed:
+            return method in IDEMPOTENT_METHODS and is_retryable_exception(
+                outcome.exception()
+            )
+
+        status_code = outcome.result().status_code
+        if method not in IDEMPOTENT_METHODS:
+            return status_code == codes.too_many_requests
+        return status_code >= codes.too_many_requests
+
+    def _before_sleep(self, retry_state) -> None:
+        outcome = retry_state.outcome
+        backoff = retry_state.next_action.sleep
+        logger.warning(
+            "Retrying %s %s in %.2fs after %s",
+            retry_state.args[0],
+            retry_state.args[1],
+            backoff,
+            outcome.exception() if outcome.failed else outcome.result(),
+        )
+        self._add_retry_stat("retries", 1)
+        self._add_retry_stat("backoff_time", backoff)
+        span = self.tracer.current if self.tracer is not None else None
+        if span is not None:
+            span.add_event(
+                "retry",
+                backoff=backoff,
+                reason=str(outcome.exception() if outcome.failed else outcome.result()),
+            )
+
+    def _stop(self, retry_state) -> bool:
+        if stop_after_attempt(MAX_NUMBER_ATTEMPTS)(retry_state):
+            return True
+        return (
+            self.deadline is not None
+            and retry_state.upcoming_sleep >= self.deadline.remaining()
+        )
+
+    def _attempt(self, method, url, *args, **kwargs) -> requests.Response:
+        if self.rate_limiter is not None:
+            wait = self.rate_limiter.acquire(url)
+            if wait > 0:
+                self._add_retry_stat("rate_limit_time", wait)
+        if "timeout" not in kwargs:
+            kwargs["timeout"] = self.timeout()
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except requests.RequestException:
+            if self.usage is not None:
+                self.usage.add("http_requests")
+            raise
+        self._count_usage(response, stream=bool(kwargs.get("stream")))
+        if response.status_code == codes.too_many_requests:
+            self._add_retry_stat("throttled", 1)
+        return response
+
+    def _count_usage(self, response: requests.Response, stream: bool = False) -> None:
+        """Counts ``response`` and the redirections which led to it in
+        :attr:`usage`, and the body of ``response`` once closed if it is
+        streamed"""
+        usage = self.usage
+        if usage is None:
+            return
+        for sent in [*response.history, response]:
+            usage.add("http_requests")
+            usage.add("http_bytes_sent", request_size(sent.request))
+            usage.add(
+                "http_bytes_received",
+                len(f"HTTP/1.1 {sent.status_code} {sent.reason}\r\n")
+                + _headers_size(sent.headers)
+                + _bytes_read(sent),
+            )
+
+        if stream:
+            start = _bytes_read(response)
+            close = response.close
+
+            def counting_close() -> None:
+                usage.add("http_bytes_received", _bytes_read(response) - start)
+                close()
+
+            response.close = counting_close  # type: ignore[method-assign]
+
+    def probe(
+        self,
+        url: str,
+        method: str = "HEAD",
+        error_status: int = codes.internal_server_error,
+    ) -> Optional[str]:
+        """Sends a single ``method`` request to ``url``, with a short timeout and
+        without retries, and returns why it failed if it did: an error, or a
+        status code of at least ``error_status``."""
+        try:
+            (connect_timeout, read_timeout) = self.timeout()
+            timeout = min(read_timeout or PROBE_TIMEOUT, PROBE_TIMEOUT)
+            response = super().request(
+                method, url, timeout=(min(connect_timeout, timeout), timeout)
+            )
+        except requests.RequestException as e:
+            if self.usage is not None:
+                self.usage.add("http_requests")
+            return str(e)
+        self._count_usage(response)
+        if response.status_code >= error_status:
+            return f"status code {response.status_code}"
+        return None
+
+    def request(self, method, url, *args, **kwargs) -> requests.Response:
+        if self.tracer is None:
+            return self._request(method, url, *args, **kwargs)
+
+        endpoint = endpoint_template(url)
+        with self.tracer.span(
+            f"{method.upper()} {endpoint}",
+            SPAN_KIND_CLIENT,
+            {
+                "http.request.method": method.upper(),
+                "url.full": url,
+                "url.template": endpoint,
+            },
+        ) as span:
+            response = self._request(method, url, *args, **kwargs)
+            span.set_attribute("http.response.status_code", response.status_code)
+            if response.status_code >= codes.internal_server_error:
+                span.set_error(f"status code {response.status_code}")
+            return response
+
+    def _request(self, method, url, *args, **kwargs) -> requests.Response:
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.before_request(
+                url, lambda url: self.probe(root_url(url))
+            )
+
+        try:
+            response = http_retry(
+                retry=self._should_retry,
+                stop=self._stop,
+                before_sleep=self._before_sleep,
+                retry_error_callback=lambda retry_state: retry_state.outcome.result(),
+            )(self._attempt)(method, url, *args, **kwargs)
+        except DeadlineExceeded:
+            # not a failure of the backend
+            raise
+        except requests.RequestException:
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.record(url, failed=True)
+            raise
+
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record(
+                url, failed=response.status_code >= codes.internal_server_error
+            )
+        return response
@@ -0,0 +1,57 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Performance data of the results of checks, in the format of the Nagios
+plugin guidelines, which Icinga parses to write time series (eg. with its
+Graphite or InfluxDB writers)::
+
+    'label'=value[UOM];[warn];[crit];[min];[max]
+"""
+
+import dataclasses
+import re
+from typing import Iterable, Optional
+
+# Characters which require the label to be quoted
+_QUOTED_LABEL_CHARS = re.compile(r"[\s=']")
+
+
+def _format_number(value: Optional[float]) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, int):
+        return str(value)
+    return f"{value:.6f}".rstrip("0").rstrip(".")
+
+
+@dataclasses.dataclass
+class PerfData:
+    label: str
+    value: float
+    uom: str = ""
+    """Unit of measurement: ``s``, ``B``, ``%``, or empty for counts"""
+    warn: Optional[float] = None
+    crit: Optional[float] = None
+    min: Optional[float] = None
+    max: Optional[float] = None
+
+    def __str__(self) -> str:
+        label = self.label
+        if _QUOTED_LABEL_CHARS.search(label):
+            label = "'" + label.replace("'", "''") + "'"
+        fields = [
+            f"{_format_number(self.value)}{self.uom}",
+            _format_number(self.warn),
+            _format_number(self.crit),
+            _format_number(self.min),
+            _format_number(self.max),
+        ]
+        return f"{label}=" + ";".join(fields).rstrip(";")
+
+
+def format_perfdata(perfdata: Iterable[PerfData]) -> str:
+    """Returns the performance data to print after ``|`` on the first line of
+    the output of a check"""
+    return " ".join(str(item) for item in perfdata)
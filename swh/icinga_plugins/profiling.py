@@ -0,0 +1,85 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""CPU and memory profiles of the runs of checks."""
+
+import cProfile
+import contextlib
+import os
+import time
+import tracemalloc
+from typing import Iterator, Optional
+
+TOP_ALLOCATIONS = 25
+"""Number of lines allocating the most memory written in memory reports"""
+
+
+class RunProfiler:
+    """Profiles a run of a check with :mod:`cProfile` and/or :mod:`tracemalloc`,
+    and writes the profiles to ``directory``, in files named after ``name``
+    and the time of the run:
+
+    * ``<prefix>.pstats``: CPU profile, to be read with :mod:`pstats` or
+      tools like snakeviz
+    * ``<prefix>.tracemalloc``: memory snapshot, to be loaded with
+      :meth:`tracemalloc.Snapshot.load`
+    * ``<prefix>.memory.txt``: lines which allocated the most memory still
+      allocated at the end of the run
+
+    cProfile only profiles the thread it was started in, so requests sent by
+    worker threads are not in CPU profiles (but their CPU time is counted in
+    :attr:`cpu_time`)."""
+
+    def __init__(self, directory: str, name: str, cpu: bool, memory: bool):
+        self.directory = directory
+        self.cpu = cpu
+        self.memory = memory
+        self.prefix = os.path.join(
+            directory,
+            f"{name}-{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())}-{os.getpid()}",
+        )
+        self.cpu_time: Optional[float] = None
+        """CPU time of the process (all threads) during the run"""
+        self.peak_memory: Optional[int] = None
+        """Peak size of the memory blocks traced during the run, in bytes"""
+
+    @contextlib.contextmanager
+    def profile(self) -> Iterator[None]:
+        os.makedirs(self.directory, exist_ok=True)
+        profiler = cProfile.Profile() if self.cpu else None
+        started_tracing = False
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracemalloc.reset_peak()
+
+        start_cpu_time = time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            self.cpu_time = time.process_time() - start_cpu_time
+            if profiler is not None:
+                profiler.dump_stats(self.prefix + ".pstats")
+            if self.memory:
+                self._write_memory_report()
+                if started_tracing:
+                    tracemalloc.stop()
+
+    def _write_memory_report(self) -> None:
+        (_, self.peak_memory) = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+        snapshot.dump(self.prefix + ".tracemalloc")
+        with open(self.prefix + ".memory.txt", "w") as fd:
+            fd.write(f"Peak traced memory: {self.peak_memory} bytes\n")
+            fd.write(f"Top {TOP_ALLOCATIONS} lines of allocated memory:\n")
+            for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+                fd.write(f"{stat}\n")
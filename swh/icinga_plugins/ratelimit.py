@@ -0,0 +1,124 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Rate limiting of the HTTP requests sent to each backend by the checks."""
+
+import fcntl
+import functools
+import os
+import re
+import struct
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+
+class TokenBucket:
+    """Token bucket allowing ``rate`` requests per second on average, and bursts
+    of up to ``burst`` requests, shared by the threads of a process.
+
+    Requests reserve their token, possibly making the bucket negative, then wait
+    until it is refilled, so waiting requests are served in order."""
+
+    def __init__(self, rate: float, burst: float):
+        if rate <= 0 or burst < 1:
+            raise ValueError("Rate limits need a positive rate and a burst of 1+")
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: float, last: float, now: float) -> Tuple[float, float]:
+        """Takes a token from a bucket with ``tokens`` at time ``last``, and
+        returns the tokens left and how long to wait for the taken one."""
+        tokens = min(self.burst, tokens + max(0.0, now - last) * self.rate) - 1
+        return (tokens, max(0.0, -tokens / self.rate))
+
+    def reserve(self) -> float:
+        """Takes a token, and returns how long to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            (self._tokens, wait) = self._reserve(self._tokens, self._last, now)
+            self._last = now
+        return wait
+
+    def acquire(self) -> float:
+        """Waits for a token, and returns how long it waited"""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class FileTokenBucket(TokenBucket):
+    """:class:`TokenBucket` whose state is kept in a locked file at ``path``,
+    so it is shared by all processes using the same file."""
+
+    STATE = struct.Struct("<dd")
+
+    def __init__(self, path: str, rate: float, burst: float):
+        super().__init__(rate, burst)
+        self.path = path
+
+    def reserve(self) -> float:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._lock, open(self.path, "a+b") as fd:
+            # the lock is released when the file is closed
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            # the monotonic clock is system-wide, and _reserve ignores times
+            # going backwards after a reboot
+            now = time.monotonic()
+            fd.seek(0)
+            try:
+                (tokens, last) = self.STATE.unpack(fd.read())
+            except struct.error:
+                (tokens, last) = (self.burst, now)
+            (tokens, wait) = self._reserve(tokens, last, now)
+            fd.truncate(0)
+            fd.write(self.STATE.pack(tokens, now))
+        return wait
+
+
+class RateLimiter:
+    """Rate limits requests with one :class:`TokenBucket` per backend host.
+
+    If a ``directory`` is given, buckets are :class:`FileTokenBucket` in that
+    directory, shared with the other processes using it."""
+
+    def __init__(self, rate: float, burst: float, directory: Optional[str] = None):
+        self.rate = rate
+        self.burst = burst
+        self.directory = directory
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, host: str) -> TokenBucket:
+        with self._lock:
+            if host not in self._buckets:
+                if self.directory is None:
+                    bucket = TokenBucket(self.rate, self.burst)
+                else:
+                    filename = re.sub(r"[^\w.-]", "_", host) + ".bucket"
+                    bucket = FileTokenBucket(
+                        os.path.join(self.directory, filename), self.rate, self.burst
+                    )
+                self._buckets[host] = bucket
+            return self._buckets[host]
+
+    def acquire(self, url: str) -> float:
+        """Waits until a request can be sent to ``url``, and returns how long
+        it waited"""
+        return self.bucket(urlsplit(url).netloc).acquire()
+
+
+@functools.lru_cache(maxsize=None)
+def shared_rate_limiter(
+    rate: float, burst: float, directory: Optional[str] = None
+) -> RateLimiter:
+    """Returns the :class:`RateLimiter` of the process for the given limits, so
+    all checks of a process share the same buckets."""
+    return RateLimiter(rate, burst, directory)
@@ -3,43 +3,206 @@
 # License: GNU General Public License version 3, or any later version
 # See top-level LICENSE file for more information
 
+from concurrent.futures import ThreadPoolExecutor
+import datetime
 import random
 import time
-from typing import Dict, List, Union
+from typing import Dict, List, Optional, Tuple, Union
 
 import requests
 
-from .base_check import BaseCheck
+from .base_check import BaseCheck, PreflightProbe
 
 REPORT_MSG = "Save code now request for origin"
 
 WAITING_STATUSES = ("pending", "scheduled", "running")
 
 
+def parse_date(date: Optional[str]) -> Optional[datetime.datetime]:
+    """Parses an ISO 8601 date of the swh-web API, as UTC if it has no offset,
+    or returns :const:`None` if it is missing or invalid"""
+    if not date:
+        return None
+    try:
+        parsed = datetime.datetime.fromisoformat(date.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
+
+
 class SaveCodeNowCheck(BaseCheck):
     TYPE = "SAVECODENOW"
     DEFAULT_WARNING_THRESHOLD = 60
     DEFAULT_CRITICAL_THRESHOLD = 120
+    DURATION_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 45, 60, 90, 120, 300)
 
     def __init__(
-        self, obj: Dict, origin: Union[str, List[str]], visit_type: str
+        self,
+        obj: Dict,
+        origin: Union[str, List[str]],
+        visit_type: str,
+        check_visit: bool = False,
     ) -> None:
         super().__init__(obj, application="scn")
-        if isinstance(origin, list):
-            origin = random.choice(origin)
+        self.origins = origin if isinstance(origin, list) else [origin]
         self.api_url = obj["swh_web_url"].rstrip("/")
         self.poll_interval = obj["poll_interval"]
-        self.origin = origin
+        self.origin = random.choice(self.origins)
         self.visit_type = visit_type
+        self.history_key = f"scn_{visit_type}"
+        self.check_visit = check_visit
 
-        self.register_prometheus_gauge("duration", "seconds", ["status"])
+        self.register_prometheus_gauge(
+            "duration", "seconds", ["status"], buckets=self.DURATION_BUCKETS
+        )
         self.register_prometheus_gauge("status", "")
+        self.register_prometheus_gauge(
+            "verification_duration",
+            "seconds",
+            ["step", "status"],
+            buckets=self.DURATION_BUCKETS,
+        )
+
+    def preflight_probes(self) -> List[PreflightProbe]:
+        return [PreflightProbe("swh-web", self.api_url + "/")]
 
     @staticmethod
     def api_url_scn(root_api_url: str, origin: str, visit_type: str) -> str:
         """Compute the save code now api url for a given origin"""
         return f"{root_api_url}/api/1/origin/save/{visit_type}/url/{origin}/"
 
+    @staticmethod
+    def api_url_latest_visit(root_api_url: str, origin: str) -> str:
+        """Compute the api url of the latest visit with a snapshot of an origin"""
+        return (
+            f"{root_api_url}/api/1/origin/{origin}/visit/latest/?require_snapshot=true"
+        )
+
+    @staticmethod
+    def api_url_snapshot(root_api_url: str, snapshot_id: str) -> str:
+        """Compute the api url of a snapshot"""
+        return f"{root_api_url}/api/1/snapshot/{snapshot_id}/"
+
+    def _timed_get(self, url: str) -> Tuple[requests.Response, float]:
+        start_time = time.time()
+        response = self.session.get(url)
+        return response, time.time() - start_time
+
+    def find_save_request(self, scn_url: str, request_date: str) -> Optional[Dict]:
+        """Returns the save request of the origin made at ``request_date``, or
+        :const:`None` if it does not exist (anymore)"""
+        response = self.session.get(scn_url)
+        if response.status_code == 404:
+            return None
+        assert (
+            response.status_code == 200
+        ), f"Unexpected response: {response}, {response.text}"
+        raw_result: List[Dict] = response.json()
+
+        # this because the api can return multiple entries for the same origin
+        return next(
+            (r for r in raw_result if r["save_request_date"] == request_date), None
+        )
+
+    def get_save_request(self, scn_url: str, request_date: str) -> Dict:
+        """Returns the save request of the origin made at ``request_date``"""
+        result = self.find_save_request(scn_url, request_date)
+        assert result is not None, f"No save request made at {request_date}"
+        return result
+
+    def _resume_save_request(self) -> Optional[Tuple[float, str, Dict]]:
+        """Returns the start time, date and current status of the save request
+        made by a previous interrupted run, if it can be resumed."""
+        checkpoint = self.load_checkpoint()
+        if checkpoint is None or checkpoint["origin"] not in self.origins:
+            return None
+        scn_url = self.api_url_scn(self.api_url, checkpoint["origin"], self.visit_type)
+        result = self.find_save_request(scn_url, checkpoint["request_date"])
+        if result is None:
+            # eg. the save request was deleted, make a new one
+            self.clear_checkpoint()
+            return None
+        self.origin = checkpoint["origin"]
+        return (checkpoint["start_time"], checkpoint["request_date"], result)
+
+    def verify_visit(self, result: Dict, metrics: Dict[str, float]) -> Optional[str]:
+        """Checks the latest visit of the origin is the one of the save request
+        (or a later one), and that it and its snapshot can be read from swh-web,
+        and records the duration of each read in ``metrics``.
+
+        When the save request already references its snapshot, both reads are
+        sent concurrently; otherwise the snapshot is only known once the visit
+        is read, and its request reuses the connection opened for the visit.
+
+        Returns:
+            an error message if the verification failed, None otherwise
+
+        """
+        visit_url = self.api_url_latest_visit(self.api_url, self.origin)
+        snapshot_swhid = result.get("snapshot_swhid")
+        snapshot_id = snapshot_swhid.split(":")[-1] if snapshot_swhid else None
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            visit_future = executor.submit(self._timed_get, visit_url)
+            snapshot_future = None
+            if snapshot_id:
+                snapshot_future = executor.submit(
+                    self._timed_get, self.api_url_snapshot(self.api_url, snapshot_id)
+                )
+
+            response, metrics["visit_time"] = visit_future.result()
+            if response.status_code != 200:
+                self.collect_prometheus_metric(
+                    "verification_duration", metrics["visit_time"], ["visit", "error"]
+                )
+                return f"getting its latest visit returned code {response.status_code}"
+
+            visit = response.json()
+            # the visit date of the save request is only set once it succeeded
+            request_date = parse_date(result.get("visit_date")) or parse_date(
+                result.get("save_request_date")
+            )
+            visit_date = parse_date(visit.get("date"))
+            if request_date is not None and (
+                visit_date is None or visit_date < request_date
+            ):
+                self.collect_prometheus_metric(
+                    "verification_duration", metrics["visit_time"], ["visit", "stale"]
+                )
+                return (
+                    f"its latest visit {visit.get('visit')} ({visit.get('date')}) is "
+                    f"older than the save request"
+                )
+            self.collect_prometheus_metric(
+                "verification_duration", metrics["visit_time"], ["visit", "ok"]
+            )
+
+            if visit.get("snapshot") is None:
+                return f"its latest visit {visit.get('visit')} has no snapshot"
+
+            if snapshot_future is None or visit["snapshot"] != snapshot_id:
+                # the visit is more recent than the snapshot of the save request
+                snapshot_future = executor.submit(
+                    self._timed_get,
+                    self.api_url_snapshot(self.api_url, visit["snapshot"]),
+                )
+            response, metrics["snapshot_time"] = snapshot_future.result()
+
+        if response.status_code != 200:
+            self.collect_prometheus_metric(
+                "verification_duration", metrics["snapshot_time"], ["snapshot", "error"]
+            )
+            return (
+                f"getting the snapshot of its latest visit returned code "
+                f"{response.status_code}"
+            )
+        self.collect_prometheus_metric(
+            "verification_duration", metrics["snapshot_time"], ["snapshot", "ok"]
+        )
+        return None
+
     def main(self) -> int:
         """Scenario description:
 
@@ -51,42 +214,53 @@ class SaveCodeNowCheck(BaseCheck):
         3. When either succeeded, failed or threshold exceeded, report approximate time
         of completion. This will warn if thresholds are exceeded.
 
+        4. Optionally, when succeeded, read the latest visit of the origin and its
+        snapshot, and report the time until they are available (freshness).
+
         """
-        start_time: float = time.time()
-        total_time: float = 0.0
-        scn_url = self.api_url_scn(self.api_url, self.origin, self.visit_type)
-        response = requests.post(scn_url)
-        assert response.status_code == 200, (response, response.text)
+        self.start_phase("request")
+        resumed = self._resume_save_request()
+        if resumed is not None:
+            # the save request of an interrupted run is still pending
+            (start_time, request_date, result) = resumed
+            scn_url = self.api_url_scn(self.api_url, self.origin, self.visit_type)
+            total_time: float = time.time() - start_time
+        else:
+            start_time = time.time()
+            total_time = 0.0
+            scn_url = self.api_url_scn(self.api_url, self.origin, self.visit_type)
+            response = self.session.post(scn_url)
+            assert response.status_code == 200, (response, response.text)
 
-        result: Dict = response.json()
+            result = response.json()
+            request_date = result["save_request_date"]
+            self.save_checkpoint(
+                {
+                    "origin": self.origin,
+                    "start_time": start_time,
+                    "request_date": request_date,
+                }
+            )
 
+        self.identifiers.update(
+            origin=self.origin,
+            visit_type=self.visit_type,
+            save_request_date=request_date,
+        )
         status_key = "save_task_status"
-        request_date = result["save_request_date"]
         origin_info = (self.visit_type, self.origin)
 
+        self.start_phase("wait")
         while result[status_key] in WAITING_STATUSES:
+            self.report_progress(result[status_key])
+            self.usage.add("polls")
             time.sleep(self.poll_interval)
-            response = requests.get(scn_url)
-            assert (
-                response.status_code == 200
-            ), f"Unexpected response: {response}, {response.text}"
-            raw_result: List[Dict] = response.json()
-            assert len(raw_result) > 0, f"Unexpected result: {raw_result}"
-
-            if len(raw_result) > 1:
-                # retrieve only the one status result we are interested in
-                result = next(
-                    filter(lambda r: r["save_request_date"] == request_date, raw_result)
-                )
-            else:
-                result = raw_result[0]
-
-            # this because the api can return multiple entries for the same origin
-            assert result["save_request_date"] == request_date
+            result = self.get_save_request(scn_url, request_date)
 
             total_time = time.time() - start_time
 
             if total_time > self.critical_threshold:
+                self.clear_checkpoint()
                 self.print_result(
                     "CRITICAL",
                     f"{REPORT_MSG} {origin_info} took more than {total_time:.2f}s "
@@ -97,12 +271,32 @@ class SaveCodeNowCheck(BaseCheck):
                 self.collect_prometheus_metric("status", 2)
                 return 2
 
+        self.clear_checkpoint()
         if result[status_key] == "succeeded":
-            (status_code, status) = self.get_status(total_time)
+            metrics = {"total_time": total_time}
+            if self.check_visit:
+                self.report_progress("verify_visit")
+                self.start_phase("verify")
+                error = self.verify_visit(result, metrics)
+                metrics["freshness_time"] = time.time() - start_time
+                if error is not None:
+                    self.print_result(
+                        "CRITICAL",
+                        f"{REPORT_MSG} {origin_info} took {total_time:.2f}s and "
+                        f"succeeded, but {error}.",
+                        **metrics,
+                    )
+                    self.collect_prometheus_metric(
+                        "duration", total_time, ["visit_error"]
+                    )
+                    self.collect_prometheus_metric("status", 2)
+                    return 2
+
+            status_code, status = self.get_status(total_time)
             self.print_result(
                 status,
                 f"{REPORT_MSG} {origin_info} took {total_time:.2f}s and succeeded.",
-                total_time=total_time,
+                **metrics,
             )
             self.collect_prometheus_metric("duration", total_time, ["succeeded"])
             self.collect_prometheus_metric("status", status_code)
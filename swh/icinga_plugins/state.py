@@ -0,0 +1,67 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""JSON documents kept on disk by checks between runs."""
+
+import contextlib
+import fcntl
+import json
+import os
+import tempfile
+from typing import Any, Dict, Iterator
+
+
+def load_json(path: str) -> Dict[str, Any]:
+    """Loads the JSON document at ``path``, or returns an empty dict if it does
+    not exist or is invalid."""
+    try:
+        with open(path) as fd:
+            return json.load(fd)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+@contextlib.contextmanager
+def lock_file(path: str) -> Iterator[None]:
+    """Holds an exclusive advisory lock on ``path``, for read-modify-write
+    updates of a file shared by concurrent runs of checks (in other processes
+    or threads)."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as fd:
+        # the lock is released when the file is closed
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+
+
+def _umask() -> int:
+    # the umask can only be read by setting it
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def save_text(path: str, text: str) -> None:
+    """Atomically writes ``text`` to ``path``, so concurrent readers never see a
+    partially written file.
+
+    The file gets the mode :func:`open` would give it (eg. 0644 with a 0022
+    umask), not the 0600 of temporary files, so it can be read by other users
+    (eg. the node exporter reading textfiles)."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path))
+    try:
+        os.fchmod(fd, 0o666 & ~_umask())
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def save_json(path: str, document: Dict[str, Any]) -> None:
+    """Atomically writes ``document`` as JSON to ``path``"""
+    save_text(path, json.dumps(document))
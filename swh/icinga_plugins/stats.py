@@ -0,0 +1,258 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Statistics over the history of the checks, to detect anomalies and trends.
+
+The history files written by :class:`swh.icinga_plugins.history.HistoryStore`
+are memory-mapped as record arrays, and all statistics are computed with
+vectorized numpy operations. This module needs the optional ``numpy``
+dependency (``swh.icinga_plugins[stats]``).
+"""
+
+import dataclasses
+import math
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .base_check import BaseCheck
+from .history import RECORD, STATUS_CODES, HistoryStore
+from .http_client import DeadlineExceeded
+
+RECORD_DTYPE = np.dtype([("timestamp", "<f8"), ("value", "<f8"), ("status", "<i4")])
+assert RECORD_DTYPE.itemsize == RECORD.size
+
+DAY = 24 * 3600
+
+
+def load_history(path: str) -> np.ndarray:
+    """Memory-maps the records of a history file, ignoring a trailing
+    truncated record."""
+    try:
+        count = os.path.getsize(path) // RECORD_DTYPE.itemsize
+    except FileNotFoundError:
+        count = 0
+    if count == 0:
+        return np.empty(0, dtype=RECORD_DTYPE)
+    return np.memmap(path, dtype=RECORD_DTYPE, mode="r", shape=(count,))
+
+
+def ewma(values: np.ndarray, alpha: float) -> np.ndarray:
+    """Returns the exponentially weighted moving average of ``values``, with
+    smoothing factor ``alpha``.
+
+    The recurrence ``s[i] = alpha * x[i] + (1 - alpha) * s[i - 1]`` is unrolled
+    as cumulative sums of values weighted by powers of ``1 / (1 - alpha)``.
+    Blocks are short enough for these powers not to overflow."""
+    values = np.asarray(values, dtype=np.float64)
+    result = np.empty_like(values)
+    if len(values) == 0:
+        return result
+    if alpha >= 1:
+        result[:] = values
+        return result
+
+    decay = 1 - alpha
+    block_size = max(1, int(200 / -math.log(decay)))
+    previous = values[0]
+    for start in range(0, len(values), block_size):
+        block = values[start : start + block_size]
+        powers = decay ** -np.arange(1, len(block) + 1, dtype=np.float64)
+        weighted = np.cumsum(alpha * block * powers)
+        result[start : start + len(block)] = (previous + weighted) / powers
+        previous = result[start + len(block) - 1]
+    return result
+
+
+def ewma_zscore(values: np.ndarray, alpha: float) -> Optional[float]:
+    """Returns the z-score of the last value against the EWMA mean and
+    variance of the values before it, or :const:`None` if they do not vary."""
+    if len(values) < 2:
+        return None
+    previous = values[:-1]
+    mean = ewma(previous, alpha)[-1]
+    variance = ewma((previous - mean) ** 2, alpha)[-1]
+    if variance <= 0:
+        return None
+    return float((values[-1] - mean) / math.sqrt(variance))
+
+
+def linear_trend(timestamps: np.ndarray, values: np.ndarray) -> Optional[float]:
+    """Returns the slope of the least-squares line through the values, in
+    units per day, or :const:`None` if there are less than two timestamps."""
+    if len(timestamps) < 2 or np.ptp(timestamps) == 0:
+        return None
+    days = (timestamps - timestamps[0]) / DAY
+    (slope, _) = np.polyfit(days, values, 1)
+    return float(slope)
+
+
+def burn_rate(statuses: np.ndarray, slo_target: float) -> Optional[float]:
+    """Returns the rate at which the error budget of the ``slo_target`` ratio of
+    successful runs is consumed: 1 means it is exactly used up by the end of
+    the SLO period. Runs which did not end in the OK or WARNING state are
+    errors."""
+    if len(statuses) == 0:
+        return None
+    error_ratio = np.count_nonzero(statuses >= STATUS_CODES["CRITICAL"]) / len(statuses)
+    return float(error_ratio / (1 - slo_target))
+
+
+@dataclasses.dataclass
+class HistoryStats:
+    check: str
+    metric: str
+    count: int
+    last: Optional[float]
+    ewma: Optional[float]
+    zscore: Optional[float]
+    trend: Optional[float]
+    """Slope of the values over the trend window, per day"""
+    burn_rate: Optional[float]
+
+
+def compute_stats(
+    path: str,
+    check: str,
+    metric: str,
+    now: float,
+    alpha: float = 0.1,
+    trend_days: float = 7,
+    slo_target: float = 0.99,
+    slo_window_days: float = 1,
+) -> HistoryStats:
+    """Computes the statistics of a history file"""
+    history = load_history(path)
+    timestamps = history["timestamp"]
+    if np.any(timestamps[1:] < timestamps[:-1]):
+        # concurrent runs may append their records out of order
+        history = history[np.argsort(timestamps, kind="stable")]
+    values = history["value"]
+    timestamps = history["timestamp"]
+
+    trend_start = np.searchsorted(timestamps, now - trend_days * DAY)
+    slo_start = np.searchsorted(timestamps, now - slo_window_days * DAY)
+    return HistoryStats(
+        check=check,
+        metric=metric,
+        count=len(history),
+        last=float(values[-1]) if len(values) else None,
+        ewma=float(ewma(values, alpha)[-1]) if len(values) else None,
+        zscore=ewma_zscore(values, alpha),
+        trend=linear_trend(timestamps[trend_start:], values[trend_start:]),
+        burn_rate=burn_rate(history["status"][slo_start:], slo_target),
+    )
+
+
+def _format(value: Optional[float], fmt: str) -> str:
+    return "-" if value is None else format(value, fmt)
+
+
+class StatsReport(BaseCheck):
+    """Reports statistics over the history of all checks of an environment, and
+    exports them to Prometheus."""
+
+    TYPE = "STATS"
+
+    def __init__(
+        self,
+        obj,
+        metric: str = "total_time",
+        alpha: float = 0.1,
+        trend_days: float = 7,
+        slo_target: float = 0.99,
+        slo_window_days: float = 1,
+    ):
+        super().__init__(obj, application="stats")
+        self.metric = metric
+        self.alpha = alpha
+        self.trend_days = trend_days
+        self.slo_target = slo_target
+        self.slo_window_days = slo_window_days
+        self._stats: List[HistoryStats] = []
+
+        self.register_prometheus_gauge("history_ewma", "seconds", ["check", "metric"])
+        self.register_prometheus_gauge("history_zscore", "", ["check", "metric"])
+        self.register_prometheus_gauge(
+            "history_trend", "seconds_per_day", ["check", "metric"]
+        )
+        self.register_prometheus_gauge("slo_burn_rate", "", ["check"])
+
+    def compute(self) -> List[HistoryStats]:
+        assert self.state_directory is not None
+        history_directory = os.path.join(
+            self.state_directory, "history", self.environment or "default"
+        )
+        try:
+            checks = sorted(os.listdir(history_directory))
+        except FileNotFoundError:
+            checks = []
+
+        now = time.time()
+        stats = []
+        for check in checks:
+            if self.deadline is not None and self.deadline.expired:
+                raise DeadlineExceeded(
+                    f"Deadline of {self.deadline.budget:.2f}s exceeded"
+                )
+            store = HistoryStore(os.path.join(history_directory, check))
+            if self.metric not in store.metrics():
+                continue
+            stats.append(
+                compute_stats(
+                    store.path(self.metric),
+                    check,
+                    self.metric,
+                    now,
+                    alpha=self.alpha,
+                    trend_days=self.trend_days,
+                    slo_target=self.slo_target,
+                    slo_window_days=self.slo_window_days,
+                )
+            )
+        return stats
+
+    def result_document(
+        self, status_type: str, status_string: str, metrics: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        document = super().result_document(status_type, status_string, metrics)
+        document["stats"] = [dataclasses.asdict(s) for s in self._stats]
+        return document
+
+    def main(self) -> int:
+        stats = self.compute()
+        self._stats = stats
+
+        lines = [
+            f"{'check':<24} {'samples':>8} {'last':>10} {'ewma':>10} "
+            f"{'z-score':>8} {'trend/day':>10} {'burn rate':>9}"
+        ]
+        for s in stats:
+            lines.append(
+                f"{s.check:<24} {s.count:>8} {_format(s.last, '.2f'):>10} "
+                f"{_format(s.ewma, '.2f'):>10} {_format(s.zscore, '.2f'):>8} "
+                f"{_format(s.trend, '+.2f'):>10} {_format(s.burn_rate, '.2f'):>9}"
+            )
+
+            gauges: Dict[str, Optional[float]] = {
+                "history_ewma": s.ewma,
+                "history_zscore": s.zscore,
+                "history_trend": s.trend,
+            }
+            for name, value in gauges.items():
+                if value is not None:
+                    self.collect_prometheus_metric(name, value, [s.check, s.metric])
+            if s.burn_rate is not None:
+                self.collect_prometheus_metric("slo_burn_rate", s.burn_rate, [s.check])
+
+        # the table is the long output of the result
+        self.print_result(
+            "OK",
+            "\n".join([f"Statistics of {self.metric} in {len(stats)} checks"] + lines),
+            checks=len(stats),
+        )
+        return 0
@@ -0,0 +1,106 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Generation of synthetic deposits, whose content is unique to each run so
+that it is not deduplicated by the archive and actually loaded."""
+
+import hashlib
+import random
+import tarfile
+from typing import Iterator, List
+
+BLOCK_SIZE = tarfile.BLOCKSIZE
+RECORD_SIZE = tarfile.RECORDSIZE
+CHUNK_SIZE = 64 * 1024
+
+METADATA_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
+<entry xmlns="http://www.w3.org/2005/Atom"
+xmlns:codemeta="https://doi.org/10.5063/SCHEMA/CODEMETA-2.0">
+  <title>Synthetic deposit {seed}</title>
+  <codemeta:description>Synthetic archive of {file_count} files and {size} bytes
+    generated by swh-icinga-plugins.</codemeta:description>
+  <codemeta:identifier>{seed}</codemeta:identifier>
+  <codemeta:author>
+    <codemeta:name>swh-icinga-plugins</codemeta:name>
+  </codemeta:author>
+</entry>
+"""
+
+
+def _padding(length: int, size: int) -> int:
+    return -length % size
+
+
+class SyntheticArchive:
+    """Uncompressed tarball of ``file_count`` files of pseudo-random content,
+    totalling ``size`` bytes of content.
+
+    The tarball is never stored: :meth:`chunks` generates it on the fly, and
+    generates the same bytes each time it is called for a given ``seed``, so
+    it can be hashed then uploaded.
+    """
+
+    content_type = "application/x-tar"
+
+    def __init__(self, size: int, file_count: int, seed: str):
+        if file_count < 1:
+            raise ValueError("A synthetic archive needs at least one file")
+        self.size = size
+        self.file_count = file_count
+        self.seed = seed
+        self.filename = f"synthetic-{seed}.tar"
+
+        self._file_sizes: List[int] = [size // file_count] * file_count
+        self._file_sizes[0] += size % file_count
+
+    def _member_header(self, index: int) -> bytes:
+        tarinfo = tarfile.TarInfo(f"synthetic-{self.seed}/file-{index:06d}.bin")
+        tarinfo.size = self._file_sizes[index]
+        tarinfo.mode = 0o644
+        return tarinfo.tobuf(format=tarfile.USTAR_FORMAT)
+
+    def _member_content(self, index: int) -> Iterator[bytes]:
+        rng = random.Random(f"{self.seed}/{index}")
+        remaining = self._file_sizes[index]
+        while remaining > 0:
+            chunk_size = min(remaining, CHUNK_SIZE)
+            yield rng.randbytes(chunk_size)
+            remaining -= chunk_size
+        yield bytes(_padding(self._file_sizes[index], BLOCK_SIZE))
+
+    def __len__(self) -> int:
+        length = sum(
+            BLOCK_SIZE + file_size + _padding(file_size, BLOCK_SIZE)
+            for file_size in self._file_sizes
+        )
+        # end-of-archive marker, then padding to a full record
+        length += 2 * BLOCK_SIZE
+        return length + _padding(length, RECORD_SIZE)
+
+    def chunks(self) -> Iterator[bytes]:
+        """Yields the content of the tarball"""
+        length = 0
+        for index in range(self.file_count):
+            header = self._member_header(index)
+            length += len(header)
+            yield header
+            for chunk in self._member_content(index):
+                length += len(chunk)
+                yield chunk
+        length += 2 * BLOCK_SIZE
+        yield bytes(2 * BLOCK_SIZE + _padding(length, RECORD_SIZE))
+
+    def md5(self) -> str:
+        """Computes the md5 checksum of the tarball, by generating it"""
+        md5 = hashlib.md5()
+        for chunk in self.chunks():
+            md5.update(chunk)
+        return md5.hexdigest()
+
+    def metadata(self) -> str:
+        """Returns an Atom document describing the tarball"""
+        return METADATA_TEMPLATE.format(
+            seed=self.seed, file_count=self.file_count, size=self.size
+        )
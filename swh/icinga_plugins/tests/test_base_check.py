@@ -3,9 +3,19 @@
 # License: GNU General Public License version 3, or any later version
 # See top-level LICENSE file for more information
 
+import json
+import os
+import pstats
+import socket
+import subprocess
+import time
+import tracemalloc
+import urllib.request
+
 import pytest
 
 from swh.icinga_plugins.base_check import BaseCheck
+from swh.icinga_plugins.history import RollingQuantiles
 
 
 def test_inexistent_metric():
@@ -55,3 +65,365 @@ def test_save(tmpdir):
     base_check.save_prometheus_metrics()
 
     assert f"{tmpdir.strpath}/{application}.prom" in tmpdir.listdir()
+
+
+def test_state(tmpdir):
+    base_check = BaseCheck({"state_directory": tmpdir.strpath}, "test")
+    assert base_check.load_state("foo") == {}
+
+    base_check.save_state("foo", {"bar": 1})
+    assert BaseCheck({"state_directory": tmpdir.strpath}, "test").load_state("foo") == {
+        "bar": 1
+    }
+    assert tmpdir.listdir() == [tmpdir.join("foo.json")]
+
+
+def test_state_disabled():
+    base_check = BaseCheck({}, "test")
+    base_check.save_state("foo", {"bar": 1})
+    assert base_check.load_state("foo") == {}
+
+
+def test_adaptive_thresholds(tmpdir):
+    config = {
+        "state_directory": str(tmpdir),
+        "adaptive_thresholds": True,
+        "adaptive_min_samples": 40,
+    }
+    base_check = BaseCheck(config, "test")
+    for total_time in range(1, 40):
+        base_check.record_history("OK", {"total_time": float(total_time)})
+
+    # not enough samples yet, static thresholds are used
+    assert base_check.get_adaptive_thresholds("total_time") is None
+    assert base_check.get_status(70.0) == (1, "WARNING")
+
+    base_check.record_history("OK", {"total_time": 40.0})
+    (warning, critical) = base_check.get_adaptive_thresholds("total_time")
+    # estimated from the p95 and p99 of 1..40, which are 38 and 40
+    assert warning == pytest.approx(38 * 1.25, rel=0.1)
+    assert critical == pytest.approx(40 * 1.5, rel=0.1)
+
+    assert base_check.get_status(30.0) == (0, "OK")
+    assert base_check.get_status(50.0) == (1, "WARNING")
+    assert base_check.get_status(70.0) == (2, "CRITICAL")
+    assert base_check.registry.get_sample_value(
+        "swh_e2e_threshold_seconds",
+        {"application": "test", "metric": "total_time", "level": "critical"},
+    ) == pytest.approx(critical)
+
+    # the static critical threshold bounds the adaptive ones
+    base_check.critical_threshold = 45
+    assert base_check.get_adaptive_thresholds("total_time") == (45, 45)
+
+
+class HangingCheck(BaseCheck):
+    TYPE = "HANGING"
+
+    def main(self):
+        self.session.get("mock://swh-web.example.org/api/1/ping/")
+        return 0
+
+
+def test_run_deadline_exceeded(capsys):
+    check = HangingCheck({"deadline": 0}, "test")
+    check.register_prometheus_gauge("status", "")
+
+    assert check.run() == 2
+    assert capsys.readouterr().out.startswith(
+        "HANGING CRITICAL - Check did not complete within 0.00s: "
+        "Deadline of 0.00s exceeded\n"
+        "| 'total_time' = "
+    )
+    assert (
+        check.registry.get_sample_value("swh_e2e_status", {"application": "test"}) == 2
+    )
+
+
+def test_run_error():
+    check = HangingCheck({"deadline": 3600}, "test")
+
+    with pytest.raises(Exception, match="No connection adapters"):
+        check.run()
+
+
+def test_run_error_json(tmp_path, capsys):
+    check = HangingCheck(
+        {
+            "deadline": 3600,
+            "output_format": "json",
+            "output_spool_directory": str(tmp_path),
+        },
+        "test",
+    )
+
+    with pytest.raises(Exception, match="No connection adapters"):
+        check.run()
+
+    document = json.loads(capsys.readouterr().out)
+    assert (document["status"], document["status_code"]) == ("UNKNOWN", 3)
+    assert document["error"]["exception"].startswith(
+        "InvalidSchema: No connection adapters"
+    )
+    (spooled,) = tmp_path.iterdir()
+    assert json.loads(spooled.read_text()) == document
+
+
+class ProgressCheck(BaseCheck):
+    TYPE = "PROGRESS"
+
+    def scrape(self):
+        port = self.prometheus_http_server.server_port
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            return response.read().decode()
+
+    def main(self):
+        self.report_progress("pending")
+        self.scrapes = [self.scrape()]
+        self.report_progress("done")
+        self.scrapes.append(self.scrape())
+        return 0
+
+
+def test_prometheus_http_server():
+    check = ProgressCheck(
+        {"prometheus_http_port": 0, "prometheus_http_addr": "127.0.0.1"}, "test"
+    )
+
+    assert check.run() == 0
+    (pending, done) = check.scrapes
+    assert 'swh_e2e_progress_state{application="test",state="pending"} 1.0' in pending
+    assert 'swh_e2e_progress_state{application="test",state="done"} 1.0' in done
+    assert 'state="pending"' not in done
+    assert 'swh_e2e_progress_elapsed_seconds{application="test"}' in done
+
+    # the server is stopped, and the progress is not exported anymore
+    assert check.prometheus_http_server is None
+    assert (
+        check.registry.get_sample_value(
+            "swh_e2e_progress_elapsed_seconds", {"application": "test"}
+        )
+        is None
+    )
+
+
+def test_report_progress_without_http_server():
+    check = ProgressCheck({}, "test")
+    check.report_progress("pending")
+
+    assert (
+        check.registry.get_sample_value(
+            "swh_e2e_progress_state", {"application": "test", "state": "pending"}
+        )
+        is None
+    )
+
+
+class AllocatingCheck(BaseCheck):
+    TYPE = "ALLOCATING"
+
+    def main(self):
+        self.buffers = [bytearray(1024) for _ in range(1024)]
+        return 0
+
+
+def test_profile(tmpdir):
+    check = AllocatingCheck(
+        {"profile": True, "trace_memory": True, "profile_directory": str(tmpdir)},
+        "test",
+    )
+
+    assert check.run() == 0
+    files = sorted(os.listdir(tmpdir))
+    assert [os.path.splitext(file)[1] for file in files] == [
+        ".txt",
+        ".pstats",
+        ".tracemalloc",
+    ]
+    assert all(file.startswith("test-") for file in files)
+
+    stats = pstats.Stats(str(tmpdir / files[1]))
+    assert any(func[2] == "main" for func in stats.stats)
+    snapshot = tracemalloc.Snapshot.load(str(tmpdir / files[2]))
+    assert snapshot.statistics("lineno")
+    assert "Top 25 lines of allocated memory" in (tmpdir / files[0]).read()
+
+    peak = check.registry.get_sample_value(
+        "swh_e2e_profile_memory_peak_bytes", {"application": "test"}
+    )
+    assert peak >= 1024 * 1024
+    assert (
+        check.registry.get_sample_value(
+            "swh_e2e_profile_cpu_time_seconds", {"application": "test"}
+        )
+        >= 0
+    )
+    assert not tracemalloc.is_tracing()
+
+
+def test_profile_disabled(tmpdir):
+    check = AllocatingCheck({"profile_directory": str(tmpdir)}, "test")
+
+    assert check.run() == 0
+    assert os.listdir(tmpdir) == []
+    assert (
+        check.registry.get_sample_value(
+            "swh_e2e_profile_cpu_time_seconds", {"application": "test"}
+        )
+        is None
+    )
+
+
+class PollingCheck(BaseCheck):
+    TYPE = "POLLING"
+
+    def main(self):
+        for _ in range(3):
+            self.usage.add("polls")
+            self.session.get("mock://swh-web.example.org/api/1/ping/")
+        return 0
+
+
+def test_usage_metrics(requests_mock):
+    requests_mock.get("mock://swh-web.example.org/api/1/ping/", text="pong")
+    check = PollingCheck({}, "test")
+
+    assert check.run() == 0
+
+    def sample(name):
+        return check.registry.get_sample_value(
+            f"swh_e2e_usage_{name}", {"application": "test"}
+        )
+
+    assert sample("polls") == 3
+    assert sample("http_requests") == 3
+    assert sample("http_sent_bytes") > 0
+    assert sample("http_received_bytes") > 3 * len("pong")
+    assert sample("cpu_user_seconds") >= 0
+    assert sample("cpu_system_seconds") >= 0
+    assert sample("max_rss_bytes") > 1024 * 1024
+
+
+def test_print_result_standard_perfdata(capsys):
+    check = PollingCheck(
+        {
+            "perfdata_format": "standard",
+            "warning_threshold": 0,
+            "critical_threshold": 600,
+        },
+        "test",
+    )
+    check.get_status(3.0, "upload_time")
+    check.print_result("OK", "all good", total_time=12.0, upload_time=3.0, retries=1)
+
+    assert capsys.readouterr().out == (
+        "POLLING OK - all good | retries=1;;;0 total_time=12s;;600;0 "
+        "upload_time=3s;;600;0 usage_http_requests=0;;;0 usage_http_sent=0B;;;0 "
+        "usage_http_received=0B;;;0 usage_polls=0;;;0\n"
+    )
+
+
+def test_run_deadline_exceeded_json(capsys):
+    check = HangingCheck({"deadline": 0, "output_format": "json"}, "test")
+    check.register_prometheus_gauge("status", "")
+
+    assert check.run() == 2
+    document = json.loads(capsys.readouterr().out)
+    assert document["status"] == "CRITICAL"
+    assert document["error"] == {
+        "message": "Check did not complete within 0.00s: Deadline of 0.00s exceeded",
+        "exception": "DeadlineExceeded: Deadline of 0.00s exceeded",
+    }
+    assert document["trace_id"] == check.tracer.trace_id
+
+
+class TwoResultsCheck(BaseCheck):
+    TYPE = "TWO"
+
+    def main(self):
+        self.print_result("OK", "first step", total_time=10.0)
+        self.print_result("OK", "second step", total_time=30.0)
+        return 0
+
+
+def test_history_recorded_once(tmp_path, capsys):
+    check = TwoResultsCheck({"state_directory": str(tmp_path)}, "test")
+
+    assert check.run() == 0
+
+    state = check.load_state(check._quantiles_state_name)
+    rolling = RollingQuantiles.from_dict(state["total_time"])
+    assert rolling.count == 1
+    assert rolling.quantiles()[0.5] == 30.0
+    # both results are printed, the quantiles with the final one
+    assert capsys.readouterr().out == (
+        "TWO OK - first step\n"
+        "| 'total_time' = 10.00s\n"
+        "TWO OK - second step\n"
+        "| 'total_time' = 30.00s\n"
+        "| 'total_time_p50' = 30.00s\n"
+        "| 'total_time_p95' = 30.00s\n"
+        "| 'total_time_p99' = 30.00s\n"
+    )
+
+
+def test_json_output_once(tmp_path, capsys):
+    check = TwoResultsCheck(
+        {"output_format": "json", "output_spool_directory": str(tmp_path)}, "test"
+    )
+
+    assert check.run() == 0
+
+    (line,) = capsys.readouterr().out.splitlines()
+    document = json.loads(line)
+    assert (document["message"], document["metrics"]) == (
+        "second step",
+        {"total_time": 30.0},
+    )
+    (spooled,) = tmp_path.iterdir()
+    assert json.loads(spooled.read_text()) == document
+
+
+def checkpoint_check(tmp_path):
+    return BaseCheck({"state_directory": str(tmp_path)}, "test")
+
+
+def test_checkpoint_owned(tmp_path):
+    start_time = time.time()
+    checkpoint_check(tmp_path).save_checkpoint({"start_time": start_time, "job": 1})
+
+    assert checkpoint_check(tmp_path).load_checkpoint() == {
+        "start_time": start_time,
+        "job": 1,
+        "owner": {"host": socket.gethostname(), "pid": os.getpid()},
+    }
+
+
+def test_checkpoint_of_running_owner(tmp_path):
+    check = checkpoint_check(tmp_path)
+    # the init process is always running
+    owner = {"host": socket.gethostname(), "pid": 1}
+    checkpoint = {"start_time": time.time(), "job": 1, "owner": owner}
+    check.save_state(check._checkpoint_state_name, checkpoint)
+
+    # the job is neither resumed nor forgotten
+    assert check.load_checkpoint() is None
+    check.clear_checkpoint()
+    assert check.load_state(check._checkpoint_state_name) == checkpoint
+
+
+def test_checkpoint_of_dead_owner(tmp_path):
+    process = subprocess.Popen(["true"])
+    process.wait()
+    check = checkpoint_check(tmp_path)
+    owner = {"host": socket.gethostname(), "pid": process.pid}
+    check.save_state(
+        check._checkpoint_state_name,
+        {"start_time": time.time(), "job": 1, "owner": owner},
+    )
+
+    checkpoint = check.load_checkpoint()
+    assert checkpoint is not None
+    assert checkpoint["owner"] == {"host": socket.gethostname(), "pid": os.getpid()}
+    check.clear_checkpoint()
+    assert check.load_state(check._checkpoint_state_name) == {}
@@ -0,0 +1,112 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+
+import pytest
+
+from swh.icinga_plugins.base_check import BaseCheck
+from swh.icinga_plugins.circuit import CircuitBreaker, CircuitOpen
+from swh.icinga_plugins.http_client import CheckSession
+
+ROOT_URL = "mock://swh-web.example.org/"
+URL = ROOT_URL + "api/1/ping/"
+
+
+def circuit_state(directory):
+    with open(directory / "swh-web.example.org.json") as fd:
+        return json.load(fd)
+
+
+def test_circuit_breaker_concurrent(tmp_path):
+    def fail(_):
+        # each breaker stands for the one of another process
+        CircuitBreaker(str(tmp_path), 100).record(URL, failed=True)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(fail, range(32)))
+
+    assert circuit_state(tmp_path)["failures"] == 32
+
+
+def test_circuit_breaker_opens(tmp_path, requests_mock, mocked_time):
+    requests_mock.get(URL, status_code=503)
+    requests_mock.head(ROOT_URL, status_code=502)
+    session = CheckSession(circuit_breaker=CircuitBreaker(str(tmp_path), 2))
+
+    for _ in range(2):
+        assert session.get(URL).status_code == 503
+    assert circuit_state(tmp_path)["failures"] == 2
+
+    # in the next run, the failed probe prevents sending requests
+    breaker = CircuitBreaker(str(tmp_path), 2)
+    session = CheckSession(circuit_breaker=breaker)
+    requests_mock.reset_mock()
+    for _ in range(2):
+        with pytest.raises(CircuitOpen, match="probe failed with status code 502"):
+            session.get(URL)
+
+    assert [request.method for request in requests_mock.request_history] == ["HEAD"]
+    assert breaker.rejected is not None
+    assert breaker.rejected.backend == "swh-web.example.org"
+
+
+def test_circuit_breaker_closes(tmp_path, requests_mock):
+    (tmp_path / "swh-web.example.org.json").write_text('{"failures": 5}')
+    requests_mock.get(URL, text="pong")
+    requests_mock.head(ROOT_URL, status_code=404)
+    session = CheckSession(circuit_breaker=CircuitBreaker(str(tmp_path), 2))
+
+    assert session.get(URL).text == "pong"
+
+    assert circuit_state(tmp_path) == {"failures": 0}
+
+
+class PingCheck(BaseCheck):
+    TYPE = "PING"
+
+    def main(self):
+        response = self.session.get(URL)
+        assert response.status_code == 200
+        return 0
+
+
+def test_run_circuit_open(tmp_path, requests_mock, capsys):
+    circuits = tmp_path / "circuits"
+    circuits.mkdir()
+    (circuits / "swh-web.example.org.json").write_text('{"failures": 3}')
+    requests_mock.head(ROOT_URL, status_code=503)
+    check = PingCheck({"state_directory": str(tmp_path)}, "test")
+
+    assert check.run() == 2
+
+    assert capsys.readouterr().out.splitlines()[0] == (
+        "PING CRITICAL - Check aborted, swh-web.example.org is down: "
+        "3 consecutive requests failed and its health probe failed with "
+        "status code 503"
+    )
+    assert (
+        check.registry.get_sample_value(
+            "swh_e2e_circuit_open",
+            {"application": "test", "backend": "swh-web.example.org"},
+        )
+        == 1
+    )
+
+
+def test_run_circuit_closed(tmp_path, requests_mock):
+    requests_mock.get(URL, status_code=200)
+    check = PingCheck({"state_directory": str(tmp_path)}, "test")
+
+    assert check.run() == 0
+
+    assert (
+        check.registry.get_sample_value(
+            "swh_e2e_circuit_open",
+            {"application": "test", "backend": "swh-web.example.org"},
+        )
+        == 0
+    )
@@ -4,14 +4,34 @@
 # See top-level LICENSE file for more information
 
 import datetime
+import gzip
+import hashlib
 import io
+import json
 import os
 import tarfile
 import time
-from typing import Optional
+from typing import Dict, Optional
+import uuid
 
+from prometheus_client.parser import text_string_to_metric_families
 import pytest
-
+import requests
+
+from swh.core.retry import MAX_NUMBER_ATTEMPTS
+from swh.icinga_plugins.deposit import (
+    CheckDepositClient,
+    CheckStatusDepositClient,
+    DepositCheck,
+    MultiDepositCheck,
+    MultipartPart,
+    MultipartStream,
+    StreamingMultipartDepositClient,
+    block_digests,
+    matches_block_digests,
+)
+from swh.icinga_plugins.http_client import CheckSession, Deadline
+from swh.icinga_plugins.synthetic import SyntheticArchive
 from swh.icinga_plugins.tests.utils import invoke
 
 from .web_scenario import WebScenario
@@ -264,7 +284,10 @@ def test_deposit_immediate_success(
         "DEPOSIT OK - Deposit took 0.00s and succeeded.\n"
         "| 'load_time' = 0.00s\n"
         "| 'total_time' = 0.00s\n"
+        "| 'upload_first_response_time' = 0.00s\n"
+        "| 'upload_server_time' = 0.00s\n"
         "| 'upload_time' = 0.00s\n"
+        "| 'upload_transfer_time' = 0.00s\n"
         "| 'validation_time' = 0.00s\n"
         "DEPOSIT OK - Deposit Metadata update took 0.00s and succeeded.\n"
         "| 'total_time' = 0.00s\n"
@@ -363,8 +386,14 @@ def test_deposit_delays(
     assert result.output == (
         "DEPOSIT OK - Deposit took 30.00s and succeeded.\n"
         "| 'load_time' = 20.00s\n"
+        "| 'state_deposited_time' = 10.00s\n"
+        "| 'state_loading_time' = 10.00s\n"
+        "| 'state_verified_time' = 10.00s\n"
         "| 'total_time' = 30.00s\n"
+        "| 'upload_first_response_time' = 0.00s\n"
+        "| 'upload_server_time' = 0.00s\n"
         "| 'upload_time' = 0.00s\n"
+        "| 'upload_transfer_time' = 0.00s\n"
         "| 'validation_time' = 10.00s\n"
         "DEPOSIT OK - Deposit Metadata update took 0.00s and succeeded.\n"
         "| 'total_time' = 30.00s\n"
@@ -450,8 +479,14 @@ def test_deposit_then_metadata_update_failed(
     assert result.output == (
         "DEPOSIT OK - Deposit took 30.00s and succeeded.\n"
         "| 'load_time' = 20.00s\n"
+        "| 'state_deposited_time' = 10.00s\n"
+        "| 'state_loading_time' = 10.00s\n"
+        "| 'state_verified_time' = 10.00s\n"
         "| 'total_time' = 30.00s\n"
+        "| 'upload_first_response_time' = 0.00s\n"
+        "| 'upload_server_time' = 0.00s\n"
         "| 'upload_time' = 0.00s\n"
+        "| 'upload_transfer_time' = 0.00s\n"
         "| 'validation_time' = 10.00s\n"
         "DEPOSIT CRITICAL - Deposit Metadata update failed: You can only update "
         "metadata on deposit with status 'done' \n"
@@ -526,8 +561,13 @@ def test_deposit_delay_warning(
     assert result.output == (
         "DEPOSIT WARNING - Deposit took 20.00s and succeeded.\n"
         "| 'load_time' = 10.00s\n"
+        "| 'state_deposited_time' = 10.00s\n"
+        "| 'state_verified_time' = 10.00s\n"
         "| 'total_time' = 20.00s\n"
+        "| 'upload_first_response_time' = 0.00s\n"
+        "| 'upload_server_time' = 0.00s\n"
         "| 'upload_time' = 0.00s\n"
+        "| 'upload_transfer_time' = 0.00s\n"
         "| 'validation_time' = 10.00s\n"
     )
     assert result.exit_code == 1, f"Unexpected output: {result.output}"
@@ -602,8 +642,13 @@ def test_deposit_delay_critical(
     assert result.output == (
         "DEPOSIT CRITICAL - Deposit took 80.00s and succeeded.\n"
         "| 'load_time' = 70.00s\n"
+        "| 'state_deposited_time' = 10.00s\n"
+        "| 'state_verified_time' = 70.00s\n"
         "| 'total_time' = 80.00s\n"
+        "| 'upload_first_response_time' = 0.00s\n"
+        "| 'upload_server_time' = 0.00s\n"
         "| 'upload_time' = 0.00s\n"
+        "| 'upload_transfer_time' = 0.00s\n"
         "| 'validation_time' = 10.00s\n"
     )
     assert result.exit_code == 2, f"Unexpected output: {result.output}"
@@ -654,8 +699,14 @@ def test_deposit_timeout(
     assert result.output == (
         "DEPOSIT CRITICAL - Timed out while in status loading "
         "(4520.0s seconds since deposit started)\n"
+        "| 'state_deposited_time' = 1510.00s\n"
+        "| 'state_loading_time' = 0.00s\n"
+        "| 'state_verified_time' = 1510.00s\n"
         "| 'total_time' = 4520.00s\n"
+        "| 'upload_first_response_time' = 1500.00s\n"
+        "| 'upload_server_time' = 1500.00s\n"
         "| 'upload_time' = 1500.00s\n"
+        "| 'upload_transfer_time' = 0.00s\n"
         "| 'validation_time' = 1510.00s\n"
     )
     assert result.exit_code == 2, f"Unexpected output: {result.output}"
@@ -726,8 +777,13 @@ def test_deposit_metadata_missing(
         f"DEPOSIT CRITICAL - No recent metadata on {swhid} with origin {origin} in: "
         f"{metadata_list!r}\n"
         "| 'load_time' = 10.00s\n"
+        "| 'state_deposited_time' = 10.00s\n"
+        "| 'state_verified_time' = 10.00s\n"
         "| 'total_time' = 20.00s\n"
+        "| 'upload_first_response_time' = 0.00s\n"
+        "| 'upload_server_time' = 0.00s\n"
         "| 'upload_time' = 0.00s\n"
+        "| 'upload_transfer_time' = 0.00s\n"
         "| 'validation_time' = 10.00s\n"
     )
     assert result.exit_code == 2, f"Unexpected output: {result.output}"
@@ -800,14 +856,121 @@ def test_deposit_metadata_error(
     assert result.output == (
         "DEPOSIT CRITICAL - Getting the list of metadata returned code 400: "
         "b'foo\\nbar'\n"
+        "| 'http_backoff_time' = 1.00s\n"
+        "| 'http_retries' = 1\n"
+        "| 'http_throttled' = 1\n"
         "| 'load_time' = 10.00s\n"
+        "| 'state_deposited_time' = 10.00s\n"
+        "| 'state_verified_time' = 10.00s\n"
         "| 'total_time' = 20.00s\n"
+        "| 'upload_first_response_time' = 0.00s\n"
+        "| 'upload_server_time' = 0.00s\n"
         "| 'upload_time' = 0.00s\n"
+        "| 'upload_transfer_time' = 0.00s\n"
         "| 'validation_time' = 10.00s\n"
     )
     assert result.exit_code == 2, f"Unexpected output: {result.output}"
 
 
+def test_deposit_metadata_throttled(
+    requests_mock, mocker, sample_archive, sample_metadata, mocked_time
+):
+    """Throttling which persists after all retries is critical"""
+    scenario = WebScenario()
+
+    scenario.add_step(
+        "post", f"{BASE_URL}/testcol/", ENTRY_TEMPLATE.format(status="deposited")
+    )
+    swhid = "swh:1:dir:02ed6084fb0e8384ac58980e07548a547431cf74"
+    scenario.add_step(
+        "get",
+        f"{BASE_URL}/testcol/42/status/",
+        status_template(status="done", status_detail="", swhid=swhid),
+    )
+    url_metadata = (
+        f"{BASE_WEB_URL}/api/1/raw-extrinsic-metadata/swhid/{swhid}/"
+        "?authority=deposit_client+http%3A%2F%2Ficinga-checker.example.org"
+        "&after=2022-03-04T17%3A02%3A39%2B00%3A00"
+    )
+    for _ in range(MAX_NUMBER_ATTEMPTS):
+        scenario.add_step("get", url_metadata, "slow down", status_code=429)
+    scenario.install_mock(requests_mock)
+
+    result = invoke(
+        [
+            "check-deposit",
+            *COMMON_OPTIONS,
+            "single",
+            "--archive",
+            sample_archive,
+            "--metadata",
+            sample_metadata,
+        ],
+        catch_exceptions=True,
+    )
+
+    assert result.output.startswith(
+        "DEPOSIT CRITICAL - Getting the list of metadata returned code 429: "
+        "b'slow down'\n"
+    ), result.output
+    assert result.exit_code == 2, f"Unexpected output: {result.output}"
+
+
+def test_deposit_metadata_url_error(
+    requests_mock, mocker, sample_archive, sample_metadata, mocked_time
+):
+    """An error reading the metadata is critical, instead of a mismatch"""
+    origin = compute_origin()
+    scenario = WebScenario()
+
+    scenario.add_step(
+        "post", f"{BASE_URL}/testcol/", ENTRY_TEMPLATE.format(status="deposited")
+    )
+    swhid = "swh:1:dir:02ed6084fb0e8384ac58980e07548a547431cf74"
+    scenario.add_step(
+        "get",
+        f"{BASE_URL}/testcol/42/status/",
+        status_template(status="done", status_detail="", swhid=swhid),
+    )
+    scenario.add_step(
+        "get",
+        f"{BASE_WEB_URL}/api/1/raw-extrinsic-metadata/swhid/{swhid}/"
+        "?authority=deposit_client+http%3A%2F%2Ficinga-checker.example.org"
+        "&after=2022-03-04T17%3A02%3A39%2B00%3A00",
+        [
+            {
+                "swhid": swhid,
+                "origin": origin,
+                "discovery_date": "2999-03-03T10:48:47+00:00",
+                "metadata_url": f"{BASE_WEB_URL}/the-metadata-url",
+            }
+        ],
+    )
+    scenario.add_step(
+        "get", f"{BASE_WEB_URL}/the-metadata-url", "not found", status_code=404
+    )
+    scenario.install_mock(requests_mock)
+
+    result = invoke(
+        [
+            "check-deposit",
+            *COMMON_OPTIONS,
+            "single",
+            "--archive",
+            sample_archive,
+            "--metadata",
+            sample_metadata,
+        ],
+        catch_exceptions=True,
+    )
+
+    assert result.output.startswith(
+        f"DEPOSIT CRITICAL - Getting the metadata on {swhid} "
+        f"(at {BASE_WEB_URL}/the-metadata-url) returned code 404: b'not found'\n"
+    ), result.output
+    assert result.exit_code == 2, f"Unexpected output: {result.output}"
+
+
 def test_deposit_metadata_corrupt(
     requests_mock, mocker, sample_archive, sample_metadata, mocked_time
 ):
@@ -878,8 +1041,13 @@ def test_deposit_metadata_corrupt(
         f"{BASE_WEB_URL}/the-metadata-url) differs from uploaded Atom document (at "
         f"{sample_metadata})\n"
         "| 'load_time' = 10.00s\n"
+        "| 'state_deposited_time' = 10.00s\n"
+        "| 'state_verified_time' = 10.00s\n"
         "| 'total_time' = 20.00s\n"
+        "| 'upload_first_response_time' = 0.00s\n"
+        "| 'upload_server_time' = 0.00s\n"
         "| 'upload_time' = 0.00s\n"
+        "| 'upload_transfer_time' = 0.00s\n"
         "| 'validation_time' = 10.00s\n"
     )
     assert result.exit_code == 2, f"Unexpected output: {result.output}"
@@ -919,8 +1087,12 @@ def test_deposit_rejected(
 
     assert result.output == (
         "DEPOSIT CRITICAL - Deposit was rejected: booo\n"
+        "| 'state_deposited_time' = 10.00s\n"
         "| 'total_time' = 10.00s\n"
+        "| 'upload_first_response_time' = 0.00s\n"
+        "| 'upload_server_time' = 0.00s\n"
         "| 'upload_time' = 0.00s\n"
+        "| 'upload_transfer_time' = 0.00s\n"
         "| 'validation_time' = 10.00s\n"
     )
     assert result.exit_code == 2, f"Unexpected output: {result.output}"
@@ -971,8 +1143,14 @@ def test_deposit_failed(
     assert result.output == (
         "DEPOSIT CRITICAL - Deposit loading failed: booo\n"
         "| 'load_time' = 20.00s\n"
+        "| 'state_deposited_time' = 10.00s\n"
+        "| 'state_loading_time' = 10.00s\n"
+        "| 'state_verified_time' = 10.00s\n"
         "| 'total_time' = 30.00s\n"
+        "| 'upload_first_response_time' = 0.00s\n"
+        "| 'upload_server_time' = 0.00s\n"
         "| 'upload_time' = 0.00s\n"
+        "| 'upload_transfer_time' = 0.00s\n"
         "| 'validation_time' = 10.00s\n"
     )
     assert result.exit_code == 2, f"Unexpected output: {result.output}"
@@ -1023,8 +1201,828 @@ def test_deposit_unexpected_status(
     assert result.output == (
         "DEPOSIT CRITICAL - Deposit got unexpected status: what (booo)\n"
         "| 'load_time' = 20.00s\n"
+        "| 'state_deposited_time' = 10.00s\n"
+        "| 'state_loading_time' = 10.00s\n"
+        "| 'state_verified_time' = 10.00s\n"
         "| 'total_time' = 30.00s\n"
+        "| 'upload_first_response_time' = 0.00s\n"
+        "| 'upload_server_time' = 0.00s\n"
         "| 'upload_time' = 0.00s\n"
+        "| 'upload_transfer_time' = 0.00s\n"
         "| 'validation_time' = 10.00s\n"
     )
     assert result.exit_code == 2, f"Unexpected output: {result.output}"
+
+
+def test_multipart_stream(sample_archive, sample_metadata):
+    body = MultipartStream(
+        [
+            MultipartPart.from_file("file", sample_archive, "application/x-tar"),
+            MultipartPart.from_file("atom", sample_metadata, "application/atom+xml"),
+        ]
+    )
+    content = b"".join(body)
+
+    assert len(content) == len(body) == body.bytes_sent
+    assert body.first_chunk_time is not None
+    assert body.last_chunk_time is not None
+
+    with open(sample_archive, "rb") as fd:
+        archive_content = fd.read()
+    assert content.startswith(
+        f"--{body.boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="archive.tar.gz"\r\n'
+        f"Content-Type: application/x-tar\r\n\r\n".encode() + archive_content + b"\r\n"
+    )
+    assert content.endswith(
+        SAMPLE_METADATA.encode() + f"\r\n--{body.boundary}--\r\n".encode()
+    )
+
+
+def test_streaming_multipart_deposit_client(
+    requests_mock, sample_archive, sample_metadata
+):
+    requests_mock.post(
+        f"{BASE_URL}/testcol/", text=ENTRY_TEMPLATE.format(status="done")
+    )
+
+    client = StreamingMultipartDepositClient(url=BASE_URL, auth=("test", "test"))
+    result = client.execute(
+        "testcol",
+        False,
+        "some-slug",
+        archive_path=sample_archive,
+        metadata_path=sample_metadata,
+    )
+
+    assert result["deposit_id"] == "42"
+    request = requests_mock.last_request
+    with open(sample_archive, "rb") as fd:
+        assert request.headers["CONTENT_MD5"] == hashlib.md5(fd.read()).hexdigest()
+    assert request.headers["SLUG"] == "some-slug"
+    assert request.headers["Content-Type"].startswith("multipart/form-data")
+    assert int(request.headers["Content-Length"]) == len(request.body)
+    assert set(client.upload_stats) == {
+        "bytes",
+        "first_response_time",
+        "transfer_time",
+        "server_time",
+    }
+
+
+def test_streaming_multipart_deposit_client_retried(
+    requests_mock, sample_archive, sample_metadata, mocked_time
+):
+    """Only the last attempt of a retried upload is measured"""
+
+    def upload(status_code, text):
+        def callback(request, context):
+            # the connection consumes the body while the request is sent
+            b"".join(request.body)
+            time.sleep(5)
+            context.status_code = status_code
+            return text
+
+        return callback
+
+    requests_mock.post(
+        f"{BASE_URL}/testcol/",
+        [
+            {"text": upload(429, "slow down")},
+            {"text": upload(201, ENTRY_TEMPLATE.format(status="done"))},
+        ],
+    )
+    session = CheckSession()
+    client = CheckDepositClient(session, url=BASE_URL, auth=("test", "test"))
+    upload_client = client.sub_client(StreamingMultipartDepositClient)
+
+    start_time = time.time()
+    result = upload_client.execute(
+        "testcol",
+        False,
+        "some-slug",
+        archive_path=sample_archive,
+        metadata_path=sample_metadata,
+    )
+
+    assert result["deposit_id"] == "42"
+    assert len(requests_mock.request_history) == 2
+    assert session.retry_stats.throttled == 1
+    body = requests_mock.last_request.body
+    assert upload_client.upload_stats["bytes"] == len(body)
+    # the backoff and the first attempt took time too
+    assert time.time() - start_time > 10
+    assert upload_client.upload_stats["first_response_time"] == 5
+
+
+def test_deposit_synthetic(requests_mock, mocker, mocked_time):
+    """A generated archive and its metadata are deposited"""
+    seed = uuid.UUID(int=42)
+    mocker.patch("uuid.uuid4", return_value=seed)
+    archive = SyntheticArchive(10000, 5, seed.hex)
+
+    origin = compute_origin()
+    scenario = WebScenario()
+
+    scenario.add_step(
+        "post", f"{BASE_URL}/testcol/", ENTRY_TEMPLATE.format(status="deposited")
+    )
+    swhid = "swh:1:dir:02ed6084fb0e8384ac58980e07548a547431cf74"
+    status_xml = status_template(status="done", status_detail="", swhid=swhid)
+    scenario.add_step("get", f"{BASE_URL}/testcol/42/status/", status_xml)
+    scenario.add_step(
+        "get",
+        f"{BASE_WEB_URL}/api/1/raw-extrinsic-metadata/swhid/{swhid}/"
+        f"?authority=deposit_client+http%3A%2F%2Ficinga-checker.example.org"
+        f"&after=2022-03-04T17%3A02%3A39%2B00%3A00",
+        [
+            {
+                "swhid": swhid,
+                "origin": origin,
+                "discovery_date": "2999-03-03T10:48:47+00:00",
+                "metadata_url": f"{BASE_WEB_URL}/the-metadata-url",
+            }
+        ],
+    )
+    scenario.add_step("get", f"{BASE_WEB_URL}/the-metadata-url", archive.metadata())
+
+    scenario.install_mock(requests_mock)
+
+    result = invoke(
+        [
+            "--warning",
+            "5",
+            "check-deposit",
+            *COMMON_OPTIONS,
+            "synthetic",
+            "--archive-size",
+            "10000",
+            "--file-count",
+            "5",
+        ],
+        catch_exceptions=True,
+    )
+
+    assert result.output.startswith(
+        "DEPOSIT WARNING - Deposit took 10.00s and succeeded.\n"
+    )
+    assert result.exit_code == 1, f"Unexpected output: {result.output}"
+
+    upload_request = requests_mock.request_history[0]
+    assert upload_request.headers["CONTENT_MD5"] == archive.md5()
+    assert int(upload_request.headers["Content-Length"]) > len(archive)
+
+
+@pytest.mark.parametrize(
+    "body,matches",
+    [
+        (b"0123456789", True),
+        (b"0123456789a", False),
+        (b"012345678", False),
+        (b"0123x56789", False),
+    ],
+)
+def test_matches_block_digests(requests_mock, tmp_path, body, matches):
+    path = os.path.join(tmp_path, "expected")
+    with open(path, "wb") as fd:
+        fd.write(b"0123456789")
+    digests = block_digests(path, block_size=4)
+    assert len(digests) == 3
+
+    requests_mock.get("mock://example.org/metadata", content=body)
+    with requests.get("mock://example.org/metadata", stream=True) as response:
+        assert matches_block_digests(response, 10, digests, 4) == matches
+
+
+def test_matches_block_digests_content_length(requests_mock, tmp_path):
+    path = os.path.join(tmp_path, "expected")
+    with open(path, "wb") as fd:
+        fd.write(b"0123456789")
+
+    requests_mock.get(
+        "mock://example.org/metadata",
+        content=b"0123456789",
+        headers={"Content-Length": "11"},
+    )
+    with requests.get("mock://example.org/metadata", stream=True) as response:
+        assert not matches_block_digests(response, 10, block_digests(path), 4)
+
+
+def test_matches_block_digests_content_encoding(requests_mock, tmp_path):
+    path = os.path.join(tmp_path, "expected")
+    with open(path, "wb") as fd:
+        fd.write(b"0123456789")
+
+    body = gzip.compress(b"0123456789")
+    requests_mock.get(
+        "mock://example.org/metadata",
+        content=body,
+        headers={"Content-Length": str(len(body)), "Content-Encoding": "gzip"},
+    )
+    with requests.get("mock://example.org/metadata", stream=True) as response:
+        assert matches_block_digests(response, 10, block_digests(path, 4), 4)
+
+
+def test_deposit_metadata_digests_cache(tmp_path_factory, sample_metadata, mocker):
+    state_directory = str(tmp_path_factory.mktemp("state"))
+    obj = {
+        "swh_web_url": BASE_WEB_URL,
+        "poll_interval": POLL_INTERVAL,
+        "collection": "testcol",
+        "provider_url": PROVIDER_URL,
+        "server": BASE_URL,
+        "username": "test",
+        "password": "test",
+        "archive": "archive.tar.gz",
+        "metadata": sample_metadata,
+        "state_directory": state_directory,
+    }
+    expected = (len(SAMPLE_METADATA), block_digests(sample_metadata))
+
+    assert DepositCheck(obj).metadata_digests() == expected
+
+    # the digests are not computed again by the next run
+    block_digests_mock = mocker.patch("swh.icinga_plugins.deposit.block_digests")
+    assert DepositCheck(obj).metadata_digests() == expected
+    block_digests_mock.assert_not_called()
+
+    # unless the file changed
+    os.utime(sample_metadata, ns=(0, 0))
+    block_digests_mock.return_value = ["updated"]
+    assert DepositCheck(obj).metadata_digests() == (len(SAMPLE_METADATA), ["updated"])
+
+
+def test_deposit_metadata_pagination(
+    requests_mock, mocker, sample_archive, sample_metadata, mocked_time
+):
+    """Metadata pages are fetched until the metadata of the deposit is found"""
+    origin = compute_origin()
+    scenario = WebScenario()
+
+    scenario.add_step(
+        "post", f"{BASE_URL}/testcol/", ENTRY_TEMPLATE.format(status="deposited")
+    )
+    swhid = "swh:1:dir:02ed6084fb0e8384ac58980e07548a547431cf74"
+    status_xml = status_template(status="done", status_detail="", swhid=swhid)
+    scenario.add_step("get", f"{BASE_URL}/testcol/42/status/", status_xml)
+
+    url_metadata = (
+        f"{BASE_WEB_URL}/api/1/raw-extrinsic-metadata/swhid/{swhid}/"
+        "?authority=deposit_client+http%3A%2F%2Ficinga-checker.example.org"
+        "&after=2022-03-04T17%3A02%3A39%2B00%3A00"
+    )
+    metadata_object = {
+        "swhid": swhid,
+        "origin": origin,
+        "discovery_date": "2999-03-03T10:48:47+00:00",
+        "metadata_url": f"{BASE_WEB_URL}/the-metadata-url",
+    }
+    other_metadata_object = {
+        **metadata_object,
+        "origin": "http://wrong-origin.example.org",
+    }
+    scenario.add_step(
+        "get",
+        url_metadata,
+        [other_metadata_object],
+        headers={"Link": f'<{url_metadata}&page_token=2>; rel="next"'},
+    )
+    # The second page is the last one to be fetched, as it contains the metadata
+    # of the deposit
+    scenario.add_step(
+        "get",
+        f"{url_metadata}&page_token=2",
+        [metadata_object],
+        headers={"Link": f'<{url_metadata}&page_token=3>; rel="next"'},
+    )
+    scenario.add_step("get", f"{BASE_WEB_URL}/the-metadata-url", SAMPLE_METADATA)
+
+    scenario.install_mock(requests_mock)
+
+    result = invoke(
+        [
+            "--warning",
+            "5",
+            "check-deposit",
+            *COMMON_OPTIONS,
+            "single",
+            "--archive",
+            sample_archive,
+            "--metadata",
+            sample_metadata,
+        ],
+        catch_exceptions=True,
+    )
+
+    assert result.output.startswith(
+        "DEPOSIT WARNING - Deposit took 10.00s and succeeded.\n"
+    ), result.output
+    assert result.exit_code == 1, f"Unexpected output: {result.output}"
+
+
+def test_deposit_multi(
+    requests_mock, mocker, sample_archive, sample_metadata, mocked_time
+):
+    """Deposits in several collections are checked concurrently"""
+    origin = compute_origin()
+    swhid = "swh:1:dir:02ed6084fb0e8384ac58980e07548a547431cf74"
+
+    # requests of both deposits are interleaved, so each URL gets its own
+    # sequence of responses instead of a common scenario
+    requests_mock.post(
+        f"{BASE_URL}/testcol/", text=ENTRY_TEMPLATE.format(status="deposited")
+    )
+    requests_mock.get(
+        f"{BASE_URL}/testcol/42/status/",
+        [
+            {"text": status_template(status="verified")},
+            {"text": status_template(status="done", swhid=swhid)},
+        ],
+    )
+    requests_mock.post(
+        f"{BASE_URL}/othercol/",
+        text=ENTRY_TEMPLATE.format(status="deposited").replace("42", "43"),
+    )
+    requests_mock.get(
+        f"{BASE_URL}/othercol/43/status/",
+        text=status_template(status="failed", status_detail="booo").replace("42", "43"),
+    )
+    requests_mock.get(
+        f"{BASE_WEB_URL}/api/1/raw-extrinsic-metadata/swhid/{swhid}/"
+        f"?authority=deposit_client+http%3A%2F%2Ficinga-checker.example.org"
+        f"&after=2022-03-04T17%3A02%3A39%2B00%3A00",
+        json=[
+            {
+                "swhid": swhid,
+                "origin": origin,
+                "discovery_date": "2999-03-03T10:48:47+00:00",
+                "metadata_url": f"{BASE_WEB_URL}/the-metadata-url",
+            }
+        ],
+    )
+    requests_mock.get(f"{BASE_WEB_URL}/the-metadata-url", text=SAMPLE_METADATA)
+
+    options = [option for option in COMMON_OPTIONS if option != "testcol"]
+    options.remove("--collection")
+    result = invoke(
+        [
+            "check-deposit",
+            *options,
+            "multi",
+            "--deposit",
+            "testcol",
+            sample_archive,
+            sample_metadata,
+            "--deposit",
+            "othercol",
+            sample_archive,
+            sample_metadata,
+        ],
+        catch_exceptions=True,
+    )
+
+    assert result.output == (
+        "DEPOSIT CRITICAL - 1 of 2 deposits succeeded, the slowest one took "
+        "20.00s. othercol: Deposit loading failed: booo.\n"
+        "| 'othercol_total_time' = 10.00s\n"
+        "| 'othercol_upload_time' = 0.00s\n"
+        "| 'testcol_total_time' = 20.00s\n"
+        "| 'testcol_upload_time' = 0.00s\n"
+        "| 'total_time' = 20.00s\n"
+    )
+    assert result.exit_code == 2, f"Unexpected output: {result.output}"
+
+
+def test_deposit_multi_clients(
+    requests_mock, sample_archive, sample_metadata, mocked_time
+):
+    """Deposits are made with the credentials of the client of their collection"""
+    requests_mock.post(
+        f"{BASE_URL}/testcol/", text=ENTRY_TEMPLATE.format(status="deposited")
+    )
+    requests_mock.get(
+        f"{BASE_URL}/testcol/42/status/",
+        text=status_template(status="failed", status_detail="booo"),
+    )
+    requests_mock.post(
+        f"{BASE_URL}/othercol/",
+        text=ENTRY_TEMPLATE.format(status="deposited").replace("42", "43"),
+    )
+    requests_mock.get(
+        f"{BASE_URL}/othercol/43/status/",
+        text=status_template(status="failed", status_detail="booo").replace("42", "43"),
+    )
+
+    options = [option for option in COMMON_OPTIONS if option != "testcol"]
+    options.remove("--collection")
+    result = invoke(
+        [
+            "check-deposit",
+            *options,
+            "multi",
+            "--deposit",
+            "testcol",
+            sample_archive,
+            sample_metadata,
+            "--deposit",
+            "othercol",
+            sample_archive,
+            sample_metadata,
+            "--client",
+            "othercol",
+            "other",
+            "secret",
+            "http://other.example.org",
+        ],
+        catch_exceptions=True,
+    )
+    assert result.exit_code == 2, f"Unexpected output: {result.output}"
+
+    authorizations = {
+        request.path: request.headers["Authorization"]
+        for request in requests_mock.request_history
+        if request.method == "POST"
+    }
+    assert authorizations == {
+        "/1/testcol/": requests.auth._basic_auth_str("test", "test"),
+        "/1/othercol/": requests.auth._basic_auth_str("other", "secret"),
+    }
+
+
+def test_deposit_multi_unknown_client(sample_archive, sample_metadata):
+    options = [option for option in COMMON_OPTIONS if option != "testcol"]
+    options.remove("--collection")
+    result = invoke(
+        [
+            "check-deposit",
+            *options,
+            "multi",
+            "--deposit",
+            "testcol",
+            sample_archive,
+            sample_metadata,
+            "--client",
+            "othercol",
+            "other",
+            "secret",
+            "http://other.example.org",
+        ],
+        catch_exceptions=True,
+    )
+
+    assert "no deposit in collections othercol" in result.output
+    assert result.exit_code == 2
+
+
+def test_deposit_multi_duplicate_collection(sample_archive, sample_metadata):
+    options = [option for option in COMMON_OPTIONS if option != "testcol"]
+    options.remove("--collection")
+    result = invoke(
+        [
+            "check-deposit",
+            *options,
+            "multi",
+            "--deposit",
+            "testcol",
+            sample_archive,
+            sample_metadata,
+            "--deposit",
+            "testcol",
+            sample_archive,
+            sample_metadata,
+        ],
+        catch_exceptions=True,
+    )
+
+    assert "collections must be unique" in result.output
+    assert result.exit_code == 2
+
+
+def test_deposit_single_missing_collection(sample_archive, sample_metadata):
+    options = [option for option in COMMON_OPTIONS if option != "testcol"]
+    options.remove("--collection")
+    result = invoke(
+        [
+            "check-deposit",
+            *options,
+            "single",
+            "--archive",
+            sample_archive,
+            "--metadata",
+            sample_metadata,
+        ],
+        catch_exceptions=True,
+    )
+
+    assert "Missing option '--collection'" in result.output
+    assert result.exit_code == 2
+
+
+def test_check_deposit_client(requests_mock, mocked_time):
+    status_url = f"{BASE_URL}/testcol/42/status/"
+    requests_mock.get(
+        status_url,
+        [
+            {"status_code": 503},
+            {"text": status_template(status="loading")},
+        ],
+    )
+    requests_mock.get(BASE_WEB_URL + "/api/1/ping/", text="pong")
+    session = CheckSession(deadline=Deadline(60))
+    client = CheckDepositClient(session.derive(), url=BASE_URL, auth=("test", "test"))
+
+    result = client.deposit_status("testcol", 42)
+
+    assert result["deposit_status"] == "loading"
+    # requests of the deposit client are retried and get a timeout
+    assert session.retry_stats.retries == 1
+    assert requests_mock.last_request.timeout[1] <= 60
+    assert "Authorization" in requests_mock.last_request.headers
+
+    # credentials of the deposit server are not sent to other servers
+    session.get(BASE_WEB_URL + "/api/1/ping/")
+    assert "Authorization" not in requests_mock.last_request.headers
+
+
+def test_check_deposit_client_reuses_sub_clients(requests_mock):
+    requests_mock.get(
+        f"{BASE_URL}/testcol/42/status/", text=status_template(status="loading")
+    )
+    client = CheckDepositClient(CheckSession(), url=BASE_URL, auth=("test", "test"))
+
+    client.deposit_status("testcol", 42)
+    status_client = client.sub_client(CheckStatusDepositClient)
+    client.deposit_status("testcol", 42)
+
+    assert client.sub_client(CheckStatusDepositClient) is status_client
+    assert status_client.session is client.session
+
+
+def test_deposit_preflight(requests_mock, sample_metadata, mocked_time, capsys):
+    obj = {
+        "swh_web_url": BASE_WEB_URL,
+        "poll_interval": POLL_INTERVAL,
+        "collection": "testcol",
+        "provider_url": PROVIDER_URL,
+        "server": BASE_URL,
+        "username": "test",
+        "password": "test",
+        "archive": "archive.tar.gz",
+        "metadata": sample_metadata,
+    }
+    requests_mock.head(BASE_WEB_URL + "/", text="")
+    requests_mock.get(f"{BASE_URL}/servicedocument/", text="<service/>")
+
+    assert DepositCheck(obj).preflight() is None
+    headers = {
+        request.url: request.headers for request in requests_mock.request_history
+    }
+    assert "Authorization" in headers[f"{BASE_URL}/servicedocument/"]
+    assert "Authorization" not in headers[BASE_WEB_URL + "/"]
+
+    # wrong credentials are detected too
+    requests_mock.get(f"{BASE_URL}/servicedocument/", status_code=401)
+
+    assert DepositCheck(obj).preflight() == 2
+    assert capsys.readouterr().out == (
+        "DEPOSIT CRITICAL - Pre-flight probe of "
+        f"deposit ({BASE_URL}/servicedocument/) failed with status code 401.\n"
+        "| 'preflight_time' = 0.00s\n"
+    )
+
+
+def test_deposit_resume(
+    requests_mock, tmp_path_factory, sample_archive, sample_metadata, mocked_time
+):
+    """The deposit of an interrupted run is polled instead of uploading a new one"""
+    state_directory = tmp_path_factory.mktemp("state")
+    checkpoint_path = state_directory / "checkpoint-default-deposit_testcol_single.json"
+    checkpoint_path.write_text(
+        json.dumps(
+            {
+                "start_time": time.time() - 30,
+                "upload_time": 5.0,
+                "slug": "check-deposit-2022-03-04T17:02:09",
+                "deposit_id": 42,
+                "upload_stats": {
+                    "bytes": 1000,
+                    "first_response_time": 5.0,
+                    "transfer_time": 4.0,
+                    "server_time": 1.0,
+                },
+                "seed": None,
+            }
+        )
+    )
+
+    scenario = WebScenario()
+    scenario.add_step(
+        "get",
+        f"{BASE_URL}/testcol/42/status/",
+        status_template(status="rejected", status_detail="booo"),
+    )
+    scenario.install_mock(requests_mock)
+
+    result = invoke(
+        [
+            "--state-directory",
+            str(state_directory),
+            "check-deposit",
+            *COMMON_OPTIONS,
+            "single",
+            "--archive",
+            sample_archive,
+            "--metadata",
+            sample_metadata,
+        ],
+        catch_exceptions=True,
+    )
+
+    assert result.output == (
+        "DEPOSIT CRITICAL - Deposit was rejected: booo\n"
+        "| 'total_time' = 30.00s\n"
+        "| 'total_time_p50' = 30.00s\n"
+        "| 'total_time_p95' = 30.00s\n"
+        "| 'total_time_p99' = 30.00s\n"
+        "| 'upload_first_response_time' = 5.00s\n"
+        "| 'upload_server_time' = 1.00s\n"
+        "| 'upload_time' = 5.00s\n"
+        "| 'upload_transfer_time' = 4.00s\n"
+        "| 'validation_time' = 25.00s\n"
+    )
+    assert result.exit_code == 2, f"Unexpected output: {result.output}"
+    assert not checkpoint_path.exists()
+    assert [request.method for request in requests_mock.request_history] == ["GET"]
+
+
+def test_deposit_state_durations_collected_once(sample_metadata, mocked_time):
+    check = DepositCheck(
+        {
+            "swh_web_url": BASE_WEB_URL,
+            "poll_interval": POLL_INTERVAL,
+            "collection": "testcol",
+            "provider_url": PROVIDER_URL,
+            "server": BASE_URL,
+            "username": "test",
+            "password": "test",
+            "archive": "archive.tar.gz",
+            "metadata": sample_metadata,
+        }
+    )
+    metrics: Dict[str, float] = {}
+    check.record_status({"deposit_status": "deposited"})
+    time.sleep(10)
+    check.record_status({"deposit_status": "verified"})
+    check.collect_state_durations(metrics)
+    time.sleep(20)
+    check.record_status({"deposit_status": "done"})
+    check.collect_state_durations(metrics)
+
+    assert metrics == {"state_deposited_time": 10.0, "state_verified_time": 20.0}
+    for state in ("deposited", "verified"):
+        assert (
+            check.registry.get_sample_value(
+                "swh_e2e_state_duration_histogram_seconds_count",
+                {"application": "deposit", "collection": "testcol", "state": state},
+            )
+            == 1
+        )
+
+
+def test_deposit_multi_metrics(
+    requests_mock, sample_archive, sample_metadata, mocked_time, tmp_path
+):
+    """The metrics of each deposit are exported by the multi check"""
+    origin = compute_origin()
+    swhid = "swh:1:dir:02ed6084fb0e8384ac58980e07548a547431cf74"
+    requests_mock.post(
+        f"{BASE_URL}/testcol/", text=ENTRY_TEMPLATE.format(status="deposited")
+    )
+    requests_mock.get(
+        f"{BASE_URL}/testcol/42/status/",
+        text=status_template(status="done", swhid=swhid),
+    )
+    metadata_list = [
+        {
+            "swhid": swhid,
+            "origin": origin,
+            "discovery_date": "2999-03-03T10:48:47+00:00",
+            "metadata_url": f"{BASE_WEB_URL}/the-metadata-url",
+        }
+    ]
+    requests_mock.get(
+        f"{BASE_WEB_URL}/api/1/raw-extrinsic-metadata/swhid/{swhid}/"
+        f"?authority=deposit_client+http%3A%2F%2Ficinga-checker.example.org"
+        f"&after=2022-03-04T17%3A02%3A39%2B00%3A00",
+        [{"status_code": 429}, {"json": metadata_list}],
+    )
+    requests_mock.get(f"{BASE_WEB_URL}/the-metadata-url", text=SAMPLE_METADATA)
+
+    check = MultiDepositCheck(
+        {
+            "swh_web_url": BASE_WEB_URL,
+            "poll_interval": POLL_INTERVAL,
+            "provider_url": PROVIDER_URL,
+            "server": BASE_URL,
+            "username": "test",
+            "password": "test",
+            "prometheus_enabled": True,
+            "prometheus_exporter_directory": str(tmp_path),
+        },
+        [("testcol", sample_archive, sample_metadata)],
+    )
+    assert check.main() == 0
+    check.save_prometheus_metrics()
+
+    labels = {"application": "deposit_multi", "collection": "testcol"}
+    assert check.registry.get_sample_value("swh_e2e_metadata_list_pages", labels) == 1
+    assert check.registry.get_sample_value(
+        "swh_e2e_metadata_list_size_bytes", labels
+    ) == len(json.dumps(metadata_list))
+    assert (
+        check.registry.get_sample_value(
+            "swh_e2e_duration_histogram_seconds_count",
+            {**labels, "step": "upload_transfer", "status": "ok"},
+        )
+        == 1
+    )
+    # the deposit is done, this status has no duration
+    assert (
+        check.registry.get_sample_value(
+            "swh_e2e_state_duration_seconds", {**labels, "state": "done"}
+        )
+        is None
+    )
+
+    # the HTTP metrics of the deposit are exported by the multi check
+    with open(tmp_path / "deposit_multi.prom") as fd:
+        families = {
+            family.name: family for family in text_string_to_metric_families(fd.read())
+        }
+    assert [
+        (sample.labels["collection"], sample.value)
+        for sample in families["swh_e2e_http_retries"].samples
+        if sample.name == "swh_e2e_http_retries_total"
+    ] == [("testcol", 1)]
+
+
+def test_deposit_deadline_exceeded_while_polling(
+    requests_mock, mocker, sample_archive, sample_metadata, mocked_time
+):
+    """The deadline expiring while polling the deposit status ends the check"""
+    # the deadline is measured with the monotonic clock, which follows the
+    # mocked time here
+    mocker.patch("time.monotonic", side_effect=time.time)
+    scenario = WebScenario()
+
+    scenario.add_step(
+        "post", f"{BASE_URL}/testcol/", ENTRY_TEMPLATE.format(status="deposited")
+    )
+    scenario.add_step(
+        "get", f"{BASE_URL}/testcol/42/status/", status_template(status="verified")
+    )
+    scenario.install_mock(requests_mock)
+
+    result = invoke(
+        [
+            "--deadline",
+            "15",
+            "check-deposit",
+            *COMMON_OPTIONS,
+            "single",
+            "--archive",
+            sample_archive,
+            "--metadata",
+            sample_metadata,
+        ],
+        catch_exceptions=True,
+    )
+
+    assert result.output.startswith(
+        "DEPOSIT CRITICAL - Check did not complete within 15.00s: "
+        "Deadline of 15.00s exceeded\n"
+        "| 'total_time' = 20.00s\n"
+    ), result.output
+    assert result.exit_code == 2, f"Unexpected output: {result.output}"
+    # the status was not polled once the deadline expired
+    assert len(requests_mock.request_history) == 2
+
+
+def test_deposit_checkpoint_key(sample_archive, sample_metadata):
+    obj = {
+        "swh_web_url": BASE_WEB_URL,
+        "poll_interval": POLL_INTERVAL,
+        "collection": "testcol",
+        "provider_url": PROVIDER_URL,
+        "server": BASE_URL,
+        "username": "test",
+        "password": "test",
+    }
+    single = DepositCheck(
+        {**obj, "archive": sample_archive, "metadata": sample_metadata}
+    )
+    synthetic = DepositCheck({**obj, "archive_size": 1024, "file_count": 1})
+
+    # both checks deposit in the same collection, but not the same archives
+    assert single.history_key == synthetic.history_key
+    assert single.checkpoint_key != synthetic.checkpoint_key
@@ -0,0 +1,173 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+from concurrent.futures import ThreadPoolExecutor
+
+from prometheus_client import CollectorRegistry, generate_latest
+
+from swh.icinga_plugins.base_check import BaseCheck
+from swh.icinga_plugins.histogram import PersistentHistogram
+from swh.icinga_plugins.textfile import merge_textfile
+
+
+def test_persistent_histogram():
+    registry = CollectorRegistry()
+    histogram = PersistentHistogram(
+        "swh_test_duration", "seconds", ["step"], [10, 60], registry=registry
+    )
+    for value in (5, 10, 30, 100):
+        histogram.observe(["upload"], value)
+
+    assert (
+        registry.get_sample_value(
+            "swh_test_duration_seconds_bucket", {"step": "upload", "le": "10.0"}
+        )
+        == 2
+    )
+    assert (
+        registry.get_sample_value(
+            "swh_test_duration_seconds_bucket", {"step": "upload", "le": "60.0"}
+        )
+        == 3
+    )
+    assert (
+        registry.get_sample_value(
+            "swh_test_duration_seconds_bucket", {"step": "upload", "le": "+Inf"}
+        )
+        == 4
+    )
+    assert (
+        registry.get_sample_value("swh_test_duration_seconds_count", {"step": "upload"})
+        == 4
+    )
+    assert (
+        registry.get_sample_value("swh_test_duration_seconds_sum", {"step": "upload"})
+        == 145
+    )
+
+    restored = PersistentHistogram("swh_test_duration", "seconds", ["step"], [10, 60])
+    restored.merge(histogram.to_dict())
+    assert restored.series == histogram.series
+
+    # observations made with other buckets are dropped
+    other = PersistentHistogram("swh_test_duration", "seconds", ["step"], [10, 30])
+    other.merge(histogram.to_dict())
+    assert other.series == {}
+
+
+def test_histogram_across_runs(tmp_path):
+    def run(value):
+        check = BaseCheck(
+            {
+                "state_directory": str(tmp_path / "state"),
+                "prometheus_enabled": True,
+                "prometheus_exporter_directory": str(tmp_path / "prom"),
+            },
+            "test",
+        )
+        check.register_prometheus_gauge(
+            "duration", "seconds", ["status"], buckets=[10, 60]
+        )
+        check.collect_prometheus_metric("duration", value, ["ok"])
+        check.save_prometheus_metrics()
+        return check
+
+    run(5)
+    run(20)
+    check = run(100)
+
+    # the gauge only has the last value, the histogram all of them
+    labels = {"application": "test", "status": "ok"}
+    assert check.registry.get_sample_value("swh_e2e_duration_seconds", labels) == 100
+    assert [
+        check.registry.get_sample_value(
+            "swh_e2e_duration_histogram_seconds_bucket", {**labels, "le": le}
+        )
+        for le in ("10.0", "60.0", "+Inf")
+    ] == [1, 2, 3]
+
+    with open(tmp_path / "prom" / "test.prom") as fd:
+        textfile = fd.read()
+    assert "# TYPE swh_e2e_duration_histogram_seconds histogram" in textfile
+    assert (
+        'swh_e2e_duration_histogram_seconds_bucket{application="test",'
+        'check_instance="test",le="+Inf",status="ok"} 3.0'
+    ) in textfile
+
+
+def test_histogram_concurrent_runs(tmp_path):
+    def run(value):
+        check = BaseCheck({"state_directory": str(tmp_path)}, "test")
+        check.register_prometheus_gauge("duration", "seconds", buckets=[10, 60])
+        check.collect_prometheus_metric("duration", value)
+        check.merge_histograms_state()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(run, range(32)))
+
+    # no run lost the observations of the others
+    check = BaseCheck({"state_directory": str(tmp_path)}, "test")
+    state = check.load_state(check._histograms_state_name)
+    ((counts, total),) = [
+        (series["counts"], series["sum"])
+        for series in state["swh_e2e_duration_histogram"]["series"]
+    ]
+    assert sum(counts) == 32
+    assert total == sum(range(32))
+
+
+def test_histogram_textfile_merge(tmp_path):
+    path = str(tmp_path / "test.prom")
+    for step in ("upload", "upload", "load"):
+        registry = CollectorRegistry()
+        histogram = PersistentHistogram(
+            "swh_test_duration", "seconds", ["step"], [10], registry=registry
+        )
+        histogram.observe([step], 1)
+        merge_textfile(path, registry)
+
+    with open(path) as fd:
+        textfile = fd.read()
+    assert textfile.count("# TYPE swh_test_duration_seconds histogram") == 1
+    assert 'swh_test_duration_seconds_count{step="upload"} 1.0' in textfile
+    assert 'swh_test_duration_seconds_count{step="load"} 1.0' in textfile
+    # series of the last run are kept together
+    assert "\n".join(generate_latest(registry).decode().splitlines()[2:]) in textfile
+
+
+def test_histogram_without_state_directory(tmp_path):
+    check = BaseCheck(
+        {
+            "prometheus_enabled": True,
+            "prometheus_exporter_directory": str(tmp_path),
+        },
+        "test",
+    )
+    check.register_prometheus_gauge("duration", "seconds", ["step"], buckets=[10])
+    check.collect_prometheus_metric("duration", 5, ["visit"])
+    check.collect_prometheus_metric("duration", 50, ["snapshot"])
+    check.save_prometheus_metrics()
+
+    # observations of the run are all kept
+    for step in ("visit", "snapshot"):
+        assert (
+            check.registry.get_sample_value(
+                "swh_e2e_duration_histogram_seconds_count",
+                {"application": "test", "step": step},
+            )
+            == 1
+        )
+
+
+def test_persistent_histogram_merge():
+    histogram = PersistentHistogram("swh_test_duration", "seconds", ["step"], [10])
+    histogram.observe(["upload"], 5)
+    previous = PersistentHistogram("swh_test_duration", "seconds", ["step"], [10])
+    previous.observe(["upload"], 20)
+    previous.observe(["load"], 1)
+
+    histogram.merge(previous.to_dict())
+
+    assert histogram.series == {("upload",): ([1, 1], 25.0), ("load",): ([1, 0], 1.0)}
@@ -0,0 +1,154 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+from concurrent.futures import ThreadPoolExecutor
+import random
+
+import pytest
+
+from swh.icinga_plugins.base_check import BaseCheck
+from swh.icinga_plugins.history import (
+    RECORD,
+    HistoryStore,
+    P2Quantile,
+    RollingQuantiles,
+)
+
+
+def test_history_store(tmp_path):
+    store = HistoryStore(str(tmp_path / "history"))
+    assert store.metrics() == []
+    assert list(store.read("total_time")) == []
+
+    store.append("total_time", 1000.0, 12.5, 0)
+    store.append("total_time", 1060.0, 130.0, 2)
+    store.append("upload_time", 1060.0, 2.0, 2)
+
+    assert store.metrics() == ["total_time", "upload_time"]
+    assert list(store.read("total_time")) == [(1000.0, 12.5, 0), (1060.0, 130.0, 2)]
+
+    # a record truncated by an interrupted write is ignored
+    with open(store.path("total_time"), "ab") as fd:
+        fd.write(RECORD.pack(1120.0, 1.0, 0)[:7])
+    assert len(list(store.read("total_time"))) == 2
+
+
+@pytest.mark.parametrize("q", [0.5, 0.95, 0.99])
+def test_p2_quantile(q):
+    rng = random.Random(42)
+    values = [rng.lognormvariate(3, 0.5) for _ in range(10000)]
+
+    sketch = P2Quantile(q)
+    for value in values:
+        sketch.add(value)
+        # the state can be saved and restored between any two values
+        sketch = P2Quantile.from_dict(sketch.to_dict())
+
+    assert sketch.count == len(values)
+    exact = sorted(values)[int(q * len(values))]
+    assert sketch.value() == pytest.approx(exact, rel=0.05)
+
+
+def test_p2_quantile_few_values():
+    sketch = P2Quantile(0.5)
+    assert sketch.value() is None
+    for value in [3.0, 1.0, 2.0]:
+        sketch.add(value)
+    assert sketch.value() == 2.0
+
+
+def test_rolling_quantiles():
+    rolling = RollingQuantiles(window=100)
+    for _ in range(100):
+        rolling.add(1.0)
+    assert rolling.quantiles() == {0.5: 1.0, 0.95: 1.0, 0.99: 1.0}
+
+    # the old values are used until enough new ones are known
+    for _ in range(49):
+        rolling.add(10.0)
+    assert rolling.count == 100
+    assert rolling.quantiles()[0.5] == 1.0
+
+    rolling.add(10.0)
+    assert rolling.count == 50
+    assert rolling.quantiles() == {0.5: 10.0, 0.95: 10.0, 0.99: 10.0}
+
+
+class HistoryCheck(BaseCheck):
+    TYPE = "HISTORY"
+
+
+def test_record_history(tmp_path, capsys):
+    for total_time in [10.0, 20.0, 30.0]:
+        check = HistoryCheck(
+            {"state_directory": str(tmp_path), "environment": "pytest"}, "test"
+        )
+        check.print_result("OK", "Done.", total_time=total_time, pages=2)
+
+    assert capsys.readouterr().out.splitlines()[-6:] == [
+        "HISTORY OK - Done.",
+        "| 'pages' = 2",
+        "| 'total_time' = 30.00s",
+        "| 'total_time_p50' = 20.00s",
+        "| 'total_time_p95' = 30.00s",
+        "| 'total_time_p99' = 30.00s",
+    ]
+    assert (
+        check.registry.get_sample_value(
+            "swh_e2e_duration_quantile_seconds",
+            {
+                "pytest": "pytest",
+                "application": "test",
+                "metric": "total_time",
+                "quantile": "p50",
+            },
+        )
+        == 20.0
+    )
+
+    # counts are not recorded
+    store = HistoryStore(str(tmp_path / "history" / "pytest" / "test"))
+    assert store.metrics() == ["total_time"]
+    assert [value for (_, value, _) in store.read("total_time")] == [10.0, 20.0, 30.0]
+
+
+def test_record_history_concurrent(tmp_path):
+    def run(total_time):
+        check = BaseCheck({"state_directory": str(tmp_path)}, "test")
+        check.record_history("OK", {"total_time": float(total_time)})
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(run, range(32)))
+
+    # no run lost the updates of the others, and records are in order
+    check = BaseCheck({"state_directory": str(tmp_path)}, "test")
+    state = check.load_state(check._quantiles_state_name)
+    assert RollingQuantiles.from_dict(state["total_time"]).count == 32
+    store = HistoryStore(str(tmp_path / "history" / "default" / "test"))
+    timestamps = [timestamp for (timestamp, _, _) in store.read("total_time")]
+    assert timestamps == sorted(timestamps)
+
+
+def test_record_history_client_waits(tmp_path):
+    check = BaseCheck({"state_directory": str(tmp_path)}, "test")
+    check.record_history(
+        "OK",
+        {
+            "total_time": 30.0,
+            "http_backoff_time": 5.0,
+            "http_rate_limit_time": 3.0,
+        },
+    )
+
+    # the waits are recorded apart from the time of the check itself
+    store = HistoryStore(str(tmp_path / "history" / "default" / "test"))
+    assert {
+        metric: [value for (_, value, _) in store.read(metric)]
+        for metric in store.metrics()
+    } == {
+        "http_backoff_time": [5.0],
+        "http_rate_limit_time": [3.0],
+        "total_time": [22.0],
+    }
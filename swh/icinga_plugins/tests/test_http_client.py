@@ -0,0 +1,150 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import pytest
+import requests
+
+from swh.icinga_plugins.http_client import (
+    CheckSession,
+    Deadline,
+    DeadlineExceeded,
+    RetryStats,
+    request_size,
+)
+from swh.icinga_plugins.usage import UsageStats
+
+URL = "mock://swh-web.example.org/api/1/ping/"
+
+
+def test_check_session_throttled(requests_mock, mocked_time):
+    requests_mock.get(URL, [{"status_code": 429}, {"status_code": 200}])
+    stats = []
+    session = CheckSession(on_retry_stat=lambda name, amount: stats.append(name))
+
+    response = session.get(URL)
+
+    assert response.status_code == 200
+    assert session.retry_stats == RetryStats(retries=1, throttled=1, backoff_time=1.0)
+    assert stats == ["throttled", "retries", "backoff_time"]
+
+
+def test_check_session_retries_exhausted(requests_mock, mocked_time):
+    requests_mock.get(URL, status_code=503)
+    session = CheckSession()
+
+    response = session.get(URL)
+
+    assert response.status_code == 503
+    assert requests_mock.call_count == 5
+    assert session.retry_stats == RetryStats(
+        retries=4, throttled=0, backoff_time=1111.0
+    )
+
+
+def test_check_session_post_not_retried(requests_mock, mocked_time):
+    requests_mock.post(URL, status_code=500)
+    session = CheckSession()
+
+    response = session.post(URL)
+
+    assert response.status_code == 500
+    assert requests_mock.call_count == 1
+    assert session.retry_stats == RetryStats()
+
+
+def test_check_session_deadline_timeout(requests_mock, mocker):
+    monotonic = mocker.patch("time.monotonic", return_value=1000.0)
+    requests_mock.get(URL, status_code=200)
+    session = CheckSession(deadline=Deadline(60))
+
+    session.get(URL)
+    assert requests_mock.last_request.timeout == (10.0, 60.0)
+
+    monotonic.return_value = 1055.0
+    session.get(URL)
+    assert requests_mock.last_request.timeout == (5.0, 5.0)
+
+    monotonic.return_value = 1060.0
+    with pytest.raises(DeadlineExceeded, match="Deadline of 60.00s exceeded"):
+        session.get(URL)
+    assert requests_mock.call_count == 2
+
+
+def test_check_session_no_retry_past_deadline(requests_mock, mocked_time):
+    requests_mock.get(URL, status_code=503)
+    session = CheckSession(deadline=Deadline(5))
+
+    response = session.get(URL)
+
+    # the second backoff (10s) would exceed the deadline
+    assert response.status_code == 503
+    assert requests_mock.call_count == 2
+    assert session.retry_stats == RetryStats(retries=1, throttled=0, backoff_time=1.0)
+
+
+def test_check_session_derive(requests_mock):
+    requests_mock.get(URL, [{"status_code": 429}, {"status_code": 200}])
+    deadline = Deadline(60)
+    session = CheckSession(deadline=deadline)
+    derived = session.derive()
+    derived.auth = ("user", "pass")
+
+    derived.get(URL)
+
+    assert derived.deadline is deadline
+    assert session.retry_stats.throttled == 1
+    assert session.auth is None
+
+
+def test_check_session_usage(requests_mock, mocked_time):
+    requests_mock.get(URL, [{"status_code": 503}, {"content": b"x" * 1000}])
+    requests_mock.post(URL, content=b"")
+    usage = UsageStats()
+    session = CheckSession(usage=usage)
+
+    response = session.get(URL)
+    session.post(URL, data=b"y" * 500)
+
+    assert usage.http_requests == 3
+    assert usage.http_bytes_sent > 500
+    assert usage.http_bytes_sent == sum(
+        request_size(request) for request in requests_mock.request_history
+    )
+    assert 1000 < usage.http_bytes_received < 1200
+    assert session.derive().usage is usage
+    assert response.content == b"x" * 1000
+
+
+def test_check_session_usage_streamed(requests_mock):
+    requests_mock.get(URL, content=b"x" * 1000)
+    usage = UsageStats()
+    session = CheckSession(usage=usage)
+
+    with session.get(URL, stream=True) as response:
+        headers_size = usage.http_bytes_received
+        assert headers_size < 100
+        response.raw.read(600)
+
+    assert usage.http_bytes_received == headers_size + 600
+
+
+def test_check_session_usage_redirect(requests_mock):
+    requests_mock.get(URL, status_code=302, headers={"Location": URL + "next"})
+    requests_mock.get(URL + "next", status_code=200)
+    usage = UsageStats()
+
+    CheckSession(usage=usage).get(URL)
+
+    assert usage.http_requests == 2
+
+
+def test_check_session_usage_connection_error(requests_mock, mocked_time):
+    requests_mock.post(URL, exc=requests.ConnectionError)
+    usage = UsageStats()
+
+    with pytest.raises(requests.ConnectionError):
+        CheckSession(usage=usage).post(URL)
+
+    assert usage == UsageStats(http_requests=1)
@@ -0,0 +1,28 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+from swh.icinga_plugins.perfdata import PerfData, format_perfdata
+
+
+def test_perfdata_format():
+    assert str(PerfData("total_time", 12.5, "s", 600, 3600, 0)) == (
+        "total_time=12.5s;600;3600;0"
+    )
+    assert str(PerfData("usage_polls", 3)) == "usage_polls=3"
+    assert str(PerfData("usage_max_rss", 1024, "B", max=2048)) == (
+        "usage_max_rss=1024B;;;;2048"
+    )
+    assert str(PerfData("time", 1 / 3, "s")) == "time=0.333333s"
+
+
+def test_perfdata_quoted_label():
+    assert str(PerfData("a label", 1)) == "'a label'=1"
+    assert str(PerfData("it's", 1)) == "'it''s'=1"
+
+
+def test_format_perfdata():
+    assert format_perfdata([PerfData("a", 1), PerfData("b", 2.0, "s", min=0)]) == (
+        "a=1 b=2s;;;0"
+    )
@@ -0,0 +1,60 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import pytest
+
+from swh.icinga_plugins.http_client import CheckSession
+from swh.icinga_plugins.ratelimit import FileTokenBucket, RateLimiter, TokenBucket
+
+
+@pytest.fixture
+def monotonic(mocker):
+    return mocker.patch("time.monotonic", return_value=1000.0)
+
+
+def test_token_bucket(monotonic):
+    bucket = TokenBucket(rate=2, burst=2)
+
+    assert [bucket.reserve() for _ in range(4)] == [0, 0, 0.5, 1.0]
+
+    # the bucket refills up to its burst
+    monotonic.return_value = 1010.0
+    assert [bucket.reserve() for _ in range(3)] == [0, 0, 0.5]
+
+
+def test_token_bucket_invalid():
+    with pytest.raises(ValueError, match="positive rate"):
+        TokenBucket(rate=0, burst=1)
+
+
+def test_file_token_bucket(tmp_path, monotonic):
+    path = str(tmp_path / "ratelimit" / "host.bucket")
+    # e.g. in two processes
+    bucket1 = FileTokenBucket(path, rate=1, burst=2)
+    bucket2 = FileTokenBucket(path, rate=1, burst=2)
+
+    assert bucket1.reserve() == 0
+    assert bucket2.reserve() == 0
+    assert bucket1.reserve() == 1.0
+    assert bucket2.reserve() == 2.0
+
+
+def test_rate_limiter(monotonic, mocked_time):
+    limiter = RateLimiter(rate=1, burst=1)
+
+    assert limiter.acquire("https://archive.example.org/api/1/") == 0
+    assert limiter.acquire("https://archive.example.org/api/1/ping/") == 1.0
+    assert limiter.acquire("https://deposit.example.org/1/") == 0
+
+
+def test_check_session_rate_limited(requests_mock, monotonic, mocked_time):
+    url = "mock://swh-web.example.org/api/1/ping/"
+    requests_mock.get(url, text="pong")
+    session = CheckSession(rate_limiter=RateLimiter(rate=0.5, burst=1))
+
+    for _ in range(3):
+        session.get(url)
+
+    assert session.retry_stats.rate_limit_time == 6.0
@@ -4,7 +4,9 @@
 # See top-level LICENSE file for more information
 
 from datetime import datetime, timezone
+import json
 import random
+import time
 from typing import Dict, List, Optional, Tuple
 
 import pytest
@@ -13,6 +15,7 @@ from swh.icinga_plugins.save_code_now import (
     REPORT_MSG,
     WAITING_STATUSES,
     SaveCodeNowCheck,
+    parse_date,
 )
 
 from .utils import invoke
@@ -251,8 +254,10 @@ def test_save_code_now_unexpected_failure(
     scenario.add_step(
         "get", api_url, [fake_response(origin, visit_type, "accepted", "running")]
     )
-    # unexpected issue when communicating with the api
-    scenario.add_step("get", api_url, {}, status_code=500)
+    # unexpected issue when communicating with the api, which persists after
+    # all retries
+    for _ in range(5):
+        scenario.add_step("get", api_url, {}, status_code=500)
     scenario.install_mock(requests_mock)
 
     with pytest.raises(AssertionError):
@@ -265,3 +270,369 @@ def test_save_code_now_unexpected_failure(
             ],
         )
         # fmt: on
+
+
+SNAPSHOT_ID = "cd" * 20
+
+
+def fake_visit(origin: str, date: Optional[str] = None) -> Dict:
+    """Fake a latest visit api response, made now unless ``date`` is given"""
+    return {
+        "origin": origin,
+        "visit": 1,
+        "date": date or str(datetime.now(tz=timezone.utc)),
+        "status": "full",
+        "snapshot": SNAPSHOT_ID,
+    }
+
+
+def test_save_code_now_check_visit(requests_mock, mocker, mocked_time, origin_info):
+    """Successful ingestion, then the latest visit and its snapshot are read"""
+    scenario = WebScenario()
+    visit_type, origin = my_origin_info = origin_info[0], origin_info[1][0]
+
+    root_api_url = "mock://swh-web.example.org"
+    api_url = SaveCodeNowCheck.api_url_scn(root_api_url, origin, visit_type)
+
+    scenario.add_step(
+        "post",
+        api_url,
+        fake_response(origin, visit_type, "accepted", "pending"),
+    )
+    scenario.add_step(
+        "get", api_url, [fake_response(origin, visit_type, "accepted", "succeeded")]
+    )
+    scenario.add_step(
+        "get",
+        SaveCodeNowCheck.api_url_latest_visit(root_api_url, origin),
+        fake_visit(origin),
+    )
+    scenario.add_step(
+        "get",
+        SaveCodeNowCheck.api_url_snapshot(root_api_url, SNAPSHOT_ID),
+        {"id": SNAPSHOT_ID, "branches": {}},
+    )
+    scenario.install_mock(requests_mock)
+
+    # fmt: off
+    result = invoke(
+        [
+            "check-savecodenow", "--swh-web-url", root_api_url,
+            "origin", origin,
+            "--visit-type", visit_type,
+            "--check-visit",
+        ]
+    )
+    # fmt: on
+
+    assert result.output == (
+        f"{SaveCodeNowCheck.TYPE} OK - {REPORT_MSG} {my_origin_info} took "
+        f"10.00s and succeeded.\n"
+        f"| 'freshness_time' = 10.00s\n"
+        f"| 'snapshot_time' = 0.00s\n"
+        f"| 'total_time' = 10.00s\n"
+        f"| 'visit_time' = 0.00s\n"
+    )
+    assert result.exit_code == 0, f"Unexpected result: {result.output}"
+
+
+def test_save_code_now_check_visit_stale(
+    requests_mock, mocker, mocked_time, origin_info
+):
+    """Successful ingestion whose latest visit is older than the save request
+    should be critical"""
+    scenario = WebScenario()
+    visit_type, origin = my_origin_info = origin_info[0], origin_info[1][0]
+
+    root_api_url = "mock://swh-web.example.org"
+    api_url = SaveCodeNowCheck.api_url_scn(root_api_url, origin, visit_type)
+
+    scenario.add_step(
+        "post",
+        api_url,
+        fake_response(origin, visit_type, "accepted", "pending"),
+    )
+    scenario.add_step(
+        "get", api_url, [fake_response(origin, visit_type, "accepted", "succeeded")]
+    )
+    scenario.add_step(
+        "get",
+        SaveCodeNowCheck.api_url_latest_visit(root_api_url, origin),
+        fake_visit(origin, "2000-01-01T00:00:00+00:00"),
+    )
+    scenario.install_mock(requests_mock)
+
+    # fmt: off
+    result = invoke(
+        [
+            "check-savecodenow", "--swh-web-url", root_api_url,
+            "origin", origin,
+            "--visit-type", visit_type,
+            "--check-visit",
+        ],
+        catch_exceptions=True,
+    )
+    # fmt: on
+
+    assert result.output.startswith(
+        f"{SaveCodeNowCheck.TYPE} CRITICAL - {REPORT_MSG} {my_origin_info} took "
+        f"10.00s and succeeded, but its latest visit 1 "
+        f"(2000-01-01T00:00:00+00:00) is older than the save request.\n"
+    )
+    assert result.exit_code == 2, f"Unexpected result: {result.output}"
+
+
+def test_save_code_now_check_visit_concurrent(
+    requests_mock, mocker, mocked_time, origin_info
+):
+    """The snapshot of the save request is read at the same time as the visit"""
+    scenario = WebScenario()
+    visit_type, origin = origin_info[0], origin_info[1][0]
+
+    root_api_url = "mock://swh-web.example.org"
+    api_url = SaveCodeNowCheck.api_url_scn(root_api_url, origin, visit_type)
+
+    succeeded = fake_response(origin, visit_type, "accepted", "succeeded")
+    succeeded["snapshot_swhid"] = f"swh:1:snp:{SNAPSHOT_ID}"
+    scenario.add_step(
+        "post",
+        api_url,
+        fake_response(origin, visit_type, "accepted", "pending"),
+    )
+    scenario.add_step("get", api_url, [succeeded])
+    scenario.install_mock(requests_mock)
+
+    # both reads are concurrent, so they cannot be ordered steps of the scenario
+    visit_mock = requests_mock.get(
+        SaveCodeNowCheck.api_url_latest_visit(root_api_url, origin),
+        json=fake_visit(origin),
+    )
+    snapshot_mock = requests_mock.get(
+        SaveCodeNowCheck.api_url_snapshot(root_api_url, SNAPSHOT_ID),
+        json={"id": SNAPSHOT_ID, "branches": {}},
+    )
+
+    # fmt: off
+    result = invoke(
+        [
+            "check-savecodenow", "--swh-web-url", root_api_url,
+            "origin", origin,
+            "--visit-type", visit_type,
+            "--check-visit",
+        ]
+    )
+    # fmt: on
+
+    assert visit_mock.call_count == 1
+    assert snapshot_mock.call_count == 1
+    assert result.exit_code == 0, f"Unexpected result: {result.output}"
+
+
+def test_save_code_now_check_visit_missing(
+    requests_mock, mocker, mocked_time, origin_info
+):
+    """Successful ingestion without any visit available should be critical"""
+    scenario = WebScenario()
+    visit_type, origin = my_origin_info = origin_info[0], origin_info[1][0]
+
+    root_api_url = "mock://swh-web.example.org"
+    api_url = SaveCodeNowCheck.api_url_scn(root_api_url, origin, visit_type)
+
+    scenario.add_step(
+        "post",
+        api_url,
+        fake_response(origin, visit_type, "accepted", "pending"),
+    )
+    scenario.add_step(
+        "get", api_url, [fake_response(origin, visit_type, "accepted", "succeeded")]
+    )
+    scenario.add_step(
+        "get",
+        SaveCodeNowCheck.api_url_latest_visit(root_api_url, origin),
+        {"exception": "NotFoundExc"},
+        status_code=404,
+    )
+    scenario.install_mock(requests_mock)
+
+    # fmt: off
+    result = invoke(
+        [
+            "check-savecodenow", "--swh-web-url", root_api_url,
+            "origin", origin,
+            "--visit-type", visit_type,
+            "--check-visit",
+        ],
+        catch_exceptions=True,
+    )
+    # fmt: on
+
+    assert result.output == (
+        f"{SaveCodeNowCheck.TYPE} CRITICAL - {REPORT_MSG} {my_origin_info} took "
+        f"10.00s and succeeded, but getting its latest visit returned code 404.\n"
+        f"| 'freshness_time' = 10.00s\n"
+        f"| 'total_time' = 10.00s\n"
+        f"| 'visit_time' = 0.00s\n"
+    )
+    assert result.exit_code == 2, f"Unexpected result: {result.output}"
+
+
+def test_save_code_now_resume(requests_mock, mocked_time, origin_info, tmp_path):
+    """The save request of an interrupted run is polled instead of a new one"""
+    visit_type, origins = origin_info
+    origin = origins[3]
+    checkpoint_path = tmp_path / f"checkpoint-default-scn_{visit_type}.json"
+    checkpoint_path.write_text(
+        json.dumps(
+            {
+                "origin": origin,
+                "start_time": time.time() - 40,
+                "request_date": "to-replace",
+            }
+        )
+    )
+
+    scenario = WebScenario()
+    api_url = SaveCodeNowCheck.api_url_scn(
+        "mock://swh-web.example.org", origin, visit_type
+    )
+    scenario.add_step(
+        "get", api_url, [fake_response(origin, visit_type, "accepted", "running")]
+    )
+    scenario.add_step(
+        "get", api_url, [fake_response(origin, visit_type, "accepted", "succeeded")]
+    )
+    scenario.install_mock(requests_mock)
+
+    # fmt: off
+    result = invoke(
+        [
+            "--state-directory", str(tmp_path),
+            "check-savecodenow", "--swh-web-url", "mock://swh-web.example.org",
+            "origin", *origins,
+            "--visit-type", visit_type,
+        ]
+    )
+    # fmt: on
+
+    assert result.output.startswith(
+        f"{SaveCodeNowCheck.TYPE} OK - {REPORT_MSG} {(visit_type, origin)} took "
+        f"50.00s and succeeded.\n"
+    )
+    assert result.exit_code == 0, f"Unexpected result: {result.output}"
+    assert not checkpoint_path.exists()
+
+
+def test_save_code_now_resume_missing_request(
+    requests_mock, mocked_time, origin_info, tmp_path
+):
+    """Checkpoints of save requests which do not exist anymore are dropped, and a
+    new save request is made"""
+    visit_type, origins = origin_info
+    origin = origins[0]
+    checkpoint_path = tmp_path / f"checkpoint-default-scn_{visit_type}.json"
+    checkpoint_path.write_text(
+        json.dumps(
+            {
+                "origin": origin,
+                "start_time": time.time() - 40,
+                "request_date": "2022-03-04T17:01:59+00:00",
+            }
+        )
+    )
+
+    scenario = WebScenario()
+    api_url = SaveCodeNowCheck.api_url_scn(
+        "mock://swh-web.example.org", origin, visit_type
+    )
+    # only other save requests of the origin are left
+    scenario.add_step(
+        "get", api_url, [fake_response(origin, visit_type, "accepted", "succeeded")]
+    )
+    scenario.add_step(
+        "post", api_url, fake_response(origin, visit_type, "accepted", "pending")
+    )
+    scenario.add_step(
+        "get", api_url, [fake_response(origin, visit_type, "accepted", "succeeded")]
+    )
+    scenario.install_mock(requests_mock)
+
+    # fmt: off
+    result = invoke(
+        [
+            "--state-directory", str(tmp_path),
+            "check-savecodenow", "--swh-web-url", "mock://swh-web.example.org",
+            "origin", origin,
+            "--visit-type", visit_type,
+        ]
+    )
+    # fmt: on
+
+    assert result.output.startswith(
+        f"{SaveCodeNowCheck.TYPE} OK - {REPORT_MSG} {(visit_type, origin)} took "
+        f"10.00s and succeeded.\n"
+    )
+    assert result.exit_code == 0, f"Unexpected result: {result.output}"
+    assert not checkpoint_path.exists()
+
+
+def test_save_code_now_resume_timed_out(
+    requests_mock, mocked_time, origin_info, tmp_path
+):
+    """Checkpoints of save requests which already timed out are ignored"""
+    visit_type, origins = origin_info
+    origin = origins[0]
+    checkpoint_path = tmp_path / f"checkpoint-default-scn_{visit_type}.json"
+    checkpoint_path.write_text(
+        json.dumps(
+            {
+                "origin": origin,
+                "start_time": time.time() - 500,
+                "request_date": "to-replace",
+            }
+        )
+    )
+
+    scenario = WebScenario()
+    api_url = SaveCodeNowCheck.api_url_scn(
+        "mock://swh-web.example.org", origin, visit_type
+    )
+    scenario.add_step(
+        "post", api_url, fake_response(origin, visit_type, "accepted", "pending")
+    )
+    scenario.add_step(
+        "get", api_url, [fake_response(origin, visit_type, "accepted", "succeeded")]
+    )
+    scenario.install_mock(requests_mock)
+
+    # fmt: off
+    result = invoke(
+        [
+            "--state-directory", str(tmp_path),
+            "check-savecodenow", "--swh-web-url", "mock://swh-web.example.org",
+            "origin", origin,
+            "--visit-type", visit_type,
+        ]
+    )
+    # fmt: on
+
+    assert result.output.startswith(
+        f"{SaveCodeNowCheck.TYPE} OK - {REPORT_MSG} {(visit_type, origin)} took "
+        f"10.00s and succeeded.\n"
+    )
+    assert result.exit_code == 0, f"Unexpected result: {result.output}"
+    assert not checkpoint_path.exists()
+
+
+@pytest.mark.parametrize(
+    "visit_date,stale",
+    [
+        ("2024-01-01T11:00:00", True),
+        ("2024-01-01T13:00:00", False),
+        ("2024-01-01T13:00:00+02:00", True),
+        ("2024-01-01T12:00:00Z", False),
+    ],
+)
+def test_parse_date_mixed_formats(visit_date, stale):
+    """Dates without offset are in UTC, and can be compared to other dates"""
+    request_date = parse_date("2024-01-01 12:00:00.000000+00:00")
+    assert (parse_date(visit_date) < request_date) == stale
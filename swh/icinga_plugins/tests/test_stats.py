@@ -0,0 +1,227 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import json
+import random
+import time
+
+import pytest
+
+from swh.icinga_plugins.history import HistoryStore
+from swh.icinga_plugins.tests.utils import invoke
+
+np = pytest.importorskip("numpy")
+
+from swh.icinga_plugins.stats import (  # noqa: E402
+    DAY,
+    burn_rate,
+    compute_stats,
+    ewma,
+    ewma_zscore,
+    linear_trend,
+    load_history,
+)
+
+
+@pytest.mark.parametrize("alpha", [0.01, 0.5, 1.0])
+def test_ewma(alpha):
+    rng = random.Random(42)
+    values = [rng.uniform(0, 1000) for _ in range(2000)]
+
+    expected = []
+    smoothed = values[0]
+    for value in values:
+        smoothed = alpha * value + (1 - alpha) * smoothed
+        expected.append(smoothed)
+
+    assert ewma(np.array(values), alpha) == pytest.approx(expected)
+
+
+def test_ewma_zscore():
+    values = np.array([10.0, 11.0] * 50 + [10.0])
+    assert abs(ewma_zscore(values, 0.1)) < 2
+    values[-1] = 20.0
+    assert ewma_zscore(values, 0.1) > 10
+    assert ewma_zscore(np.array([10.0, 10.0, 10.0]), 0.1) is None
+
+
+def test_linear_trend():
+    timestamps = np.arange(0, 10 * DAY, 3600, dtype=np.float64)
+    assert linear_trend(timestamps, 100 + 2 * timestamps / DAY) == pytest.approx(2)
+    assert linear_trend(timestamps[:1], timestamps[:1]) is None
+
+
+def test_burn_rate():
+    statuses = np.array([0] * 97 + [1, 2, 3])
+    assert burn_rate(statuses, 0.99) == pytest.approx(2)
+    assert burn_rate(statuses[:0], 0.99) is None
+
+
+def test_load_history(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    assert len(load_history(store.path("total_time"))) == 0
+
+    for i in range(10):
+        store.append("total_time", 1000.0 + i, 10.0 * i, i % 3)
+    with open(store.path("total_time"), "ab") as fd:
+        fd.write(b"\0\0\0")
+
+    history = load_history(store.path("total_time"))
+    assert [tuple(record) for record in history.tolist()] == list(
+        store.read("total_time")
+    )
+
+
+def test_stats_cli(tmp_path, mocked_time):
+    now = time.time()
+    store = HistoryStore(str(tmp_path / "history" / "production" / "vault"))
+    for i in range(100):
+        store.append("total_time", now - (100 - i) * 3600, 100.0 + (i % 2), 0)
+    store.append("total_time", now, 300.0, 2)
+    HistoryStore(str(tmp_path / "history" / "production" / "scn")).append(
+        "upload_time", now, 1.0, 0
+    )
+
+    result = invoke(
+        [
+            "--state-directory",
+            str(tmp_path),
+            "--environment",
+            "production",
+            "stats",
+            "--trend-days",
+            "1",
+        ]
+    )
+
+    assert result.exit_code == 0, result.output
+    (summary, header, row, checks) = result.output.splitlines()
+    assert summary == "STATS OK - Statistics of total_time in 1 checks"
+    assert checks == "| 'checks' = 1"
+    assert header.split() == [
+        "check",
+        "samples",
+        "last",
+        "ewma",
+        "z-score",
+        "trend/day",
+        "burn",
+        "rate",
+    ]
+    (check, samples, last, smoothed, zscore, trend, rate) = row.split()
+    assert (check, samples, last) == ("vault", "101", "300.00")
+    assert float(smoothed) == pytest.approx(120.47, abs=0.01)
+    assert float(zscore) > 10
+    assert float(trend) > 0
+    # 1 error out of the 24 runs of the last day, for a budget of 1%
+    assert float(rate) == pytest.approx(100 / 25, abs=0.01)
+
+
+def test_compute_stats_unsorted(tmp_path):
+    """Records appended out of order by concurrent runs are sorted by time"""
+    now = 100 * DAY
+    store = HistoryStore(str(tmp_path))
+    for i in range(10):
+        store.append("total_time", now - (10 - i) * DAY, 100.0, 0)
+    # a failed run appended before the record of an earlier run
+    store.append("total_time", now - 0.5 * DAY, 50.0, 2)
+    store.append("total_time", now - 0.75 * DAY, 200.0, 0)
+
+    stats = compute_stats(
+        store.path("total_time"),
+        "vault",
+        "total_time",
+        now,
+        trend_days=2,
+        slo_window_days=0.6,
+    )
+
+    assert stats.last == 50.0
+    # only the run of the last 0.6 day
+    assert stats.burn_rate == pytest.approx(100)
+    # the runs of the last two days, in the order they started
+    assert stats.trend == pytest.approx(
+        linear_trend(
+            np.array([now - 2 * DAY, now - DAY, now - 0.75 * DAY, now - 0.5 * DAY]),
+            np.array([100.0, 100.0, 200.0, 50.0]),
+        )
+    )
+
+
+def test_stats_cli_json(tmp_path, mocked_time):
+    state_directory = tmp_path / "state"
+    spool_directory = tmp_path / "spool"
+    now = time.time()
+    store = HistoryStore(str(state_directory / "history" / "default" / "vault"))
+    for i in range(10):
+        store.append("total_time", now - (10 - i) * 3600, 100.0, i % 5 // 4 * 2)
+
+    result = invoke(
+        [
+            "--state-directory",
+            str(state_directory),
+            "--output",
+            "json",
+            "--output-spool-directory",
+            str(spool_directory),
+            "stats",
+        ]
+    )
+
+    assert result.exit_code == 0, result.output
+    (line,) = result.output.splitlines()
+    document = json.loads(line)
+    assert document["check"] == "STATS"
+    assert document["status"] == "OK"
+    assert document["metrics"] == {"checks": 1}
+    (stats,) = document["stats"]
+    assert stats["check"] == "vault"
+    assert stats["count"] == 10
+    assert stats["last"] == 100.0
+    assert stats["burn_rate"] == pytest.approx(20)
+
+    (spooled,) = spool_directory.iterdir()
+    assert json.loads(spooled.read_text()) == document
+
+
+def test_stats_cli_deadline(tmp_path, mocker, mocked_time):
+    mocker.patch("time.monotonic", side_effect=time.time)
+    now = time.time()
+    for check in ("scn", "vault"):
+        HistoryStore(str(tmp_path / "history" / "default" / check)).append(
+            "total_time", now, 100.0, 0
+        )
+    mocker.patch(
+        "swh.icinga_plugins.stats.compute_stats",
+        side_effect=lambda *args, **kwargs: time.sleep(20),
+    )
+
+    result = invoke(
+        ["--state-directory", str(tmp_path), "--deadline", "15", "stats"],
+        catch_exceptions=True,
+    )
+
+    assert result.output.startswith(
+        "STATS CRITICAL - Check did not complete within 15.00s: "
+        "Deadline of 15.00s exceeded\n"
+        "| 'total_time' = 20.00s\n"
+    ), result.output
+    assert result.exit_code == 2, result.output
+
+
+def test_stats_cli_no_state_directory():
+    result = invoke(["stats"], catch_exceptions=True)
+
+    assert result.exit_code == 2
+    assert "Missing option '--state-directory'" in result.output
+
+
+def test_profile_cli_no_directory():
+    result = invoke(["--profile", "stats"], catch_exceptions=True)
+
+    assert result.exit_code == 2
+    assert "Missing option '--profile-directory' or '--state-directory'" in (
+        result.output
+    )
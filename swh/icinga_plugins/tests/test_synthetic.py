@@ -0,0 +1,49 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import hashlib
+import io
+import tarfile
+
+import pytest
+
+from swh.icinga_plugins.synthetic import SyntheticArchive
+
+
+@pytest.mark.parametrize("size,file_count", [(0, 1), (1000, 3), (200_000, 2)])
+def test_synthetic_archive(size, file_count):
+    archive = SyntheticArchive(size, file_count, "some-seed")
+    content = b"".join(archive.chunks())
+
+    assert len(content) == len(archive)
+    assert len(content) % tarfile.RECORDSIZE == 0
+    assert archive.md5() == hashlib.md5(content).hexdigest()
+
+    with tarfile.open(fileobj=io.BytesIO(content), mode="r:") as tf:
+        members = tf.getmembers()
+        assert [member.name for member in members] == [
+            f"synthetic-some-seed/file-{index:06d}.bin" for index in range(file_count)
+        ]
+        assert sum(member.size for member in members) == size
+        for member in members:
+            fd = tf.extractfile(member)
+            assert fd is not None
+            assert len(fd.read()) == member.size
+
+
+def test_synthetic_archive_unique():
+    content = b"".join(SyntheticArchive(1000, 2, "seed1").chunks())
+    assert content == b"".join(SyntheticArchive(1000, 2, "seed1").chunks())
+    assert content != b"".join(SyntheticArchive(1000, 2, "seed2").chunks())
+
+
+def test_synthetic_archive_metadata():
+    metadata = SyntheticArchive(1000, 2, "some-seed").metadata()
+    assert "<title>Synthetic deposit some-seed</title>" in metadata
+
+
+def test_synthetic_archive_no_file():
+    with pytest.raises(ValueError, match="at least one file"):
+        SyntheticArchive(1000, 0, "some-seed")
@@ -0,0 +1,138 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import stat
+import time
+
+from prometheus_client import CollectorRegistry, Counter, Gauge
+from prometheus_client.parser import text_string_to_metric_families
+
+from swh.icinga_plugins.base_check import BaseCheck
+from swh.icinga_plugins.textfile import merge_textfile
+
+
+def run_registry(duration, retries=None):
+    registry = CollectorRegistry()
+    gauge = Gauge("swh_test_duration", "", ["application"], registry=registry)
+    gauge.labels("scn").set(duration)
+    if retries is not None:
+        counter = Counter("swh_test_retries", "", ["application"], registry=registry)
+        counter.labels("scn").inc(retries)
+    return registry
+
+
+def read_samples(path):
+    with open(path) as fd:
+        return {
+            (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+            for family in text_string_to_metric_families(fd.read())
+            for sample in family.samples
+            if not sample.name.endswith("_created")
+        }
+
+
+def test_merge_textfile(tmp_path, mocked_time):
+    path = str(tmp_path / "scn.prom")
+
+    merge_textfile(path, run_registry(10, retries=1), {"check": "scn_git"})
+    merge_textfile(path, run_registry(20), {"check": "scn_svn"})
+    # the same check replaces its own series
+    merge_textfile(path, run_registry(30, retries=2), {"check": "scn_git"})
+
+    assert read_samples(path) == {
+        ("swh_test_duration", (("application", "scn"), ("check", "scn_git"))): 30,
+        ("swh_test_duration", (("application", "scn"), ("check", "scn_svn"))): 20,
+        ("swh_test_retries_total", (("application", "scn"), ("check", "scn_git"))): 2,
+    }
+    with open(path) as fd:
+        # each family is written once
+        assert fd.read().count("# TYPE swh_test_retries_total counter") == 1
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "scn.prom",
+        "scn.prom.ages.json",
+        "scn.prom.lock",
+    ]
+
+
+def test_merge_textfile_replaces_instance(tmp_path, mocked_time):
+    path = str(tmp_path / "scn.prom")
+
+    merge_textfile(path, run_registry(10, retries=1), {"check": "scn_git"})
+    merge_textfile(path, run_registry(20, retries=3), {"check": "scn_svn"})
+    # series of the previous run of scn_git it did not write are removed
+    merge_textfile(path, run_registry(30), {"check": "scn_git"})
+
+    assert read_samples(path) == {
+        ("swh_test_duration", (("application", "scn"), ("check", "scn_git"))): 30,
+        ("swh_test_duration", (("application", "scn"), ("check", "scn_svn"))): 20,
+        ("swh_test_retries_total", (("application", "scn"), ("check", "scn_svn"))): 3,
+    }
+
+
+def test_merge_textfile_mode(tmp_path, mocked_time):
+    path = str(tmp_path / "scn.prom")
+    umask = os.umask(0o022)
+    try:
+        merge_textfile(path, run_registry(10))
+    finally:
+        os.umask(umask)
+
+    # readable by the node exporter, which usually runs as another user
+    for written in (path, path + ".ages.json"):
+        assert stat.S_IMODE(os.stat(written).st_mode) == 0o644
+
+
+def test_merge_textfile_expires(tmp_path, mocked_time):
+    path = str(tmp_path / "scn.prom")
+
+    merge_textfile(path, run_registry(10), {"check": "scn_git"}, max_age=100)
+    time.sleep(60)
+    merge_textfile(path, run_registry(20), {"check": "scn_svn"}, max_age=100)
+    time.sleep(60)
+    merge_textfile(path, run_registry(30), {"check": "scn_hg"}, max_age=100)
+
+    assert read_samples(path) == {
+        ("swh_test_duration", (("application", "scn"), ("check", "scn_hg"))): 30,
+        ("swh_test_duration", (("application", "scn"), ("check", "scn_svn"))): 20,
+    }
+
+
+def test_merge_textfile_concurrent(tmp_path):
+    path = str(tmp_path / "scn.prom")
+
+    def write(i):
+        merge_textfile(path, run_registry(i), {"check": f"check_{i}"})
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(write, range(32)))
+
+    assert len(read_samples(path)) == 32
+
+
+def test_save_concurrent_checks(tmp_path):
+    for visit_type, duration in [("git", 10), ("svn", 20)]:
+        check = BaseCheck(
+            {
+                "prometheus_enabled": True,
+                "prometheus_exporter_directory": str(tmp_path),
+            },
+            "scn",
+        )
+        check.history_key = f"scn_{visit_type}"
+        check.register_prometheus_gauge("duration", "seconds")
+        check.collect_prometheus_metric("duration", duration)
+        check.save_prometheus_metrics()
+
+    samples = read_samples(tmp_path / "scn.prom")
+    assert {
+        labels: value
+        for ((name, labels), value) in samples.items()
+        if name == "swh_e2e_duration_seconds"
+    } == {
+        (("application", "scn"), ("check_instance", "scn_git")): 10,
+        (("application", "scn"), ("check_instance", "scn_svn")): 20,
+    }
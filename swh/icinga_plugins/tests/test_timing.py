@@ -0,0 +1,137 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+
+import pytest
+
+from swh.icinga_plugins.base_check import BaseCheck
+from swh.icinga_plugins.http_client import CheckSession
+from swh.icinga_plugins.timing import endpoint_template, parse_server_timing
+
+
+@pytest.mark.parametrize(
+    "url,endpoint",
+    [
+        (
+            "https://archive.example.org/api/1/vault/directory/" + "ab" * 20 + "/",
+            "archive.example.org/api/1/vault/directory/{id}/",
+        ),
+        (
+            "https://archive.example.org/api/1/vault/directory/"
+            + "ab" * 20
+            + "/raw/?foo=bar",
+            "archive.example.org/api/1/vault/directory/{id}/raw/",
+        ),
+        (
+            "https://archive.example.org/api/1/origin/save/git/url/"
+            "https://github.com/foo/bar/",
+            "archive.example.org/api/1/origin/save/git/url/{origin}/",
+        ),
+        (
+            "https://archive.example.org/api/1/origin/https://github.com/foo/bar"
+            "/visit/latest/?require_snapshot=true",
+            "archive.example.org/api/1/origin/{origin}/visit/latest/",
+        ),
+        (
+            "https://deposit.example.org/1/testcol/42/status/",
+            "deposit.example.org/1/testcol/{id}/status/",
+        ),
+        (
+            "https://archive.example.org/api/1/snapshot/" + "cd" * 20 + "/",
+            "archive.example.org/api/1/snapshot/{id}/",
+        ),
+    ],
+)
+def test_endpoint_template(url, endpoint):
+    assert endpoint_template(url) == endpoint
+
+
+def test_parse_server_timing():
+    assert parse_server_timing(
+        'db;dur=53, app;dur=47.2, cache;desc="Cache Read";dur=23.2, miss, bad;dur=x'
+    ) == pytest.approx({"db": 0.053, "app": 0.0472, "cache": 0.0232})
+    assert parse_server_timing("") == {}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"x" * 1000
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Server-Timing", "db;dur=12, render;dur=3")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://localhost:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_request_timing(server_url):
+    timings = []
+    session = CheckSession(on_request_timing=timings.append)
+
+    url = server_url + "/api/1/vault/directory/" + "ab" * 20 + "/"
+    assert session.get(url).content == b"x" * 1000
+    assert session.get(url).status_code == 200
+
+    (first, second) = timings
+    assert first.endpoint == endpoint_template(url)
+    assert first.endpoint.endswith("/api/1/vault/directory/{id}/")
+    assert (first.method, first.status_code) == ("GET", 200)
+    assert first.dns > 0
+    assert first.connect > 0
+    assert first.tls == 0
+    assert first.ttfb > 0
+    assert first.transfer is not None
+    assert first.server_timing == {"db": 0.012, "render": 0.003}
+
+    # the connection is reused
+    assert (second.dns, second.connect) == (0, 0)
+    assert second.ttfb > 0
+
+
+def test_request_timing_metrics(server_url):
+    check = BaseCheck({}, "test")
+    check.session.get(server_url + "/1/testcol/42/status/", stream=True).close()
+
+    endpoint = server_url.split("://")[1] + "/1/testcol/{id}/status/"
+    labels = {"application": "test", "endpoint": endpoint}
+    assert (
+        check.registry.get_sample_value(
+            "swh_e2e_http_requests_total",
+            {**labels, "method": "GET", "status_code": "200"},
+        )
+        == 1
+    )
+    assert (
+        check.registry.get_sample_value(
+            "swh_e2e_http_phase_duration_seconds_total", {**labels, "phase": "ttfb"}
+        )
+        > 0
+    )
+    # the body of streamed responses is read by the caller
+    assert (
+        check.registry.get_sample_value(
+            "swh_e2e_http_phase_duration_seconds_total", {**labels, "phase": "transfer"}
+        )
+        is None
+    )
+    assert check.registry.get_sample_value(
+        "swh_e2e_http_server_timing_seconds_total", {**labels, "metric": "db"}
+    ) == pytest.approx(0.012)
@@ -0,0 +1,154 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+
+import pytest
+
+from swh.icinga_plugins.tests.utils import invoke
+from swh.icinga_plugins.tracing import STATUS_ERROR, Tracer
+
+from .test_vault import (
+    DIR_ID,
+    TARBALL,
+    FakeStorage,
+    response_done,
+    response_pending,
+    url_api,
+    url_fetch,
+)
+from .web_scenario import WebScenario
+
+
+def span_tree(document):
+    """Returns the names of the spans of an OTLP document as nested tuples"""
+    (resource_spans,) = document["resourceSpans"]
+    (scope_spans,) = resource_spans["scopeSpans"]
+    spans = scope_spans["spans"]
+    assert len({span["traceId"] for span in spans}) == 1
+
+    def children(parent_id):
+        return [
+            (span["name"], children(span["spanId"]))
+            for span in spans
+            if span.get("parentSpanId") == parent_id
+        ]
+
+    return children(None)
+
+
+def test_tracer():
+    tracer = Tracer({"service.name": "test"})
+
+    def work(i):
+        with tracer.span(f"worker {i}"):
+            pass
+
+    with tracer.span("root"):
+        tracer.start_phase("first")
+        with tracer.span("request"):
+            with tracer.span("inner"):
+                pass
+        tracer.start_phase("second")
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            # spans of other threads are attached to the current phase
+            list(executor.map(work, [0]))
+        with pytest.raises(ValueError):
+            with tracer.span("failing"):
+                raise ValueError("boo")
+        tracer.end_phase()
+
+    document = tracer.to_otlp()
+    assert span_tree(document) == [
+        (
+            "root",
+            [
+                ("first", [("request", [("inner", [])])]),
+                ("second", [("worker 0", []), ("failing", [])]),
+            ],
+        )
+    ]
+    spans = {
+        span["name"]: span
+        for span in document["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    }
+    assert spans["failing"]["status"] == {
+        "code": STATUS_ERROR,
+        "message": "ValueError: boo",
+    }
+    assert int(spans["root"]["endTimeUnixNano"]) >= int(
+        spans["root"]["startTimeUnixNano"]
+    )
+    assert document["resourceSpans"][0]["resource"]["attributes"] == [
+        {"key": "service.name", "value": {"stringValue": "test"}}
+    ]
+
+
+def test_vault_trace(requests_mock, mocker, mocked_time, tmp_path):
+    scenario = WebScenario()
+    scenario.add_step("get", url_api, {}, status_code=404)
+    scenario.add_step("post", url_api, response_pending)
+    scenario.add_step("get", url_api, {}, status_code=503)
+    scenario.add_step("get", url_api, response_done)
+    scenario.add_step(
+        "get", url_fetch, TARBALL, headers={"Content-Type": "application/gzip"}
+    )
+    scenario.install_mock(requests_mock)
+    collector = requests_mock.post("mock://collector.example.org/v1/traces")
+
+    get_storage_mock = mocker.patch("swh.icinga_plugins.vault.get_storage")
+    get_storage_mock.side_effect = FakeStorage
+
+    trace_file = tmp_path / "traces.jsonl"
+    result = invoke(
+        [
+            "--trace-file",
+            str(trace_file),
+            "--trace-endpoint",
+            "mock://collector.example.org/v1/traces",
+            "check-vault",
+            "--swh-web-url",
+            "mock://swh-web.example.org",
+            "--swh-storage-url",
+            "foo://example.org",
+            "directory",
+        ]
+    )
+    assert result.exit_code == 0, result.output
+
+    (line,) = trace_file.read_text().splitlines()
+    document = json.loads(line)
+    endpoint = "GET swh-web.example.org/api/1/vault/directory/{id}/"
+    assert span_tree(document) == [
+        (
+            "check vault",
+            [
+                ("pick", [(endpoint, [])]),
+                (
+                    "cook",
+                    [
+                        ("POST swh-web.example.org/api/1/vault/directory/{id}/", []),
+                        (endpoint, []),
+                    ],
+                ),
+                ("fetch", [(endpoint + "raw/", [])]),
+            ],
+        )
+    ]
+    spans = document["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    (poll,) = [span for span in spans if span["name"] == endpoint and span["events"]]
+    assert [event["name"] for event in poll["events"]] == ["retry"]
+    assert {"key": "url.full", "value": {"stringValue": url_api}} in poll["attributes"]
+    assert {
+        "key": "http.response.status_code",
+        "value": {"intValue": "200"},
+    } in poll["attributes"]
+    assert DIR_ID not in json.dumps(
+        [span["name"] for span in spans]
+    ), "span names are endpoint templates"
+
+    assert collector.call_count == 1
+    assert collector.last_request.json() == document
@@ -4,11 +4,15 @@
 # See top-level LICENSE file for more information
 
 import io
+import json
 import sys
 import tarfile
 import time
 
+import requests
+
 from swh.icinga_plugins.tests.utils import invoke
+from swh.icinga_plugins.vault import VaultCheck
 
 from .web_scenario import WebScenario
 
@@ -73,9 +77,11 @@ response_unknown_status = {
 
 class FakeStorage:
     def __init__(self, foo, **kwargs):
-        pass
+        self.timeout = kwargs.get("timeout")
+        self.call_timeouts = []
 
     def directory_get_random(self):
+        self.call_timeouts.append(self.timeout)
         return bytes.fromhex(DIR_ID)
 
 
@@ -374,13 +380,15 @@ def test_vault_fetch_failed(requests_mock, mocker, mocked_time):
     scenario.add_step("get", url_api, {}, status_code=404)
     scenario.add_step("post", url_api, response_pending)
     scenario.add_step("get", url_api, response_done)
-    scenario.add_step(
-        "get",
-        url_fetch,
-        "",
-        status_code=500,
-        headers={"Content-Type": "application/gzip"},
-    )
+    # the fetch is retried on server errors
+    for _ in range(5):
+        scenario.add_step(
+            "get",
+            url_fetch,
+            "",
+            status_code=500,
+            headers={"Content-Type": "application/gzip"},
+        )
 
     scenario.install_mock(requests_mock)
 
@@ -402,6 +410,9 @@ def test_vault_fetch_failed(requests_mock, mocker, mocked_time):
     assert result.output == (
         f"VAULT CRITICAL - cooking directory {DIR_ID} took "
         f"10.00s and succeeded, but fetch failed with status code 500.\n"
+        f"| 'http_backoff_time' = 1111.00s\n"
+        f"| 'http_retries' = 4\n"
+        f"| 'http_throttled' = 0\n"
         f"| 'total_time' = 10.00s\n"
     )
     assert result.exit_code == 2, result.output
@@ -601,3 +612,281 @@ def test_vault_no_fetch_url(requests_mock, mocker, mocked_time):
         f"| 'total_time' = 10.00s\n"
     )
     assert result.exit_code == 2, result.output
+
+
+def test_vault_preflight_failed(requests_mock, mocker, mocked_time, tmp_path):
+    requests_mock.head("mock://swh-web.example.org/", text="")
+    requests_mock.head("mock://storage.example.org/", status_code=503)
+    requests_mock.head(
+        "mock://swh-web-redirected.example.org/",
+        exc=requests.exceptions.ConnectionError("connection refused"),
+    )
+    (tmp_path / "vault.json").write_text(
+        json.dumps({"fetch_root_url": "mock://swh-web-redirected.example.org/"})
+    )
+
+    get_storage_mock = mocker.patch("swh.icinga_plugins.vault.get_storage")
+    get_storage_mock.side_effect = FakeStorage
+
+    result = invoke(
+        [
+            "--state-directory",
+            str(tmp_path),
+            "--preflight",
+            "check-vault",
+            "--swh-web-url",
+            "mock://swh-web.example.org",
+            "--swh-storage-url",
+            "mock://storage.example.org/",
+            "directory",
+        ],
+        catch_exceptions=True,
+    )
+
+    assert result.output == (
+        "VAULT CRITICAL - Pre-flight probe of "
+        "storage (mock://storage.example.org/) failed with status code 503; "
+        "fetch (mock://swh-web-redirected.example.org/) failed with "
+        "connection refused.\n"
+        "| 'preflight_time' = 0.00s\n"
+    )
+    assert result.exit_code == 2, result.output
+    # the scenario did not start
+    assert {request.method for request in requests_mock.request_history} == {"HEAD"}
+
+
+def test_vault_resume(requests_mock, mocker, mocked_time, tmp_path):
+    checkpoint_path = tmp_path / "checkpoint-default-vault.json"
+    checkpoint_path.write_text(
+        json.dumps({"dir_id": DIR_ID, "start_time": time.time() - 100})
+    )
+
+    scenario = WebScenario()
+
+    # no new directory is picked nor cooked
+    scenario.add_step("get", url_api, response_pending)
+    scenario.add_step("get", url_api, response_done)
+    scenario.add_step(
+        "get", url_fetch, TARBALL, headers={"Content-Type": "application/gzip"}
+    )
+
+    scenario.install_mock(requests_mock)
+
+    get_storage_mock = mocker.patch("swh.icinga_plugins.vault.get_storage")
+    get_storage_mock.side_effect = FakeStorage
+
+    result = invoke(
+        [
+            "--state-directory",
+            str(tmp_path),
+            "check-vault",
+            "--swh-web-url",
+            "mock://swh-web.example.org",
+            "--swh-storage-url",
+            "foo://example.org",
+            "directory",
+        ]
+    )
+
+    assert result.output.startswith(
+        f"VAULT OK - cooking directory {DIR_ID} took 110.00s and succeeded.\n"
+    )
+    assert result.exit_code == 0, result.output
+    assert not checkpoint_path.exists()
+
+
+def test_vault_resume_expired(requests_mock, mocker, mocked_time, tmp_path):
+    checkpoint_path = tmp_path / "checkpoint-default-vault.json"
+    checkpoint_path.write_text(
+        json.dumps({"dir_id": "cd" * 20, "start_time": time.time() - 100})
+    )
+
+    scenario = WebScenario()
+
+    # the cooking of the checkpoint is gone, a new one is started
+    scenario.add_step(
+        "get",
+        f"mock://swh-web.example.org/api/1/vault/directory/{'cd' * 20}/",
+        {},
+        status_code=404,
+    )
+    scenario.add_step("get", url_api, {}, status_code=404)
+    scenario.add_step("post", url_api, response_pending)
+    scenario.add_step("get", url_api, response_done)
+    scenario.add_step(
+        "get", url_fetch, TARBALL, headers={"Content-Type": "application/gzip"}
+    )
+
+    scenario.install_mock(requests_mock)
+
+    get_storage_mock = mocker.patch("swh.icinga_plugins.vault.get_storage")
+    get_storage_mock.side_effect = FakeStorage
+
+    result = invoke(
+        [
+            "--state-directory",
+            str(tmp_path),
+            "check-vault",
+            "--swh-web-url",
+            "mock://swh-web.example.org",
+            "--swh-storage-url",
+            "foo://example.org",
+            "directory",
+        ]
+    )
+
+    assert result.output.startswith(
+        f"VAULT OK - cooking directory {DIR_ID} took 10.00s and succeeded.\n"
+    )
+    assert result.exit_code == 0, result.output
+    assert not checkpoint_path.exists()
+
+
+def test_vault_standard_perfdata(requests_mock, mocker, mocked_time):
+    scenario = WebScenario()
+
+    scenario.add_step("get", url_api, {}, status_code=404)
+    scenario.add_step("post", url_api, response_pending)
+    scenario.add_step("get", url_api, response_pending)
+    scenario.add_step("get", url_api, response_done)
+    scenario.add_step(
+        "get", url_fetch, TARBALL, headers={"Content-Type": "application/gzip"}
+    )
+
+    scenario.install_mock(requests_mock)
+
+    get_storage_mock = mocker.patch("swh.icinga_plugins.vault.get_storage")
+    get_storage_mock.side_effect = FakeStorage
+
+    result = invoke(
+        [
+            "--perfdata-format",
+            "standard",
+            "-w",
+            "30",
+            "check-vault",
+            "--swh-web-url",
+            "mock://swh-web.example.org",
+            "--swh-storage-url",
+            "foo://example.org",
+            "directory",
+        ]
+    )
+
+    assert result.exit_code == 0, result.output
+    (line,) = result.output.splitlines()
+    (message, perfdata) = line.split(" | ")
+    assert (
+        message == f"VAULT OK - cooking directory {DIR_ID} took 20.00s and succeeded."
+    )
+    perfdata = perfdata.split()
+    assert perfdata[:4] == [
+        "total_time=20s;30;3600;0",
+        "phase_pick_time=0s;;;0",
+        "phase_cook_time=20s;;;0",
+        "phase_fetch_time=0s;;;0",
+    ]
+    labels = [item.split("=")[0] for item in perfdata]
+    assert labels[4:] == [
+        "usage_http_requests",
+        "usage_http_sent",
+        "usage_http_received",
+        "usage_polls",
+        "usage_cpu_user",
+        "usage_cpu_system",
+        "usage_max_rss",
+    ]
+    assert "usage_http_requests=5;;;0" in perfdata
+    assert "usage_polls=2;;;0" in perfdata
+
+
+def test_vault_json_output(requests_mock, mocker, mocked_time, tmp_path):
+    scenario = WebScenario()
+
+    scenario.add_step("get", url_api, {}, status_code=404)
+    scenario.add_step("post", url_api, response_pending)
+    scenario.add_step("get", url_api, response_failed)
+
+    scenario.install_mock(requests_mock)
+
+    get_storage_mock = mocker.patch("swh.icinga_plugins.vault.get_storage")
+    get_storage_mock.side_effect = FakeStorage
+
+    result = invoke(
+        [
+            "--output",
+            "json",
+            "--output-spool-directory",
+            str(tmp_path),
+            "check-vault",
+            "--swh-web-url",
+            "mock://swh-web.example.org",
+            "--swh-storage-url",
+            "foo://example.org",
+            "directory",
+        ],
+        catch_exceptions=True,
+    )
+
+    assert result.exit_code == 2, result.output
+    (line,) = result.output.splitlines()
+    document = json.loads(line)
+    assert {
+        key: document[key]
+        for key in (
+            "check",
+            "application",
+            "status",
+            "status_code",
+            "identifiers",
+            "metrics",
+            "thresholds",
+            "phases",
+            "error",
+        )
+    } == {
+        "check": "VAULT",
+        "application": "vault",
+        "status": "CRITICAL",
+        "status_code": 2,
+        "identifiers": {"dir_id": DIR_ID},
+        "metrics": {"total_time": 10.0},
+        "thresholds": {"total_time": {"warning": None, "critical": 3600}},
+        "phases": {"pick": 0.0, "cook": 10.0},
+        "error": {
+            "message": f"cooking directory {DIR_ID} took 10.00s and failed with: "
+            "foobar",
+            "exception": None,
+        },
+    }
+    assert document["http"]["requests"] == 3
+    assert document["http"]["retries"] == 0
+    assert document["usage"]["polls"] == 1
+    assert set(document["usage"]) == {"polls", "cpu_user", "cpu_system", "max_rss"}
+
+    # the same document is spooled
+    (spooled,) = tmp_path.iterdir()
+    assert spooled.name.startswith("vault-20220304T170249Z-")
+    assert json.loads(spooled.read_text()) == document
+
+
+def test_vault_storage_timeout(mocker, mocked_time):
+    """Storage requests time out when the deadline of the check expires"""
+    mocker.patch("swh.icinga_plugins.vault.get_storage", side_effect=FakeStorage)
+    # the deadline is measured with the monotonic clock, which follows the
+    # mocked time here
+    mocker.patch("time.monotonic", side_effect=time.time)
+    check = VaultCheck(
+        {
+            "swh_storage_url": "foo://example.org",
+            "swh_web_url": "mock://swh-web.example.org",
+            "poll_interval": 10,
+            "deadline": 100,
+        }
+    )
+
+    check._pick_directory()
+    time.sleep(40)
+    check._pick_directory()
+
+    assert [read for (_, read) in check._swh_storage.call_timeouts] == [100, 60]
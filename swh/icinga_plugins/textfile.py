@@ -0,0 +1,123 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Prometheus textfiles shared by concurrent runs of checks.
+
+Each run merges its series into the textfile of its application instead of
+overwriting it, under an advisory lock. The last time each series was written
+is kept in a sidecar file, so series no run updated for a while (eg. of a
+check which is not run anymore) expire instead of being exported forever.
+"""
+
+import json
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from prometheus_client import CollectorRegistry, generate_latest
+from prometheus_client.metrics_core import Metric
+from prometheus_client.parser import text_string_to_metric_families
+from prometheus_client.samples import Sample
+
+from .state import load_json, lock_file, save_json, save_text
+
+DEFAULT_MAX_AGE = 24 * 3600
+
+
+def _series_key(family: Metric, sample: Sample) -> str:
+    return json.dumps([family.name, sample.name, sorted(sample.labels.items())])
+
+
+class _Families:
+    """Collector of a fixed list of metric families"""
+
+    def __init__(self, families: Iterable[Metric]):
+        self.families = list(families)
+
+    def collect(self) -> Iterable[Metric]:
+        return self.families
+
+
+def _read_families(path: str) -> List[Metric]:
+    try:
+        with open(path) as fd:
+            return list(text_string_to_metric_families(fd.read()))
+    except (FileNotFoundError, ValueError):
+        # a corrupt textfile is replaced
+        return []
+
+
+def merge_textfile(
+    path: str,
+    registry: CollectorRegistry,
+    labels: Optional[Dict[str, str]] = None,
+    max_age: float = DEFAULT_MAX_AGE,
+) -> None:
+    """Merges the series of ``registry`` into the textfile at ``path``.
+
+    ``labels`` are added to all series of ``registry`` which do not have them
+    already, and identify the writer of the series (eg. an instance of a
+    check): all series of the textfile with these ``labels`` are replaced by
+    those of ``registry``, so series this run did not write (eg. with the
+    status of a previous failure) are not exported anymore. Series of other
+    writers are kept unless they are older than ``max_age`` seconds.
+
+    The textfile is replaced atomically, so the node exporter never reads a
+    partially written file."""
+    labels = labels or {}
+    now = time.time()
+    with lock_file(path + ".lock"):
+        ages_path = path + ".ages.json"
+        ages = load_json(ages_path)
+        families: Dict[Tuple[str, str], Metric] = {}
+        new_ages: Dict[str, float] = {}
+
+        # parsed from the text format like the textfile, so both have the
+        # same families (eg. with separate families for _created samples)
+        for family in text_string_to_metric_families(
+            generate_latest(registry).decode()
+        ):
+            merged = Metric(family.name, family.documentation, family.type, family.unit)
+            for sample in family.samples:
+                sample = sample._replace(labels={**labels, **sample.labels})
+                merged.samples.append(sample)
+                new_ages[_series_key(merged, sample)] = now
+            families[(family.name, family.type)] = merged
+
+        for family in _read_families(path):
+            merged = families.setdefault(
+                (family.name, family.type),
+                Metric(family.name, family.documentation, family.type, family.unit),
+            )
+            for sample in family.samples:
+                if labels and labels.items() <= sample.labels.items():
+                    # written by a previous run of the same writer
+                    continue
+                key = _series_key(merged, sample)
+                # series of textfiles written before ages were kept expire
+                # as if they had just been written
+                age = now - ages.get(key, now)
+                if key in new_ages or age > max_age:
+                    continue
+                merged.samples.append(sample)
+                new_ages[key] = now - age
+
+        for family in families.values():
+            # the stable sort keeps the buckets, count and sum of each series of
+            # histograms and summaries together and in order
+            family.samples.sort(
+                key=lambda sample: sorted(
+                    (name, value)
+                    for (name, value) in sample.labels.items()
+                    if name not in ("le", "quantile")
+                )
+            )
+        output = CollectorRegistry(auto_describe=False)
+        output.register(
+            _Families(
+                family for (_, family) in sorted(families.items()) if family.samples
+            )
+        )
+        save_text(path, generate_latest(output).decode())
+        save_json(ages_path, new_ages)
@@ -0,0 +1,205 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Breakdown of the latency of HTTP requests into network and server phases.
+
+:class:`TimingAdapter` is a :class:`requests.adapters.HTTPAdapter` whose
+connections measure DNS resolution, TCP connection and TLS handshake, and
+which measures the time to the first byte of the response and the transfer
+of its body. ``Server-Timing`` headers of responses are parsed too, so the
+time spent in each component of the server can be told apart.
+"""
+
+import dataclasses
+import re
+import socket
+import threading
+import time
+from typing import Callable, Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+PHASES = ("dns", "connect", "tls", "ttfb", "transfer")
+
+ENDPOINT_RULES = [
+    # origin URLs are not encoded in swh-web API URLs
+    (re.compile(r"(/origin/save/[^/]+/url/).+"), r"\1{origin}/"),
+    (re.compile(r"(/origin/).+(/visit/)"), r"\1{origin}\2"),
+    (
+        re.compile(r"(?<=/)(swh:1:\w+:)?([0-9a-f]{8,}|[0-9a-f-]{36}|\d{2,})(?=/|$)"),
+        "{id}",
+    ),
+]
+"""Rules rewriting the paths of URLs into endpoint templates"""
+
+
+def endpoint_template(url: str) -> str:
+    """Returns the endpoint of ``url``: its host and its path, where the
+    identifiers of objects are replaced by placeholders, eg.
+    ``swh-web.example.org/api/1/vault/directory/{id}/``"""
+    parts = urlsplit(url)
+    path = parts.path
+    for pattern, replacement in ENDPOINT_RULES:
+        path = pattern.sub(replacement, path)
+    return parts.netloc + path
+
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    """Returns the duration (in seconds) of each metric of a ``Server-Timing``
+    header which has one."""
+    durations: Dict[str, float] = {}
+    for metric in header.split(","):
+        (name, *params) = [param.strip() for param in metric.split(";")]
+        for param in params:
+            (key, _, value) = param.partition("=")
+            if name and key.strip().lower() == "dur":
+                try:
+                    durations[name] = float(value.strip().strip('"')) / 1000
+                except ValueError:
+                    pass
+    return durations
+
+
+@dataclasses.dataclass
+class RequestTiming:
+    """Duration (in seconds) of each phase of an HTTP request.
+
+    The connection phases are null when the connection was reused, and the
+    transfer is not measured for streamed responses, whose body is read by
+    the caller."""
+
+    method: str
+    endpoint: str
+    status_code: Optional[int] = None
+    dns: float = 0.0
+    connect: float = 0.0
+    tls: float = 0.0
+    ttfb: float = 0.0
+    """From the end of the connection to the end of the response headers"""
+    transfer: Optional[float] = None
+    server_timing: Dict[str, float] = dataclasses.field(default_factory=dict)
+
+    def phases(self) -> Dict[str, float]:
+        phases = {phase: getattr(self, phase) for phase in PHASES}
+        return {phase: value for (phase, value) in phases.items() if value is not None}
+
+
+_current = threading.local()
+"""Timing of the request sent by the thread, filled by its connection"""
+
+
+class _TimedConnectionMixin:
+    _dns_host: str
+    port: int
+
+    def _new_conn(self) -> socket.socket:
+        timing: Optional[RequestTiming] = getattr(_current, "timing", None)
+        if timing is None:
+            return super()._new_conn()  # type: ignore[misc]
+
+        start = time.monotonic()
+        try:
+            addresses = socket.getaddrinfo(
+                self._dns_host, self.port, 0, socket.SOCK_STREAM
+            )
+        except OSError:
+            # let urllib3 report the resolution error
+            addresses = []
+        timing.dns += time.monotonic() - start
+
+        start = time.monotonic()
+        host = self._dns_host
+        try:
+            if not addresses:
+                return super()._new_conn()  # type: ignore[misc]
+            # connect to the resolved addresses in turn, like urllib3 does
+            error: Optional[Exception] = None
+            for *_, sockaddr in addresses:
+                self._dns_host = str(sockaddr[0])
+                try:
+                    return super()._new_conn()  # type: ignore[misc]
+                except (NewConnectionError, ConnectTimeoutError) as e:
+                    error = e
+            assert error is not None
+            raise error
+        finally:
+            self._dns_host = host
+            timing.connect += time.monotonic() - start
+
+
+class TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    def connect(self) -> None:
+        timing: Optional[RequestTiming] = getattr(_current, "timing", None)
+        if timing is None:
+            return super().connect()
+        start = time.monotonic()
+        socket_time = timing.dns + timing.connect
+        super().connect()
+        # the rest of the time is spent in the TLS handshake
+        socket_time = timing.dns + timing.connect - socket_time
+        timing.tls += max(0.0, time.monotonic() - start - socket_time)
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimingAdapter(HTTPAdapter):
+    """HTTP adapter calling ``on_timing`` with the :class:`RequestTiming` of
+    each request it sends (including each redirection), once its response is
+    received."""
+
+    def __init__(self, on_timing: Callable[[RequestTiming], None], **kwargs):
+        self.on_timing = on_timing
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
+
+    def send(
+        self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None
+    ) -> requests.Response:
+        timing = RequestTiming(
+            method=request.method, endpoint=endpoint_template(request.url)
+        )
+        _current.timing = timing
+        start = time.monotonic()
+        try:
+            response = super().send(request, stream, timeout, verify, cert, proxies)
+        finally:
+            _current.timing = None
+        timing.ttfb = max(
+            0.0,
+            time.monotonic() - start - timing.dns - timing.connect - timing.tls,
+        )
+        timing.status_code = response.status_code
+        timing.server_timing = parse_server_timing(
+            response.headers.get("Server-Timing", "")
+        )
+
+        if not stream:
+            # the session reads it right after anyway
+            start = time.monotonic()
+            response.content
+            timing.transfer = time.monotonic() - start
+        self.on_timing(timing)
+        return response
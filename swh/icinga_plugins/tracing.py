@@ -0,0 +1,257 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Traces of the runs of checks, as trees of spans.
+
+Each run has a root span, with a child span for each phase of its scenario
+(eg. cooking, then fetching a bundle), which are the parents of the spans of
+the HTTP requests sent during the phase. Traces are exported in the JSON
+encoding of the OpenTelemetry protocol (OTLP), either appended to a file (one
+trace per line, like the OpenTelemetry collector file exporter) or posted to
+the ``/v1/traces`` endpoint of a collector.
+"""
+
+import contextlib
+import dataclasses
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+SCOPE = "swh.icinga_plugins"
+
+# OTLP span kinds and status codes
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CLIENT = 3
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+EXPORT_TIMEOUT = 5.0
+
+
+def _now_ns() -> int:
+    return int(time.time() * 1e9)
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    elif isinstance(value, int):
+        return {"intValue": str(value)}
+    elif isinstance(value, float):
+        return {"doubleValue": value}
+    else:
+        return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [
+        {"key": key, "value": _otlp_value(value)}
+        for (key, value) in attributes.items()
+        if value is not None
+    ]
+
+
+@dataclasses.dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_span_id: Optional[str]
+    kind: int = SPAN_KIND_INTERNAL
+    start_time: int = dataclasses.field(default_factory=_now_ns)
+    """In nanoseconds since the epoch"""
+    end_time: Optional[int] = None
+    attributes: Dict[str, Any] = dataclasses.field(default_factory=dict)
+    events: List[Dict[str, Any]] = dataclasses.field(default_factory=list)
+    status: int = STATUS_UNSET
+    status_message: str = ""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes: Any) -> None:
+        self.events.append({"name": name, "time": _now_ns(), "attributes": attributes})
+
+    def set_error(self, message: str) -> None:
+        self.status = STATUS_ERROR
+        self.status_message = message
+
+    def end(self) -> None:
+        if self.end_time is None:
+            self.end_time = _now_ns()
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span: Dict[str, Any] = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_time),
+            "endTimeUnixNano": str(
+                self.end_time if self.end_time is not None else _now_ns()
+            ),
+            "attributes": _otlp_attributes(self.attributes),
+            "events": [
+                {
+                    "name": event["name"],
+                    "timeUnixNano": str(event["time"]),
+                    "attributes": _otlp_attributes(event["attributes"]),
+                }
+                for event in self.events
+            ],
+            "status": {"code": self.status},
+        }
+        if self.parent_span_id is not None:
+            span["parentSpanId"] = self.parent_span_id
+        if self.status_message:
+            span["status"]["message"] = self.status_message
+        return span
+
+
+class Tracer:
+    """Records the spans of a trace.
+
+    The first span is the root span. The parent of a new span is the innermost
+    span opened by :meth:`span` in the same thread, or else the current phase,
+    or else the root span, so spans of requests sent by worker threads are
+    attached to the phase."""
+
+    def __init__(self, resource: Optional[Dict[str, Any]] = None):
+        self.resource = resource or {}
+        self.trace_id = os.urandom(16).hex()
+        self.spans: List[Span] = []
+        self.root: Optional[Span] = None
+        self.phase: Optional[Span] = None
+        self.phases: List[Span] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self) -> List[Span]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @property
+    def current(self) -> Optional[Span]:
+        stack = self._stack()
+        if stack and stack[-1] is not self.root:
+            return stack[-1]
+        return self.phase or self.root
+
+    def start_span(
+        self,
+        name: str,
+        kind: int = SPAN_KIND_INTERNAL,
+        attributes: Optional[Dict[str, Any]] = None,
+    ) -> Span:
+        parent = self.current
+        span = Span(
+            name=name,
+            trace_id=self.trace_id,
+            span_id=os.urandom(8).hex(),
+            parent_span_id=parent.span_id if parent is not None else None,
+            kind=kind,
+            attributes=dict(attributes or {}),
+        )
+        with self._lock:
+            self.spans.append(span)
+            if self.root is None:
+                self.root = span
+        return span
+
+    @contextlib.contextmanager
+    def span(
+        self,
+        name: str,
+        kind: int = SPAN_KIND_INTERNAL,
+        attributes: Optional[Dict[str, Any]] = None,
+    ) -> Iterator[Span]:
+        """Opens a span for the duration of the block, marking it as failed if
+        the block raises an exception"""
+        span = self.start_span(name, kind, attributes)
+        stack = self._stack()
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set_error(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            stack.pop()
+            span.end()
+
+    def start_phase(self, name: str) -> None:
+        """Ends the current phase of the scenario, if any, and starts a new one"""
+        self.end_phase()
+        self.phase = self.start_span(name)
+        with self._lock:
+            self.phases.append(self.phase)
+
+    def end_phase(self) -> None:
+        if self.phase is not None:
+            self.phase.end()
+            self.phase = None
+
+    def phase_durations(self) -> Dict[str, float]:
+        """Returns the total duration (in seconds) of each phase so far, in the
+        order they started"""
+        now = _now_ns()
+        durations: Dict[str, float] = {}
+        with self._lock:
+            phases = list(self.phases)
+        for phase in phases:
+            end_time = phase.end_time if phase.end_time is not None else now
+            durations[phase.name] = (
+                durations.get(phase.name, 0.0) + (end_time - phase.start_time) / 1e9
+            )
+        return durations
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """Returns the trace in the OTLP JSON encoding"""
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": _otlp_attributes(self.resource)},
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": SCOPE},
+                            "spans": [span.to_otlp() for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+
+    def export(
+        self, path: Optional[str] = None, endpoint: Optional[str] = None
+    ) -> None:
+        """Appends the trace as a JSON line to the file at ``path``, and posts
+        it to the OTLP/HTTP ``endpoint`` of a collector (eg.
+        ``http://localhost:4318/v1/traces``). Failures to export are logged
+        but do not fail the check."""
+        document = self.to_otlp()
+        if path is not None:
+            # a single write in append mode, so lines of concurrent runs
+            # are not interleaved
+            with open(path, "a") as fd:
+                fd.write(json.dumps(document) + "\n")
+        if endpoint is not None:
+            try:
+                # not a session of the check, so the export is not traced
+                requests.post(
+                    endpoint, json=document, timeout=EXPORT_TIMEOUT
+                ).raise_for_status()
+            except requests.RequestException as e:
+                logger.warning("Could not export the trace to %s: %s", endpoint, e)
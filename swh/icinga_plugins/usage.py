@@ -0,0 +1,61 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Resources used by the runs of checks, to size the hosts running them."""
+
+import dataclasses
+import resource
+import sys
+import threading
+
+
+@dataclasses.dataclass
+class UsageStats:
+    """Counts of the work done by a run of a check, shared by its HTTP sessions
+    and by the checks it runs (eg. in threads of :class:`MultiDepositCheck`)."""
+
+    http_requests: int = 0
+    """Number of HTTP requests sent, including retries and redirections"""
+    http_bytes_sent: int = 0
+    """Size of the HTTP requests sent (headers and bodies)"""
+    http_bytes_received: int = 0
+    """Size of the HTTP responses received (headers and bodies, as read from
+    the connections, so before decompression)"""
+    polls: int = 0
+    """Number of times the check waited before polling a status again"""
+    _lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+
+    def add(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+
+@dataclasses.dataclass
+class ResourceUsage:
+    """Resources used by the process, from :func:`resource.getrusage`."""
+
+    cpu_user: float
+    """In seconds"""
+    cpu_system: float
+    """In seconds"""
+    max_rss: int
+    """Maximum resident set size of the process over its lifetime, in bytes"""
+
+    @classmethod
+    def current(cls) -> "ResourceUsage":
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        # ru_maxrss is in kilobytes, except on macOS
+        factor = 1 if sys.platform == "darwin" else 1024
+        return cls(usage.ru_utime, usage.ru_stime, usage.ru_maxrss * factor)
+
+    def since(self, start: "ResourceUsage") -> "ResourceUsage":
+        """Returns the CPU times used since ``start``, and the maximum RSS"""
+        return ResourceUsage(
+            self.cpu_user - start.cpu_user,
+            self.cpu_system - start.cpu_system,
+            self.max_rss,
+        )
@@ -6,13 +6,16 @@
 import sys
 import tarfile
 import time
-from typing import List
+from typing import Any, Dict, List, Optional, Tuple
 
 import requests
 
 from swh.storage import get_storage
 
-from .base_check import BaseCheck
+from .base_check import BaseCheck, PreflightProbe
+from .http_client import root_url
+
+VAULT_STATE = "vault"
 
 
 class NoDirectory(Exception):
@@ -23,20 +26,37 @@ class VaultCheck(BaseCheck):
     TYPE = "VAULT"
     DEFAULT_WARNING_THRESHOLD = 0
     DEFAULT_CRITICAL_THRESHOLD = 3600
+    DURATION_BUCKETS = (10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400)
 
     def __init__(self, obj):
         super().__init__(obj, application="vault")
+        # its timeout is set before each call, from the remaining time
         self._swh_storage = get_storage("remote", url=obj["swh_storage_url"])
+        self._swh_storage_url = obj["swh_storage_url"]
         self._swh_web_url = obj["swh_web_url"]
         self._poll_interval = obj["poll_interval"]
 
         self.register_prometheus_gauge("status", "")
-        self.register_prometheus_gauge("duration", "seconds", ["step", "status"])
+        self.register_prometheus_gauge(
+            "duration", "seconds", ["step", "status"], buckets=self.DURATION_BUCKETS
+        )
+
+    def preflight_probes(self) -> List[PreflightProbe]:
+        probes = [
+            PreflightProbe("swh-web", self._swh_web_url.rstrip("/") + "/"),
+            PreflightProbe("storage", self._swh_storage_url),
+        ]
+        # The host bundles are fetched from, as seen in the previous run
+        fetch_root_url = self.load_state(VAULT_STATE).get("fetch_root_url")
+        if fetch_root_url and fetch_root_url != root_url(self._swh_web_url):
+            probes.append(PreflightProbe("fetch", fetch_root_url))
+        return probes
 
     def _url_for_dir(self, dir_id):
         return self._swh_web_url + f"/api/1/vault/directory/{dir_id.hex()}/"
 
     def _pick_directory(self):
+        self._swh_storage.timeout = self.session.timeout()
         dir_ = self._swh_storage.directory_get_random()
         if dir_ is None:
             raise NoDirectory()
@@ -45,7 +65,7 @@ class VaultCheck(BaseCheck):
     def _pick_uncached_directory(self):
         while True:
             dir_id = self._pick_directory()
-            response = requests.get(self._url_for_dir(dir_id))
+            response = self.session.get(self._url_for_dir(dir_id))
             if response.status_code == 404:
                 return dir_id
 
@@ -59,27 +79,55 @@ class VaultCheck(BaseCheck):
             labels,
         )
 
+    def _resume_cooking(self) -> Optional[Tuple[bytes, float, Dict[str, Any]]]:
+        """Returns the directory, start time and current status of the cooking
+        started by a previous interrupted run, if it can be resumed."""
+        checkpoint = self.load_checkpoint()
+        if checkpoint is None:
+            return None
+        dir_id = bytes.fromhex(checkpoint["dir_id"])
+        response = self.session.get(self._url_for_dir(dir_id))
+        if response.status_code != 200:
+            # eg. the cooking was garbage-collected, start a new one
+            self.clear_checkpoint()
+            return None
+        return (dir_id, checkpoint["start_time"], response.json())
+
     def main(self):
-        try:
-            dir_id = self._pick_uncached_directory()
-        except NoDirectory:
-            self.print_result("CRITICAL", "No directory exists in the archive.")
-            return 2
+        resumed = self._resume_cooking()
+        if resumed is not None:
+            self.start_phase("cook")
+            (dir_id, start_time, result) = resumed
+            self.identifiers["dir_id"] = dir_id.hex()
+            total_time = time.time() - start_time
+        else:
+            self.start_phase("pick")
+            try:
+                dir_id = self._pick_uncached_directory()
+            except NoDirectory:
+                self.print_result("CRITICAL", "No directory exists in the archive.")
+                return 2
 
-        start_time = time.time()
-        total_time = 0
-        response = requests.post(self._url_for_dir(dir_id))
-        assert response.status_code == 200, (response, response.text)
-        result = response.json()
+            self.identifiers["dir_id"] = dir_id.hex()
+            self.start_phase("cook")
+            start_time = time.time()
+            total_time = 0.0
+            response = self.session.post(self._url_for_dir(dir_id))
+            assert response.status_code == 200, (response, response.text)
+            result = response.json()
+            self.save_checkpoint({"dir_id": dir_id.hex(), "start_time": start_time})
         while result["status"] in ("new", "pending"):
+            self.report_progress(result["status"])
+            self.usage.add("polls")
             time.sleep(self._poll_interval)
-            response = requests.get(self._url_for_dir(dir_id))
+            response = self.session.get(self._url_for_dir(dir_id))
             assert response.status_code == 200, (response, response.text)
             result = response.json()
 
             total_time = time.time() - start_time
 
             if total_time > self.critical_threshold:
+                self.clear_checkpoint()
                 self.print_result(
                     "CRITICAL",
                     f"cooking directory {dir_id.hex()} took more than "
@@ -92,6 +140,7 @@ class VaultCheck(BaseCheck):
 
                 return 2
 
+        self.clear_checkpoint()
         if result["status"] == "failed":
             self.print_result(
                 "CRITICAL",
@@ -126,7 +175,10 @@ class VaultCheck(BaseCheck):
             self._collect_prometheus_metrics(2, total_time, ["fetch", "no_url"])
             return 2
 
-        with requests.get(result["fetch_url"], stream=True) as fetch_response:
+        self.report_progress("fetch")
+        self.start_phase("fetch")
+        self.save_state(VAULT_STATE, {"fetch_root_url": root_url(result["fetch_url"])})
+        with self.session.get(result["fetch_url"], stream=True) as fetch_response:
             try:
                 fetch_response.raise_for_status()
             except requests.HTTPError: